@@ -33,6 +33,7 @@ import netifaces
 
 # in this repo
 from TelemXnet import clienthub
+from TelemXnet import unipacket
 
 
 def ip4_addresses():
@@ -53,8 +54,30 @@ if __name__ == '__main__':
     parser.add_argument("--localport", help="Local port to listen on", type=int, default=14650)
     parser.add_argument("--localonly", help="Use localhost only", action="store_true")
     parser.add_argument("--mode", help="uas or gcs side", default='gcs')
+    parser.add_argument("--check", help="Packet integrity check (sha256, crc32, blake2s or hmac)",
+                        choices=list(unipacket.CHECK_NAMES), default='sha256')
+    parser.add_argument("--key", help="Shared secret for the hmac integrity check", default=None)
+    parser.add_argument("--coalesce", help="Pack local datagrams together, waiting up to this many ms",
+                        type=float, default=0)
+    parser.add_argument("--compress", help="Compress data packets", action="store_true")
+    parser.add_argument("--zdict", help="Preset dictionary file for compression (see tools/zdictbuild.py)",
+                        default=None)
+    parser.add_argument("--engine", help="threaded (polling) or selector (single event loop)", default='threaded')
+    parser.add_argument("--max-queue", help="Max packets queued per interface, each way", type=int, default=256)
+    parser.add_argument("--queue-policy", help="Packet dropped from a full queue: oldest, newest or age (expired, then oldest)",
+                        default='oldest')
+    parser.add_argument("--max-age", help="Drop queued packets older than this many ms", type=float, default=None)
+    parser.add_argument("--link-policy", help="Interfaces each data packet is sent on: all, best, besttwo, degraded "
+                        "(best, or all if it's degraded) or priority (in order, until a healthy one)", default='all')
+    parser.add_argument("--probe-interval", help="Measure each interface's RTT and loss with a probe every this many ms "
+                        "(0 for none)", type=float, default=1000)
     args = parser.parse_args()
 
+    # check the integrity check key
+    if args.check == 'hmac' and not args.key:
+        print("Error - hmac integrity check requires a key")
+        sys.exit(0)
+
     # check the network ID
     if len(args.netid) != 32:
         print("Error - Invalid network ID")
@@ -72,7 +95,18 @@ if __name__ == '__main__':
         sys.exit(0)
     remoteserver = (args.remote.split(':')[0], int(args.remote.split(':')[1]))
 
-    client = clienthub.Clienthub(("127.0.0.1", args.localport), remoteserver, args.netid.encode("utf8"), base_id)
+    key = args.key.encode("utf8") if args.key else None
+
+    # load the compression dictionary
+    zdict = None
+    if args.zdict:
+        with open(args.zdict, 'rb') as f:
+            zdict = f.read()
+    client = clienthub.Clienthub(("127.0.0.1", args.localport), remoteserver, args.netid.encode("utf8"), base_id,
+                                 unipacket.CHECK_NAMES[args.check], key, args.coalesce / 1000,
+                                 args.compress, zdict, args.engine, args.max_queue, args.queue_policy,
+                                 args.max_age / 1000 if args.max_age else None, args.link_policy,
+                                 args.probe_interval / 1000)
     # print("Started Client")
 
     # check for interfaces to add
@@ -89,14 +123,24 @@ if __name__ == '__main__':
     client.start()
     # print("Started Client2")
 
-    # while waiting for a ctrl+c, ping the server every 1 sec
+    # while waiting for a ctrl+c, show the link stats (or ping the server if not probing) every 1 sec
     try:
         while True:
             time.sleep(1)
-            p_ret = client.pinginterfaces()
-            for dv in p_ret:
-                i_d, iface, ptime = dv.split(',')
-                print("Device " + str(i_d) + " (" + str(iface) + ") ping is " + str(ptime) + "ms")
+            if not args.probe_interval:
+                p_ret = client.pinginterfaces()
+                for dv in p_ret:
+                    i_d, iface, ptime = dv.split(',')
+                    print("Device " + str(i_d) + " (" + str(iface) + ") ping is " + str(ptime) + "ms")
+                continue
+            for link in client.getlinkstats():
+                if link['rtt'] is None:
+                    print("Device " + str(link['devid']) + " (" + link['iface'] + ") no response, " +
+                          str(link['lost']) + "/" + str(link['probes']) + " probes lost")
+                else:
+                    print("Device " + str(link['devid']) + " (" + link['iface'] + ") RTT is " +
+                          str(round(link['rtt'], 1)) + "ms, jitter " + str(round(link['jitter'], 1)) + "ms, loss " +
+                          str(round(link['loss'] * 100)) + "%")
     except KeyboardInterrupt:
         pass
 
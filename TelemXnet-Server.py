@@ -33,15 +33,76 @@ import netifaces
 
 # in this repo
 from TelemXnet import serverhub
+from TelemXnet import unipacket
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--ip", help="The IP of the network adapter to run on", default="127.0.0.1")
     parser.add_argument("--port", help="The server port", type=int, default=16250)
+    parser.add_argument("--checks", help="Comma separated list of allowed packet integrity checks "
+                        "(sha256, crc32, blake2s, hmac). Default is hmac with --key, otherwise the others", default=None)
+    parser.add_argument("--key", help="Shared secret for the hmac integrity check", default=None)
+    parser.add_argument("--verify", help="Which packets to verify before forwarding",
+                        choices=['all', 'sample', 'control'], default='all')
+    parser.add_argument("--sample-rate", help="Verify 1 in this many data packets, for --verify=sample",
+                        type=int, default=100)
+    parser.add_argument("--engine", help="Handle packets in a thread each (threaded), on one event loop (asyncio) "
+                        "or in batches with recvmmsg/sendmmsg (batched)",
+                        choices=['threaded', 'asyncio', 'batched'], default='threaded')
+    parser.add_argument("--workers", help="Number of worker processes, sharing the port via SO_REUSEPORT",
+                        type=int, default=1)
+    parser.add_argument("--max-networks", help="Max number of networks, for --workers > 1",
+                        type=int, default=1024)
+    parser.add_argument("--route-timeout", help="Remove devices that haven't sent a packet for this many seconds. "
+                        "Default is never", type=float, default=None)
+    parser.add_argument("--copies", help="Forward only the first N copies of each packet, when the sender has "
+                        "several links. Default is all", type=int, default=None)
+    parser.add_argument("--stats-port", help="Serve the server metrics over HTTP on this port, in the Prometheus "
+                        "text format. Each worker uses the next port up", type=int, default=None)
+    parser.add_argument("--stats-ip", help="The IP to serve --stats-port on. Default is localhost only",
+                        default="127.0.0.1")
+    parser.add_argument("--stats-file", help="Write the server metrics to this file, in the Prometheus text format",
+                        default=None)
+    parser.add_argument("--stats-interval", help="Seconds between writes of --stats-file",
+                        type=float, default=10)
+    parser.add_argument("--source-rate", help="Max packets/sec from each client. Default is no limit",
+                        type=float, default=None)
+    parser.add_argument("--network-rate", help="Max packets/sec of each network. Default is no limit",
+                        type=float, default=None)
+    parser.add_argument("--max-rate", help="Max packets/sec of the server. Data packets are dropped before "
+                        "control packets when over it. Default is no limit", type=float, default=None)
+    parser.add_argument("--block-time", help="Seconds to block a client that keeps sending invalid packets. "
+                        "Clients with a registered device are never blocked. Default is never", type=float,
+                        default=None)
     args = parser.parse_args()
 
-    srv = serverhub.ServerHub(args.ip, args.port)
+    checks = None
+    if args.checks:
+        try:
+            checks = [unipacket.CHECK_NAMES[name] for name in args.checks.split(',')]
+        except KeyError:
+            print("Error - invalid integrity check")
+            sys.exit(0)
+    key = args.key.encode("utf8") if args.key else None
+    if checks and unipacket.CHECK_HMAC in checks and not key:
+        print("Error - hmac integrity check requires a key")
+        sys.exit(0)
+
+    if args.workers > 1:
+        srv = serverhub.ShardedServerHub(args.ip, args.port, checks, key, args.verify,
+                                         args.sample_rate, args.engine, args.workers,
+                                         args.max_networks, args.route_timeout, args.copies,
+                                         args.stats_port, args.stats_file, args.stats_interval,
+                                         args.source_rate, args.network_rate, args.max_rate,
+                                         args.block_time, args.stats_ip)
+    else:
+        srv = serverhub.ServerHub(args.ip, args.port, checks, key, args.verify, args.sample_rate,
+                                  args.engine, route_timeout=args.route_timeout, copies=args.copies,
+                                  stats_port=args.stats_port, stats_file=args.stats_file,
+                                  stats_interval=args.stats_interval, source_rate=args.source_rate,
+                                  network_rate=args.network_rate, max_rate=args.max_rate,
+                                  block_time=args.block_time, stats_ip=args.stats_ip)
     
     #start the server
     srv.run()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Batched UDP socket I/O
+#  Sends and recieves many datagrams per syscall with the Linux
+#  recvmmsg/sendmmsg calls, or one at a time where they're not available
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+import ctypes
+import errno
+import select
+import socket
+import struct
+
+# Via pip
+
+# In this repo
+
+
+class Iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+
+class Msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(Iovec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class Mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', Msghdr),
+                ('msg_len', ctypes.c_uint)]
+
+# the Linux calls, if there are any
+try:
+    libc = ctypes.CDLL(None, use_errno=True)
+    recvmmsg = libc.recvmmsg
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(Mmsghdr), ctypes.c_uint,
+                         ctypes.c_int, ctypes.c_void_p]
+    sendmmsg = libc.sendmmsg
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(Mmsghdr), ctypes.c_uint,
+                         ctypes.c_int]
+    HAVE_MMSG = hasattr(socket, 'MSG_DONTWAIT')
+except (OSError, AttributeError):
+    HAVE_MMSG = False
+
+# struct sockaddr_in - family (native order), port, IPv4 address, padding
+sockaddr_format = struct.Struct("=H2s4s8x")
+
+
+class Batchsocket():
+    """Wraps a UDP (IPv4) socket, to recieve and send lists of datagrams.
+    calls is the number of send/recv syscalls made, for benchmarking"""
+    def __init__(self, sock, batch=64, bufsize=2048, native=None):
+        """Up to batch datagrams of up to bufsize bytes are sent or
+        recieved per call. native chooses recvmmsg/sendmmsg (True) or
+        recvfrom/sendto (False). The default is native if available"""
+        self.sock = sock
+        self.batch = batch
+        self.bufsize = bufsize
+        self.native = HAVE_MMSG if native is None else native
+        self.calls = 0
+        if not self.native:
+            return
+
+        # the message headers, each pointing to its own part of the
+        # buffers. Built once and reused
+        self.buf = ctypes.create_string_buffer(batch * bufsize)
+        self.names = ctypes.create_string_buffer(batch * sockaddr_format.size)
+        self.iovecs = (Iovec * batch)()
+        self.msgs = (Mmsghdr * batch)()
+        buf_addr = ctypes.addressof(self.buf)
+        names_addr = ctypes.addressof(self.names)
+        for i in range(0, batch):
+            self.iovecs[i].iov_base = buf_addr + i * bufsize
+            self.iovecs[i].iov_len = bufsize
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_name = names_addr + i * sockaddr_format.size
+            hdr.msg_namelen = sockaddr_format.size
+            hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            hdr.msg_iovlen = 1
+
+        # ctypes attributes are slow to get and set, so the fields changed
+        # per datagram are accessed through memoryviews instead
+        self.bufview = memoryview(self.buf).cast('B')
+        self.namesview = memoryview(self.names).cast('B')
+        # msg_namelen and msg_len of each message
+        msgsview = memoryview(self.msgs).cast('B').cast('I')
+        step = ctypes.sizeof(Mmsghdr) // 4
+        self.namelens = msgsview[Msghdr.msg_namelen.offset // 4::step]
+        self.lens = msgsview[Mmsghdr.msg_len.offset // 4::step]
+        # iov_len of each message
+        self.iovlens = memoryview(self.iovecs).cast('B').cast('N')[1::2]
+        # the (ip, port) of each sockaddr, and back
+        self.addresses = {}
+        self.sockaddrs = {}
+        # the number of messages with changed fields, from the last call
+        self.used = 0
+
+    def recvbatch(self, timeout=None):
+        """Wait up to timeout (sec) for datagrams, then return a list of
+        the (data, (ip, port)) of each datagram waiting, up to the batch
+        size"""
+        (readable, writable, errored) = select.select([self.sock], [], [],
+                                                      timeout)
+        if not readable:
+            return []
+        if not self.native:
+            return self.recvfallback()
+
+        self.resetmsgs()
+        self.calls += 1
+        count = recvmmsg(self.sock.fileno(), self.msgs, self.batch,
+                         socket.MSG_DONTWAIT, None)
+        if count < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EINTR):
+                return []
+            raise OSError(err, "recvmmsg: " + errno.errorcode.get(err, ''))
+        self.used = count
+
+        datagrams = []
+        size = sockaddr_format.size
+        for i in range(0, count):
+            offset = i * self.bufsize
+            datagrams.append((self.bufview[offset:offset +
+                                           self.lens[i]].tobytes(),
+                              self.getaddress(
+                                  self.namesview[i * size:(i + 1) * size])))
+        return datagrams
+
+    def resetmsgs(self):
+        """Put back the fields of the messages used by the last call"""
+        for i in range(0, self.used):
+            self.namelens[i] = sockaddr_format.size
+            self.iovlens[i] = self.bufsize
+        self.used = 0
+
+    def getaddress(self, sockaddr):
+        """The (ip, port) of a sockaddr_in"""
+        key = sockaddr.tobytes()
+        address = self.addresses.get(key)
+        if address is None:
+            (family, port, ip) = sockaddr_format.unpack(key)
+            address = (socket.inet_ntoa(ip),
+                       int.from_bytes(port, byteorder='big'))
+            if len(self.addresses) > 4096:
+                self.addresses.clear()
+            self.addresses[key] = address
+        return address
+
+    def getsockaddr(self, address):
+        """The sockaddr_in of an (ip, port)"""
+        sockaddr = self.sockaddrs.get(address)
+        if sockaddr is None:
+            sockaddr = sockaddr_format.pack(
+                socket.AF_INET, address[1].to_bytes(2, byteorder='big'),
+                socket.inet_aton(address[0]))
+            if len(self.sockaddrs) > 4096:
+                self.sockaddrs.clear()
+            self.sockaddrs[address] = sockaddr
+        return sockaddr
+
+    def recvfallback(self):
+        """recvbatch() with a recvfrom per datagram"""
+        datagrams = []
+        while len(datagrams) < self.batch:
+            self.calls += 1
+            try:
+                datagrams.append(self.sock.recvfrom(self.bufsize,
+                                                    socket.MSG_DONTWAIT))
+            except (BlockingIOError, InterruptedError):
+                break
+        return datagrams
+
+    def sendbatch(self, datagrams):
+        """Send a list of (data, (ip, port)). A datagram that can't be sent
+        is dropped"""
+        if not self.native:
+            self.sendfallback(datagrams)
+            return
+        if any(len(data) > self.bufsize for (data, address) in datagrams):
+            # too big for the buffers, so sent on their own
+            self.sendfallback([datagram for datagram in datagrams
+                               if len(datagram[0]) > self.bufsize])
+            datagrams = [datagram for datagram in datagrams
+                         if len(datagram[0]) <= self.bufsize]
+
+        self.resetmsgs()
+        size = sockaddr_format.size
+        for start in range(0, len(datagrams), self.batch):
+            chunk = datagrams[start:start + self.batch]
+            for (i, (data, address)) in enumerate(chunk):
+                offset = i * self.bufsize
+                self.bufview[offset:offset + len(data)] = data
+                self.iovlens[i] = len(data)
+                self.namesview[i * size:(i + 1) * size] = \
+                    self.getsockaddr(address)
+            self.used = max(self.used, len(chunk))
+            sent = 0
+            while sent < len(chunk):
+                self.calls += 1
+                count = sendmmsg(self.sock.fileno(),
+                                 ctypes.byref(self.msgs[sent]),
+                                 len(chunk) - sent, 0)
+                if count < 0:
+                    if ctypes.get_errno() == errno.EINTR:
+                        continue
+                    # skip the datagram that failed
+                    count = 1
+                sent += count
+
+    def sendfallback(self, datagrams):
+        """sendbatch() with a sendto per datagram"""
+        for (data, address) in datagrams:
+            self.calls += 1
+            try:
+                self.sock.sendto(data, address)
+            except OSError:
+                pass
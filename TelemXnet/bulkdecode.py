@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Bulk decoder for captured streams of packets
+#  Decodes many Unipacket frames at once via NumPy, for offline analysis
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+
+# Via pip
+import numpy
+
+# In this repo
+from TelemXnet import unipacket
+
+
+# The decoded fields of each frame. NetworkID is the 32 byte NetworkID,
+# or the session token followed by zeros. Payload_offset is the offset
+# of the payload in the decoded data. A FLAG_COMPRESSED payload is left
+# compressed
+frame_dtype = numpy.dtype([('Flags', numpy.uint8),
+                           ('NetworkID', numpy.uint8, (32,)),
+                           ('DeviceID', numpy.int8),
+                           ('Sequence', numpy.uint16),
+                           ('Payload_offset', numpy.int64),
+                           ('Payload_length', numpy.uint8),
+                           ('Valid', numpy.bool_)])
+
+
+class Bulkdecoder():
+    """Decodes a capture of concatenated Unipacket frames (each
+    0x00 + COBS/R + 0x00) into a NumPy structured array of frame_dtype.
+    The frames are found and de-cobs/r'd in batches with vectorised
+    operations, rather than one at a time"""
+    def __init__(self, key=None, batch_size=100000, accept=None):
+        """Constructor. key is the shared secret for frames with a
+        unipacket.CHECK_HMAC check, and accept the checks that frames
+        may have (see unipacket.Unipacket). Frames are decoded batch_size
+        at a time to limit the memory used"""
+        self.pkt = unipacket.Unipacket(key=key, accept=accept)
+        self.check_lengths = numpy.array(self.pkt.check_lengths,
+                                         dtype=numpy.int64)
+        self.batch_size = batch_size
+
+    def splitframes(self, capture):
+        """Returns the (start, end) index arrays of the COBS/R data of each
+        frame in the capture, ie. between the 0x00 delimiters"""
+        delims = numpy.flatnonzero(capture == 0)
+        starts = delims[:-1] + 1
+        ends = delims[1:]
+        nonempty = ends > starts
+        return (starts[nonempty], ends[nonempty])
+
+    def decodecobsr(self, capture, starts, ends):
+        """De-cobs/r the frames at starts:ends in the capture. Returns the
+        decoded data of all the frames and the (start, end) index arrays of
+        each frame in it"""
+        # walk the code bytes of all frames in lockstep. The first code
+        # byte is dropped, later code bytes are a 0x00 unless the previous
+        # code was 0xFF
+        keep = capture != 0
+        value = capture.copy()
+        ptr = starts.copy()
+        prev = numpy.full(len(starts), -1, dtype=numpy.int64)
+        active = numpy.arange(len(starts))
+        while active.size:
+            pos = ptr[active]
+            code = capture[pos].astype(numpy.int64)
+            keep[pos] = (prev[active] >= 0) & (prev[active] < 0xFF)
+            value[pos] = 0
+            prev[active] = code
+            ptr[active] = pos + code
+            active = active[ptr[active] < ends[active]]
+
+        # a last code that runs past the end of the frame is itself the
+        # last byte of data (the COBS/R reduction). It takes the place of
+        # the closing delimiter
+        reduced = ptr > ends
+        keep[ends] = reduced
+        value[ends[reduced]] = prev[reduced]
+
+        count = numpy.cumsum(keep)
+        return (value[keep], count[starts - 1], count[ends])
+
+    def decodebatch(self, capture, starts, ends, verify):
+        """Decode the frames at starts:ends in the capture. Returns the
+        frame_dtype array and decoded data"""
+        (data, dec_starts, dec_ends) = self.decodecobsr(capture, starts, ends)
+        fields = numpy.zeros(len(starts), dtype=frame_dtype)
+        if len(data) == 0:
+            return (fields, data)
+        lengths = dec_ends - dec_starts
+
+        # the fixed fields. Indexes past the end of the data are clipped,
+        # and the frame is then too short to be valid
+        flags = numpy.take(data, dec_starts, mode='clip')
+        id_len = numpy.where(flags & unipacket.FLAG_TOKEN,
+                             unipacket.TOKEN_LENGTH, 32)
+        net_ids = numpy.take(data, dec_starts[:, None] + 1 + numpy.arange(32),
+                             mode='clip')
+        net_ids[numpy.arange(32) >= id_len[:, None]] = 0
+        route = dec_starts + id_len + 1
+        pay_lens = numpy.take(data, route + 3, mode='clip')
+        chk_lens = self.check_lengths[flags]
+        pay_offsets = dec_starts + id_len + 5
+
+        fields['Flags'] = flags
+        fields['NetworkID'] = net_ids
+        fields['DeviceID'] = numpy.take(data, route,
+                                        mode='clip').view(numpy.int8)
+        fields['Sequence'] = (numpy.take(data, route + 1, mode='clip').astype(
+            numpy.uint16) << 8 | numpy.take(data, route + 2, mode='clip'))
+        fields['Payload_offset'] = pay_offsets
+        fields['Payload_length'] = pay_lens
+        # as unipacket, nothing may follow the check value
+        fields['Valid'] = ((chk_lens > 0) & (lengths >= id_len + 5) &
+                           (lengths == id_len + 5 + pay_lens + chk_lens))
+
+        # verify the check values. There's no vectorised hash, so this is
+        # one call per frame
+        if verify:
+            valid = numpy.flatnonzero(fields['Valid'])
+            data_view = memoryview(data.tobytes())
+            checkfuncs = [self.pkt.checkfuncs.get(chk)
+                          for chk in range(0, unipacket.CHECK_MASK + 1)]
+            # plain lists are much faster to index than numpy arrays
+            verified = [(checkfunc is not None and
+                         checkfunc(data_view[start:data_end]) ==
+                         data_view[data_end:data_end + chk_len])
+                        for (checkfunc, start, data_end, chk_len) in zip(
+                            [checkfuncs[chk] for chk in
+                             (flags[valid] & unipacket.CHECK_MASK).tolist()],
+                            dec_starts[valid].tolist(),
+                            (pay_offsets[valid] + pay_lens[valid]).tolist(),
+                            chk_lens[valid].tolist())]
+            fields['Valid'][valid] = verified
+        return (fields, data)
+
+    def decode(self, capture, verify=True):
+        """Decode all the frames in a capture (bytes-like). Returns the
+        frame_dtype array of the fields of each frame, and a uint8 array of
+        the decoded data that Payload_offset refers to. Frames that fail the
+        integrity check (or if verify is False, are too short) have Valid
+        set False"""
+        capture = numpy.frombuffer(capture, dtype=numpy.uint8)
+        (starts, ends) = self.splitframes(capture)
+
+        all_fields = []
+        all_data = []
+        offset = 0
+        for i in range(0, len(starts), self.batch_size):
+            batch_starts = starts[i:i + self.batch_size]
+            batch_ends = ends[i:i + self.batch_size]
+            # each batch is decoded from its own part of the capture, so
+            # the copies in decodecobsr() are the size of the batch
+            first = batch_starts[0] - 1
+            (fields, data) = self.decodebatch(capture[first:batch_ends[-1] + 1],
+                                              batch_starts - first,
+                                              batch_ends - first, verify)
+            fields['Payload_offset'] += offset
+            offset += len(data)
+            all_fields.append(fields)
+            all_data.append(data)
+
+        if not all_fields:
+            return (numpy.zeros(0, dtype=frame_dtype),
+                    numpy.zeros(0, dtype=numpy.uint8))
+        return (numpy.concatenate(all_fields), numpy.concatenate(all_data))
@@ -29,19 +29,75 @@ import multiprocessing
 from multiprocessing import Value
 import time
 import select
+import selectors
+import collections
+import struct
+import math
 
 # Via pip
 
 # In this repo
 from TelemXnet import unipacket
 from TelemXnet import udpxciever
+from TelemXnet import seqwindow
+from TelemXnet import linksched
 from TelemXnet import util
 
+# a link probe - a server ping with the time it was sent (time.monotonic())
+PROBE = b'CL_SVRPING'
+probe_format = struct.Struct(">d")
+# the fields of each iface in the shared link stats, see getlinkstats()
+LINK_FIELDS = ('devid', 'iface', 'rtt', 'jitter', 'loss', 'probes', 'lost',
+               'tx_depth', 'tx_dropped', 'rx_depth', 'rx_dropped')
+# the most ifaces in the shared link stats
+MAX_LINKS = 8
+# the datagrams recieved before the local client is known are held for
+# up to this long (sec), or max_age if less, then sent to it once it is
+LOCAL_HOLD = 1.0
+# an iface registers with the server again after this many probes in a
+# row are unanswered, as its route may have expired
+REGISTER_MISSED = 2
+
 
 class Clienthub(multiprocessing.Process):
     """This a a UDP server for sending and recieving data packets
     to a UAVNet server"""
-    def __init__(self, local, remote, net_id, baseID):
+    def __init__(self, local, remote, net_id, baseID,
+                 check=unipacket.CHECK_SHA256, key=None, coalesce_delay=None,
+                 compress=False, zdict=None, engine='threaded',
+                 max_queue=256, queue_policy=udpxciever.DROP_OLDEST,
+                 max_age=None, link_policy=linksched.SEND_ALL,
+                 probe_interval=1.0):
+        """Constructor. The ifaces of the hub have the DeviceIDs from
+        baseID on, which must stay in its block of unipacket.HUB_DEVICES.
+        check is the integrity check algorithm to use for packets sent to
+        the server, and key the shared secret if it is
+        unipacket.CHECK_HMAC. If coalesce_delay (sec) is set, datagrams
+        from the local client are packed together into packets of up to
+        maxPayloadSize(), which are sent when full or when the first
+        datagram in them is coalesce_delay old. If compress is set, data
+        packets are compressed (when that makes them smaller) with the
+        preset dictionary zdict.
+        engine is 'threaded' (a Udpxciever thread per iface, all polled
+        in turn) or 'selector' (the local and iface sockets all waited on
+        in one selectors loop, see runselector()).
+        The Tx and Rx queues of each Udpxciever hold up to max_queue
+        packets, dropping by queue_policy when full and dropping packets
+        older than max_age (sec), so a stalled link holds little and only
+        sends fresh data (see udpxciever.Packetqueue). The selector engine
+        has no queues, just the socket buffers.
+        link_policy is how the ifaces that carry each data packet are
+        chosen, from the RTT and loss of the probes on each (see
+        linksched.Linkscheduler). Control packets go on every iface.
+        A probe is sent on every iface each probe_interval (sec, None for
+        none), and the server echoes it back. The estimates from them are
+        read with getlinkstats(). An iface whose probes go unanswered
+        registers again, in case the server has expired its route"""
+        if engine not in ('threaded', 'selector'):
+            raise ValueError("Unknown engine " + str(engine))
+        # checks the queue options, here rather than in the new process
+        udpxciever.Packetqueue(max_queue, queue_policy, max_age)
+        linksched.Linkscheduler(link_policy)
         multiprocessing.Process.__init__(self)
         self.localaddport = local
         self.remaddport = remote
@@ -53,17 +109,41 @@ class Clienthub(multiprocessing.Process):
         self.pinginprogress = Value('i', 0)
         self.ping_q = multiprocessing.Queue()
 
-        self.pkt = unipacket.Unipacket()
+        # a keyed codec only accepts HMAC packets, so the key is only
+        # used with that check
+        if check != unipacket.CHECK_HMAC:
+            key = None
+        self.pkt = unipacket.Unipacket(check, key, zdict)
+        self.coalesce_delay = coalesce_delay
+        # Flags for data packets
+        self.dataflags = unipacket.FLAG_COMPRESSED if compress else 0
+        # packets are sent with the session token from the server once
+        # it's known, rather than the full net_id
+        self.session_id = net_id
+        self.engine = engine
+        self.queue_options = (max_queue, queue_policy, max_age)
+        self.hold_age = LOCAL_HOLD if max_age is None else min(max_age,
+                                                               LOCAL_HOLD)
+        self.link_policy = link_policy
+        self.probe_interval = probe_interval
+        # the number of ifaces, then the LINK_FIELDS of each
+        self.linkstats = multiprocessing.Array(
+            'd', 1 + MAX_LINKS * len(LINK_FIELDS))
+        # wakes the selector engine for a change from the parent
+        if engine == 'selector':
+            (self.wakeup_r, self.wakeup_w) = multiprocessing.Pipe(False)
 
     def addinterface(self, iface):
         """Add a network interface to the client
         Takes in the IP address of that interface"""
         self.client_ifaces_q.put("Add-" + iface)
+        self.wakeup(b'i')
 
     def removeinterface(self, iface):
         """Remove a network interface to the client
         Takes in the IP address of that interface"""
         self.client_ifaces_q.put("Rem-" + iface)
+        self.wakeup(b'i')
 
     def pinginterfaces(self):
         """Run a server ping on all ifaces. Also functions as a status/heartbeat
@@ -72,6 +152,7 @@ class Clienthub(multiprocessing.Process):
         alldevices = []
         if self.pingbasetime.value == 0:
             self.pingbasetime.value = util.gettimestamp()
+            self.wakeup(b'p')
         else:
             print("Ping already in process")
 
@@ -101,132 +182,430 @@ class Clienthub(multiprocessing.Process):
         self.pinginprogress.value = 0
         return retping
 
+    def getlinkstats(self):
+        """The latest estimates of each iface, as a list of dicts of
+        LINK_FIELDS. The iface is its IP address, the rtt and jitter are in
+        ms (None until a probe is answered) and the queue depths and drops
+        are of its Udpxciever (0 with the selector engine). Returns
+        straight away - the estimates are updated as each probe is sent or
+        answered"""
+        with self.linkstats.get_lock():
+            values = self.linkstats[:]
+        links = []
+        size = len(LINK_FIELDS)
+        for i in range(0, int(values[0])):
+            link = dict(zip(LINK_FIELDS, values[1 + i * size:
+                                                1 + (i + 1) * size]))
+            for field in LINK_FIELDS:
+                if field not in ('rtt', 'jitter', 'loss'):
+                    link[field] = int(link[field])
+            link['iface'] = socket.inet_ntoa(struct.pack(">I",
+                                                         link['iface']))
+            if math.isnan(link['rtt']):
+                link['rtt'] = link['jitter'] = None
+            links.append(link)
+        return links
+
     def run(self):
-        serversocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        serversocket.setblocking(False)
-        serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.serversocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.serversocket.setblocking(False)
+        self.serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR,
+                                     1)
         #serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 10)
         #serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 10)
-        serversocket.bind(self.localaddport)
-        udpclients = []
-        udpclientdevid = []
-        lastrxseq = -1
-        seq_no = 0
+        self.serversocket.bind(self.localaddport)
+        self.udpclients = []
+        self.udpclientdevid = []
+        # the sequence numbers recieved from each remote hub. All of the
+        # ifaces of a hub send the same packet with the same sequence
+        # number, but a different DeviceID in its block, so the window is
+        # per block (see unipacket.HUB_DEVICES) rather than per DeviceID
+        self.rxwindows = {}
+        self.seq_no = 0
+        # datagrams from the local client waiting to be coalesced
+        self.txpending = []
+        self.txpendinglen = 0
+        self.txpendingtime = 0
+        # packets from the server are decoded into this buffer
+        self.rxbuf = self.pkt.newbuffer()
+        # the local client, once it has sent a datagram, and the last few
+        # (time recieved, datagram) for it from before then
+        self.localaddress = None
+        self.rxpending = collections.deque(maxlen=32)
+        # the ifaces to send data on, by their RTT and loss
+        self.scheduler = linksched.Linkscheduler(self.link_policy)
+        # the first probe waits for the ifaces to register
+        self.nextprobe = time.monotonic() + (self.probe_interval or 0)
 
         # print("Started")
+        if self.engine == 'selector':
+            self.runselector()
+        else:
+            self.runthreaded()
+
+        # send ending packets
+        self.seq_no = self.sendallClients(self.udpclients, self.udpclientdevid,
+                                          -1, self.seq_no, b'CL_END')
+        # close the sockets - just remove the first item n times
+        # (array reindexes each time)
+        for i in range(0, len(self.udpclients)):
+            self.udpclients[0].close()
+            time.sleep(0.001)
+            self.udpclients.remove(self.udpclients[0])
+            self.udpclientdevid.remove(self.udpclientdevid[0])
+        self.serversocket.close()
+        # print("Ended")
+
+    def runthreaded(self):
+        """Run the threaded engine until join(), polling the local socket
+        and each iface's Udpxciever in turn"""
         while self.endloop.value == 0:
             # sync with any changes to the client interfaces
-            (udpclients, udpclientdevid) = self.sync_ifaces(udpclients,
-                                                            udpclientdevid,
-                                                            seq_no)
-            # send out a server ping if required (and return list of all current clients)
-            if self.pingbasetime.value != 0 and self.pinginprogress.value == 0:
-                seq_no = self.sendallClients(udpclients, udpclientdevid, -1,
-                                             seq_no, b'CL_SVRPING')
-                self.pinginprogress.value = 1
-                # print("Sending ping " + str(seq_no))
-                for i in range(0, len(udpclients)):
-                    self.ping_q.put(str(udpclientdevid[i]) + "," +
-                                        str(udpclients[i].getiface()))
-                    
-
-            ready = select.select([serversocket], [], [], 0.0001)
+            (self.udpclients, self.udpclientdevid) = self.sync_ifaces(
+                self.udpclients, self.udpclientdevid, self.seq_no)
+            # send out a server ping if required (and return list of all
+            # current clients)
+            self.startping()
+            self.sendprobes()
+
+            ready = select.select([self.serversocket], [], [], 0.0001)
             # if there is data from the local client, send it to the remote
             # only read up to the max payload size though
             if ready[0]:
-                data, address = serversocket.recvfrom(self.pkt.maxPayloadSize())
-
-                # send to the all the clients...
-                # print("Sending data")
-                seq_no = self.sendallClients(udpclients, udpclientdevid, 1,
-                                             seq_no, data)
+                data, address = self.serversocket.recvfrom(
+                    self.pkt.maxPayloadSize())
+                self.handlelocal(data, address)
+            self.flushcoalesced()
 
             # poll the clients for any new data
-            for i in range(0, len(udpclients)):
-                # if client has data, compare to latest timestamp
-                datarx = udpclients[i].readpacket()
+            for i in range(0, len(self.udpclients)):
+                datarx = self.udpclients[i].readpacket()
                 if datarx:
-                    dec_msg = self.pkt.recoverpacket(datarx)
-                    # check if it's a returned ping packet
-                    if dec_msg.Payload == b'CL_SVRPING' and dec_msg.DeviceID < 0 and self.pinginprogress.value == 1:
-                        deltatime = int((util.gettimestamp() -
-                                         self.pingbasetime.value)/10)
-                        self.ping_q.put(str(udpclientdevid[i]) + "," +
-                                        str(udpclients[i].getiface()) +
-                                        "," + str(deltatime))
-
-                    # print("Got packet from serverhub["+ str(i) +"][" +
-                    #      str(dec_msg.DeviceID) + "] " +
-                    #      str(dec_msg.Timestamp) + ", " + str(lastrxtime))
-                    # if this data is newer, send to local client and
-                    # update the timestamp
-                    # need to ensure it's a new packet and we have a
-                    # connected local client
-                    if dec_msg.Sequence > lastrxseq and ('address' in locals() or 'address' in globals()):
-                        # print("rx packet")
-                        lastrxseq = dec_msg.Sequence
-                        serversocket.sendto(dec_msg.Payload, address)
-        # close the socket on end
-        if serversocket is not None:
-            # send ending packets
-            seq_no = self.sendallClients(udpclients, udpclientdevid, -1, seq_no,
-                                         b'CL_END')
-            # close the sockets - just remove the first item n times
-            # (array reindexes each time)
-            for i in range(0, len(udpclients)):
-                udpclients[0].close()
-                time.sleep(0.001)
-                udpclients.remove(udpclients[0])
-                udpclientdevid.remove(udpclientdevid[0])
-            serversocket.close()
-            # print("Ended")
-
-    def sendallClients(self, udpclients, udpclientdevid, ctrl, seq_no, data):
-        """Send data to server via all current ifaces"""
-        for i in range(0, len(udpclients)):
-            msg = self.pkt.buildpacket(self.net_id, ctrl * udpclientdevid[i],
-                                       seq_no, data)
+                    self.handleserver(datarx, i)
+
+    def runselector(self):
+        """Run the selector engine until join(). The local socket, each
+        iface's socket and the wakeup pipe from the parent are waited on
+        together, so the loop only wakes for a packet, a change from the
+        parent or to send coalesced datagrams"""
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.serversocket, selectors.EVENT_READ)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ)
+        while self.endloop.value == 0:
+            timeout = None
+            if self.txpending:
+                timeout = max(0, self.txpendingtime + self.coalesce_delay -
+                              time.time())
+            if self.probe_interval and self.udpclients:
+                probetimeout = max(0, self.nextprobe - time.monotonic())
+                if timeout is None or probetimeout < timeout:
+                    timeout = probetimeout
+            for (key, events) in self.selector.select(timeout):
+                if key.fileobj is self.serversocket:
+                    self.drainlocal()
+                elif key.fileobj is self.wakeup_r:
+                    self.handlewakeups()
+                elif key.fileobj in self.udpclients:
+                    i = self.udpclients.index(key.fileobj)
+                    for datarx in key.fileobj.recvall():
+                        self.handleserver(datarx, i)
+            self.flushcoalesced()
+            self.sendprobes()
+        self.selector.close()
+
+    def drainlocal(self):
+        """Handle the datagrams waiting from the local client, up to a
+        batch of them"""
+        for i in range(0, 64):
+            try:
+                data, address = self.serversocket.recvfrom(
+                    self.pkt.maxPayloadSize())
+            except BlockingIOError:
+                return
+            self.handlelocal(data, address)
+
+    def handlewakeups(self):
+        """Handle each wakeup from the parent - b'i' for an iface change
+        in the queue, b'p' for a ping or b'e' for the end"""
+        while self.wakeup_r.poll():
+            reason = self.wakeup_r.recv_bytes()
+            if reason == b'i':
+                # the wakeup is sent after the change is queued, so it will
+                # arrive
+                self.changeiface(self.client_ifaces_q.get(), self.udpclients,
+                                 self.udpclientdevid, self.seq_no)
+            elif reason == b'p':
+                self.startping()
+
+    def wakeup(self, reason):
+        """Wake the selector engine, see handlewakeups()"""
+        if self.engine == 'selector':
+            self.wakeup_w.send_bytes(reason)
+
+    def startping(self):
+        """Send a server ping if one has been asked for, and put the list
+        of ifaces in the ping queue"""
+        if self.pingbasetime.value != 0 and self.pinginprogress.value == 0:
+            now = time.monotonic()
+            for udpclient in self.udpclients:
+                self.scheduler.probesent(udpclient, self.seq_no, now)
+            self.seq_no = self.sendallClients(self.udpclients,
+                                              self.udpclientdevid, -1,
+                                              self.seq_no, b'CL_SVRPING')
+            self.pinginprogress.value = 1
+            # print("Sending ping " + str(seq_no))
+            for i in range(0, len(self.udpclients)):
+                self.ping_q.put(str(self.udpclientdevid[i]) + "," +
+                                str(self.udpclients[i].getiface()))
+
+    def sendprobes(self):
+        """Send a probe on each iface if it's time to, counting those not
+        answered in time as lost"""
+        if not self.probe_interval or not self.udpclients:
+            return
+        now = time.monotonic()
+        if now < self.nextprobe:
+            return
+        self.nextprobe = now + self.probe_interval
+        self.scheduler.expire(now)
+        self.reregister()
+        for udpclient in self.udpclients:
+            self.scheduler.probesent(udpclient, self.seq_no, now)
+        self.seq_no = self.sendallClients(self.udpclients,
+                                          self.udpclientdevid, -1,
+                                          self.seq_no,
+                                          PROBE + probe_format.pack(now))
+        self.publishlinks()
+
+    def reregister(self):
+        """Send a CL_BEGIN on each iface whose last REGISTER_MISSED probes
+        are unanswered. The server replies with the (maybe new) session
+        token"""
+        for (udpclient, devid) in zip(self.udpclients, self.udpclientdevid):
+            stats = self.scheduler.getstats(udpclient)
+            if stats.missed >= REGISTER_MISSED:
+                stats.missed = 0
+                udpclient.writepacket(self.pkt.buildpacket(
+                    self.net_id, -devid, self.seq_no, b'CL_BEGIN+TOKEN'))
+
+    def publishlinks(self):
+        """Copy the estimates of each iface to the shared link stats"""
+        values = [min(len(self.udpclients), MAX_LINKS)]
+        for (udpclient, devid) in list(zip(self.udpclients,
+                                           self.udpclientdevid))[:MAX_LINKS]:
+            stats = self.scheduler.getstats(udpclient)
+            queues = udpclient.getqueuestats()
+            # NaN until a probe is answered
+            rtt = math.nan if stats.srtt is None else stats.srtt * 1000
+            values += [devid,
+                       struct.unpack(">I", socket.inet_aton(
+                           udpclient.getiface()))[0],
+                       rtt, stats.jitter * 1000,
+                       stats.loss, stats.sentcount, stats.lostcount,
+                       queues['tx_depth'], queues['tx_dropped'],
+                       queues['rx_depth'], queues['rx_dropped']]
+        with self.linkstats.get_lock():
+            self.linkstats[0:len(values)] = values
+
+    def handlelocal(self, data, address):
+        """Send a datagram from the local client to the server, or add it
+        to the datagrams to coalesce"""
+        if self.localaddress is None:
+            self.localaddress = address
+            now = time.monotonic()
+            held = [datagram for (recieved, datagram) in self.rxpending
+                    if now - recieved <= self.hold_age]
+            self.rxpending.clear()
+            self.sendlocal(held)
+        self.localaddress = address
+        # an empty datagram has nothing to send, and can't be coalesced
+        if not data:
+            return
+        if self.coalesce_delay:
+            # send the pending datagrams first if this one won't fit
+            if (self.txpending and self.txpendinglen + 1 + len(data) >
+                    self.pkt.maxPayloadSize()):
+                self.seq_no = self.sendcoalesced(self.udpclients,
+                                                 self.udpclientdevid,
+                                                 self.seq_no, self.txpending)
+                self.txpending = []
+                self.txpendinglen = 0
+            if not self.txpending:
+                self.txpendingtime = time.time()
+            self.txpending.append(data)
+            self.txpendinglen += 1 + len(data)
+        else:
+            # send to the all the clients...
+            # print("Sending data")
+            self.seq_no = self.sendallClients(self.udpclients,
+                                              self.udpclientdevid, 1,
+                                              self.seq_no, data,
+                                              self.dataflags)
+
+    def flushcoalesced(self):
+        """Send the pending datagrams if they are old enough, or there's
+        no room for any more"""
+        if self.txpending and (self.txpendinglen + 2 >
+                               self.pkt.maxPayloadSize() or
+                               time.time() - self.txpendingtime >=
+                               self.coalesce_delay):
+            self.seq_no = self.sendcoalesced(self.udpclients,
+                                             self.udpclientdevid, self.seq_no,
+                                             self.txpending)
+            self.txpending = []
+            self.txpendinglen = 0
+
+    def handleserver(self, datarx, i):
+        """Handle a packet from the server, recieved on iface number i"""
+        dec_msg = self.pkt.recoverpacket_into(datarx, self.rxbuf)
+        if dec_msg is None:
+            return
+        # check if it's a returned ping packet or probe
+        if dec_msg.DeviceID < 0 and dec_msg.Payload[:len(PROBE)] == PROBE:
+            sent = None
+            if dec_msg.Payload_length == len(PROBE) + probe_format.size:
+                sent = probe_format.unpack_from(dec_msg.Payload,
+                                                len(PROBE))[0]
+            self.scheduler.probeanswered(self.udpclients[i],
+                                         dec_msg.Sequence, time.monotonic(),
+                                         sent)
+            self.publishlinks()
+        if (dec_msg.Payload == b'CL_SVRPING' and dec_msg.DeviceID < 0 and
+                self.pinginprogress.value == 1):
+            deltatime = int((util.gettimestamp() -
+                             self.pingbasetime.value)/10)
+            self.ping_q.put(str(self.udpclientdevid[i]) + "," +
+                            str(self.udpclients[i].getiface()) +
+                            "," + str(deltatime))
+        # session token reply to a CL_BEGIN
+        if (dec_msg.DeviceID < 0 and
+                dec_msg.Payload_length == 8 + unipacket.TOKEN_LENGTH and
+                bytes(dec_msg.Payload[:8]) == b'CL_TOKEN' and
+                bytes(dec_msg.NetworkID) in (self.net_id, self.session_id)):
+            self.session_id = bytes(dec_msg.Payload[8:])
+        # control packets are not for the local client
+        if dec_msg.DeviceID < 0:
+            return
+
+        # print("Got packet from serverhub["+ str(i) +"][" +
+        #      str(dec_msg.DeviceID) + "] " +
+        #      str(dec_msg.Timestamp) + ", " + str(lastrxtime))
+        # if this is the first copy of the packet (from any
+        # iface), send to local client
+        hub = dec_msg.DeviceID // unipacket.HUB_DEVICES
+        rxwindow = self.rxwindows.get(hub)
+        if rxwindow is None:
+            rxwindow = self.rxwindows[hub] = seqwindow.Seqwindow()
+        if rxwindow.checkseq(dec_msg.Sequence):
+            # print("rx packet")
+            if dec_msg.Flags & unipacket.FLAG_COALESCED:
+                self.sendlocal(self.pkt.splitpayload(dec_msg.Payload) or [])
+            else:
+                self.sendlocal([dec_msg.Payload])
+
+    def sendlocal(self, datagrams):
+        """Send datagrams to the local client. Until there is one, the
+        latest are held for up to hold_age"""
+        if self.localaddress is None:
+            now = time.monotonic()
+            self.rxpending.extend((now, bytes(datagram))
+                                  for datagram in datagrams)
+            return
+        for datagram in datagrams:
+            self.serversocket.sendto(datagram, self.localaddress)
+
+    def sendcoalesced(self, udpclients, udpclientdevid, seq_no, datagrams):
+        """Send a list of datagrams to server via all current ifaces, in
+        a single packet if there's more than one"""
+        if len(datagrams) == 1:
+            return self.sendallClients(udpclients, udpclientdevid, 1, seq_no,
+                                       datagrams[0], self.dataflags)
+        return self.sendallClients(udpclients, udpclientdevid, 1, seq_no,
+                                   self.pkt.coalesce(datagrams),
+                                   unipacket.FLAG_COALESCED | self.dataflags)
+
+    def sendallClients(self, udpclients, udpclientdevid, ctrl, seq_no, data,
+                       flags=0):
+        """Send data to server via all current ifaces. Data packets (ctrl
+        1) only go via the ifaces chosen by the link scheduler"""
+        if ctrl == 1 and self.scheduler.policy != linksched.SEND_ALL:
+            chosen = [udpclients.index(udpclient) for udpclient in
+                      self.scheduler.choose(time.monotonic())]
+        else:
+            chosen = range(0, len(udpclients))
+        msgs = self.pkt.buildpackets(self.session_id,
+                                     [ctrl * udpclientdevid[i]
+                                      for i in chosen],
+                                     seq_no, data, flags)
+        if msgs is None:
+            return seq_no
+        for (i, msg) in zip(chosen, msgs):
             udpclients[i].writepacket(msg)
-        return seq_no + 1
+        return (seq_no + 1) % 65536
 
     def sync_ifaces(self, udpclients, udpclientdevid, seq_no):
         """Runs inside thread. Syncs the iface queue with the internal
         vars, plus any CL_BEGINS and CL_ENDS"""
         while not self.client_ifaces_q.empty():
-            ifacechange = self.client_ifaces_q.get()
-            if ifacechange[0:4] == "Add-":
-                # add client
-                dev_id = self.base_id + len(udpclientdevid)
-                udpclients.append(udpxciever.Udpxciever(self.remaddport[0],
-                                                        self.remaddport[1],
-                                                        ifacechange[4:]))
-                udpclientdevid.append(dev_id)
-                udpclients[len(udpclients)-1].start()
-                time.sleep(0.001)
-                msg = self.pkt.buildpacket(self.net_id, -dev_id,
-                                           seq_no, b'CL_BEGIN')
-                udpclients[len(udpclients)-1].writepacket(msg)
-                # print("Client " + ifacechange[4:] + " added (" +
-                # str(dev_id) + ")")
-            elif ifacechange[0:4] == "Rem-":
-                # remove client
-                for i in range(0, len(udpclients)):
-                    if udpclients[i].getiface() == ifacechange[4:]:
-                        msg = self.pkt.buildpacket(self.net_id,
-                                                   -udpclientdevid[i],
-                                                   seq_no, b'CL_END')
-                        udpclients[i].writepacket(msg)
-                        # time.sleep(0.01)
-                        udpclients[i].close()
-                        udpclients.remove(udpclients[i])
-                        # print("Client " + ifacechange[4:] + " removed (" +
-                        # str(udpclientdevid[i]) + ")")
-                        udpclientdevid.remove(udpclientdevid[i])
-                        break
+            self.changeiface(self.client_ifaces_q.get(), udpclients,
+                             udpclientdevid, seq_no)
         # return new version of var
         return (udpclients, udpclientdevid)
 
+    def changeiface(self, ifacechange, udpclients, udpclientdevid, seq_no):
+        """Add or remove an iface, from an "Add-" or "Rem-" change"""
+        if ifacechange[0:4] == "Add-":
+            # add client. Its DeviceID must be in the block of the hub
+            dev_id = self.base_id + len(udpclientdevid)
+            if (dev_id // unipacket.HUB_DEVICES !=
+                    self.base_id // unipacket.HUB_DEVICES):
+                return
+            udpclients.append(self.newxciever(ifacechange[4:]))
+            udpclientdevid.append(dev_id)
+            self.scheduler.addlink(udpclients[-1])
+            self.publishlinks()
+            msg = self.pkt.buildpacket(self.net_id, -dev_id,
+                                       seq_no, b'CL_BEGIN+TOKEN')
+            udpclients[len(udpclients)-1].writepacket(msg)
+            # print("Client " + ifacechange[4:] + " added (" +
+            # str(dev_id) + ")")
+        elif ifacechange[0:4] == "Rem-":
+            # remove client
+            for i in range(0, len(udpclients)):
+                if udpclients[i].getiface() == ifacechange[4:]:
+                    msg = self.pkt.buildpacket(self.session_id,
+                                               -udpclientdevid[i],
+                                               seq_no, b'CL_END')
+                    udpclients[i].writepacket(msg)
+                    # time.sleep(0.01)
+                    if self.engine == 'selector':
+                        self.selector.unregister(udpclients[i])
+                    udpclients[i].close()
+                    self.scheduler.removelink(udpclients[i])
+                    udpclients.remove(udpclients[i])
+                    # print("Client " + ifacechange[4:] + " removed (" +
+                    # str(udpclientdevid[i]) + ")")
+                    udpclientdevid.remove(udpclientdevid[i])
+                    self.publishlinks()
+                    break
+
+    def newxciever(self, iface):
+        """Returns a new transciever to the server on iface. The selector
+        engine uses the socket directly, rather than a Udpxciever thread"""
+        if self.engine == 'selector':
+            xciever = udpxciever.udpclient(self.remaddport[0],
+                                           self.remaddport[1], iface)
+            self.selector.register(xciever, selectors.EVENT_READ)
+            return xciever
+        xciever = udpxciever.Udpxciever(self.remaddport[0],
+                                        self.remaddport[1], iface,
+                                        *self.queue_options)
+        xciever.start()
+        time.sleep(0.001)
+        return xciever
+
     def join(self, timeout=None):
         if self.is_alive():
             self.endloop.value = 1
+            self.wakeup(b'e')
             multiprocessing.Process.join(self, timeout)
@@ -23,34 +23,587 @@
 #
 
 # Default python libs
+import mmap
+import multiprocessing
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
 
 # Via pip
 
 # In this repo
+from TelemXnet import timerwheel
+
+# the sides of a network for getpeers(). Devices 0-31 are on the UAS
+# side, 32-63 on the GCS side
+UAS_SIDE = 0
+GCS_SIDE = 1
+
+
+class Route():
+    """A registered device - its (ip, port), the integrity check it
+    registered with and when a packet was last recieved from it"""
+    __slots__ = ('address', 'check', 'lastseen')
+
+    def __init__(self, address, check, lastseen):
+        self.address = address
+        self.check = check
+        self.lastseen = lastseen
+
+
+class Network():
+    """The registered devices of a network. peers is the (ip, port) of
+    each device on each side, see Devicedict.getpeers()"""
+    __slots__ = ('network', 'devices', 'peers')
+
+    def __init__(self, network):
+        self.network = network
+        self.devices = {}
+        self.peers = {}
 
 
 class Devicedict():
-    """A dictionary of devices in the server, where the key is
-    networkID-deviceID and the value is a (ip port) tuple"""
-    def __init__(self):
-        self.dict = {}
+    """A dictionary of devices in the server, keyed by network then
+    deviceID. The network is a short session token assigned to each
+    networkID, see newtoken(). The integrity check algorithm each device
+    registered with is also kept.
+    The server handles packets in many threads. Changes are locked, and
+    only replace or add/remove single dict items, so lookups need no
+    lock.
+    If timeout (sec) is given, a device that hasn't been seen() for that
+    long is removed by expire()"""
+    def __init__(self, token_length=4, timeout=None):
+        self.token_length = token_length
+        # token -> Network, and networkID -> token
+        self.routes = {}
+        self.tokens = {}
+        self.lock = threading.Lock()
+        # each route has a timer in the wheel, for when it could expire
+        self.timeout = timeout
+        self.expired = 0
+        if timeout is not None:
+            self.tick = min(1.0, timeout / 4)
+            self.wheel = timerwheel.Timerwheel(self.tick,
+                                               now=time.monotonic())
+
+    def size(self):
+        """The number of networks in the table"""
+        return len(self.routes)
 
-    def addremote(self, network, device, _ip, _port):
-        """Add a new remote to the database"""
+    def getexpired(self):
+        """The number of devices removed by expire() so far"""
+        return self.expired
+
+    def newtoken(self, network):
+        """Get the token of a networkID, assigning a new random token
+        if it does not have one yet"""
+        with self.lock:
+            token = self.tokens.get(network)
+            if token is None:
+                token = os.urandom(self.token_length)
+                while token in self.routes:
+                    token = os.urandom(self.token_length)
+                self.routes[token] = Network(network)
+                self.tokens[network] = token
+            return token
+
+    def gettoken(self, network):
+        """Get the token of a networkID, return None if it has none"""
+        return self.tokens.get(network)
+
+    def getnetwork(self, token):
+        """Get the networkID of a token, return None if token not found"""
+        entry = self.routes.get(token)
+        if entry is None:
+            return None
+        return entry.network
+
+    def updatepeers(self, entry, side):
+        """Rebuild the peers of a side of a network"""
+        peers = tuple(route.address for (device, route)
+                      in entry.devices.items() if device // 32 == side)
+        if peers:
+            entry.peers[side] = peers
+        else:
+            entry.peers.pop(side, None)
+
+    def addremote(self, network, device, _ip, _port, check=None):
+        """Add a new remote to the database. network is the token
+        of the networkID"""
         # print("Mapped Dev-" + str(device) + " to" + str(ip) + ":" + str(port))
-        self.dict[str(network) + "-" + str(device)] = (_ip, _port)
+        with self.lock:
+            entry = self.routes.get(network)
+            if entry is None:
+                entry = Network(None)
+                self.routes[network] = entry
+            old = entry.devices.get(device)
+            if check is None and old is not None:
+                check = old.check
+            now = time.monotonic()
+            route = Route((_ip, _port), check, now)
+            entry.devices[device] = route
+            self.updatepeers(entry, device // 32)
+            if self.timeout is not None:
+                self.wheel.add(now + self.timeout, (network, device, route))
 
     def getremote(self, network, device):
         """Get the (ip, port) of a device, return
         (None, None) if device not found"""
+        entry = self.routes.get(network)
+        if entry is not None:
+            route = entry.devices.get(device)
+            if route is not None:
+                return route.address
+        return (None, None)
+
+    def getcheck(self, network, device):
+        """Get the integrity check algorithm a device registered with,
+        return None if device not found"""
+        entry = self.routes.get(network)
+        if entry is not None:
+            route = entry.devices.get(device)
+            if route is not None:
+                return route.check
+        return None
+
+    def getpeers(self, network, side):
+        """Get the (ip, port) of each device on a side (UAS_SIDE or
+        GCS_SIDE) of a network"""
+        entry = self.routes.get(network)
+        if entry is None:
+            return ()
+        return entry.peers.get(side, ())
+
+    def seen(self, network, device, now=None):
+        """Record that a packet has been recieved from a device"""
+        if self.timeout is None:
+            return
+        entry = self.routes.get(network)
+        if entry is not None:
+            route = entry.devices.get(device)
+            if route is not None:
+                route.lastseen = time.monotonic() if now is None else now
+
+    def expire(self, now=None):
+        """Remove the devices that haven't been seen for the timeout.
+        Returns the number removed"""
+        if now is None:
+            now = time.monotonic()
+        count = 0
+        with self.lock:
+            for (network, device, route) in self.wheel.advance(now):
+                entry = self.routes.get(network)
+                # the route may have been removed or replaced since
+                if entry is None or entry.devices.get(device) is not route:
+                    continue
+                if now - route.lastseen >= self.timeout:
+                    self.dropremote(network, entry, device)
+                    count += 1
+                else:
+                    self.wheel.add(route.lastseen + self.timeout,
+                                   (network, device, route))
+            self.expired += count
+        return count
+
+    def dropremote(self, network, entry, device):
+        """Remove a remote from a network entry. The caller holds the
+        lock"""
+        del entry.devices[device]
+        self.updatepeers(entry, device // 32)
+        if not entry.devices:
+            del self.routes[network]
+            if entry.network is not None:
+                del self.tokens[entry.network]
+
+    def removeremote(self, network, device):
+        """Remove a remote from the database. The token is freed when
+        the last remote using it is removed"""
+        with self.lock:
+            entry = self.routes.get(network)
+            if entry is None or device not in entry.devices:
+                return None
+            self.dropremote(network, entry, device)
+
+
+class Shareddevicedict():
+    """A Devicedict held in shared memory, for the worker processes of a
+    sharded server. Create it before the workers are forked; a remote
+    added in any worker is then seen by all of them. The table is a fixed
+    size - up to max_networks networks of 128 IPv4 devices each"""
+    # slot states
+    EMPTY = 0
+    USED = 1
+    DELETED = 2
+    # state, networkID, token, number of remotes, then a bitmap of the
+    # devices on each side
+    network_format = struct.Struct(">B32s4sB4I")
+    COUNT_OFFSET = 37
+    side_format = struct.Struct(">I")
+    SIDE_OFFSET = 38
+    # ip, port, check (NO_CHECK if none), used, last seen
+    remote_format = struct.Struct(">4sHBBd")
+    SEEN_OFFSET = 8
+    seen_format = struct.Struct(">d")
+    # state, token, network slot
+    token_format = struct.Struct(">B4sI")
+    MAX_DEVICES = 128
+    NO_CHECK = 0xFF
+
+    def __init__(self, token_length=4, max_networks=1024, timeout=None):
+        if token_length != 4:
+            raise ValueError("Shared tables only support 4 byte tokens")
+        self.token_length = token_length
+        # open addressing, so at most half full
+        self.slots = max_networks * 2
+        self.max_networks = max_networks
+        self.slot_size = (self.network_format.size +
+                          self.MAX_DEVICES * self.remote_format.size)
+        self.token_offset = self.slots * self.slot_size
+        # anonymous shared mapping, inherited by forked workers
+        self.mem = mmap.mmap(-1, self.token_offset +
+                             self.slots * self.token_format.size)
+        # reads are not locked. Each remote is written with a single
+        # pack_into(), so a reader sees the old or new route
+        ctx = multiprocessing.get_context('fork')
+        self.lock = ctx.Lock()
+        # number of networks in the table
+        self.count = ctx.Value('i', 0, lock=False)
+        # number of DELETED slots in the network and token tables. Misses
+        # probe on past them, so the tables are compacted when there are
+        # too many
+        self.deleted = ctx.Value('i', 0, lock=False)
+        self.deleted_tokens = ctx.Value('i', 0, lock=False)
+        self.max_deleted = max(1, self.slots // 4)
+        # a timer wheel can't be shared between processes, so expire()
+        # sweeps through the table once every timeout instead
+        self.timeout = timeout
+        self.expired = ctx.Value('L', 0, lock=False)
+        if timeout is not None:
+            self.tick = min(1.0, timeout / 4)
+            self.sweep = 0
+            self.sweep_size = int(-(-self.slots * self.tick // timeout))
+
+    def findnetwork(self, network):
+        """Returns the slot of a networkID, or None if not found"""
+        slot = zlib.crc32(network) % self.slots
+        for i in range(0, self.slots):
+            (state, slot_network) = self.network_format.unpack_from(
+                self.mem, slot * self.slot_size)[0:2]
+            if state == self.EMPTY:
+                return None
+            if state == self.USED and slot_network == network:
+                return slot
+            slot = (slot + 1) % self.slots
+        return None
+
+    def findtoken(self, token):
+        """Returns the (token slot, network slot) of a token, or
+        (None, None) if not found"""
+        if len(token) != 4:
+            return (None, None)
+        slot = int.from_bytes(token, byteorder='big') % self.slots
+        for i in range(0, self.slots):
+            (state, slot_token, network_slot) = self.token_format.unpack_from(
+                self.mem, self.token_offset + slot * self.token_format.size)
+            if state == self.EMPTY:
+                return (None, None)
+            if state == self.USED and slot_token == token:
+                return (slot, network_slot)
+            slot = (slot + 1) % self.slots
+        return (None, None)
+
+    def freeslot(self, slot, offset, size):
+        """Returns the first unused slot from slot onwards"""
+        while self.mem[offset + slot * size] == self.USED:
+            slot = (slot + 1) % self.slots
+        return slot
+
+    def networkhome(self, slot):
+        """The slot that the probe for the network in slot starts at"""
+        network = self.network_format.unpack_from(
+            self.mem, slot * self.slot_size)[1]
+        return zlib.crc32(network) % self.slots
+
+    def tokenhome(self, slot):
+        """The slot that the probe for the token in slot starts at"""
+        token = self.token_format.unpack_from(
+            self.mem, self.token_offset + slot * self.token_format.size)[1]
+        return int.from_bytes(token, byteorder='big') % self.slots
+
+    def movenetwork(self, src, dst):
+        """Move a network from slot src to the unused slot dst. It is in
+        both until the token points to dst. The caller holds the lock"""
+        old = src * self.slot_size
+        new = dst * self.slot_size
+        self.mem[new + 1:new + self.slot_size] = \
+            self.mem[old + 1:old + self.slot_size]
+        self.mem[new] = self.USED
+        token = self.network_format.unpack_from(self.mem, new)[2]
+        (token_slot, slot) = self.findtoken(token)
+        self.token_format.pack_into(
+            self.mem, self.token_offset + token_slot * self.token_format.size,
+            self.USED, token, dst)
+        self.mem[old] = self.DELETED
+
+    def movetoken(self, src, dst):
+        """Move a token from slot src to the unused slot dst. The caller
+        holds the lock"""
+        size = self.token_format.size
+        old = self.token_offset + src * size
+        new = self.token_offset + dst * size
+        self.mem[new + 1:new + size] = self.mem[old + 1:old + size]
+        self.mem[new] = self.USED
+        self.mem[old] = self.DELETED
+
+    def compacttable(self, offset, size, home, move):
+        """Move each entry of a table back to the first DELETED slot on
+        its probe path, then mark all the DELETED slots EMPTY. A reader
+        racing with this may miss an entry that is being moved. The
+        caller holds the lock"""
+        states = [self.mem[offset + slot * size]
+                  for slot in range(0, self.slots)]
+        # start at an EMPTY slot, which no probe path crosses
         try:
-            return self.dict[str(network) + "-" + str(device)]
-        except KeyError:
+            start = states.index(self.EMPTY)
+        except ValueError:
+            return
+        for i in range(1, self.slots):
+            slot = (start + i) % self.slots
+            if states[slot] != self.USED:
+                continue
+            hole = home(slot)
+            while hole != slot and states[hole] == self.USED:
+                hole = (hole + 1) % self.slots
+            if hole != slot:
+                move(slot, hole)
+                states[hole] = self.USED
+                states[slot] = self.DELETED
+        for (slot, state) in enumerate(states):
+            if state == self.DELETED:
+                self.mem[offset + slot * size] = self.EMPTY
+
+    def compact(self):
+        """Remove the DELETED slots from both tables. The caller holds
+        the lock"""
+        self.compacttable(0, self.slot_size, self.networkhome,
+                          self.movenetwork)
+        self.compacttable(self.token_offset, self.token_format.size,
+                          self.tokenhome, self.movetoken)
+        self.deleted.value = 0
+        self.deleted_tokens.value = 0
+
+    def size(self):
+        """The number of networks in the table"""
+        return self.count.value
+
+    def getexpired(self):
+        """The number of devices removed by expire() so far"""
+        return self.expired.value
+
+    def newtoken(self, network):
+        """Get the token of a networkID, assigning a new random token
+        if it does not have one yet. Returns None if the table is full"""
+        with self.lock:
+            slot = self.findnetwork(network)
+            if slot is not None:
+                return self.network_format.unpack_from(
+                    self.mem, slot * self.slot_size)[2]
+            if self.count.value == self.max_networks:
+                return None
+            token = os.urandom(self.token_length)
+            while self.findtoken(token)[0] is not None:
+                token = os.urandom(self.token_length)
+
+            slot = self.freeslot(zlib.crc32(network) % self.slots, 0,
+                                 self.slot_size)
+            offset = slot * self.slot_size
+            if self.mem[offset] == self.DELETED:
+                self.deleted.value -= 1
+            self.mem[offset:offset + self.slot_size] = bytes(self.slot_size)
+            self.network_format.pack_into(self.mem, offset, self.USED,
+                                          network, token, 0, 0, 0, 0, 0)
+            token_slot = self.freeslot(
+                int.from_bytes(token, byteorder='big') % self.slots,
+                self.token_offset, self.token_format.size)
+            if (self.mem[self.token_offset +
+                         token_slot * self.token_format.size] ==
+                    self.DELETED):
+                self.deleted_tokens.value -= 1
+            self.token_format.pack_into(
+                self.mem, self.token_offset +
+                token_slot * self.token_format.size, self.USED, token, slot)
+            self.count.value += 1
+            return token
+
+    def gettoken(self, network):
+        """Get the token of a networkID, return None if it has none"""
+        slot = self.findnetwork(network)
+        if slot is None:
+            return None
+        return self.network_format.unpack_from(self.mem,
+                                               slot * self.slot_size)[2]
+
+    def getnetwork(self, token):
+        """Get the networkID of a token, return None if token not found"""
+        (token_slot, slot) = self.findtoken(token)
+        if slot is None:
+            return None
+        return self.network_format.unpack_from(self.mem,
+                                               slot * self.slot_size)[1]
+
+    def remoteoffset(self, slot, device):
+        """The offset of a device of the network in slot"""
+        return (slot * self.slot_size + self.network_format.size +
+                device * self.remote_format.size)
+
+    def addremote(self, network, device, _ip, _port, check=None):
+        """Add a new remote to the database. network is the token
+        of the networkID"""
+        if not 0 <= device < self.MAX_DEVICES:
+            return
+        with self.lock:
+            (token_slot, slot) = self.findtoken(network)
+            if slot is None:
+                return
+            offset = self.remoteoffset(slot, device)
+            if not self.remote_format.unpack_from(self.mem, offset)[3]:
+                self.mem[slot * self.slot_size + self.COUNT_OFFSET] += 1
+            if check is None:
+                check = self.NO_CHECK
+            self.remote_format.pack_into(self.mem, offset,
+                                         socket.inet_aton(_ip), _port,
+                                         check, 1, time.monotonic())
+            # set in the side bitmap after the remote is written
+            side = self.sideoffset(slot, device)
+            (bitmap, ) = self.side_format.unpack_from(self.mem, side)
+            self.side_format.pack_into(self.mem, side,
+                                       bitmap | 1 << (device % 32))
+
+    def getremote(self, network, device):
+        """Get the (ip, port) of a device, return
+        (None, None) if device not found"""
+        (token_slot, slot) = self.findtoken(network)
+        if slot is None or not 0 <= device < self.MAX_DEVICES:
             return (None, None)
-            
+        (ip, port, check, used, lastseen) = self.remote_format.unpack_from(
+            self.mem, self.remoteoffset(slot, device))
+        if not used:
+            return (None, None)
+        return (socket.inet_ntoa(ip), port)
+
+    def getcheck(self, network, device):
+        """Get the integrity check algorithm a device registered with,
+        return None if device not found"""
+        (token_slot, slot) = self.findtoken(network)
+        if slot is None or not 0 <= device < self.MAX_DEVICES:
+            return None
+        (ip, port, check, used, lastseen) = self.remote_format.unpack_from(
+            self.mem, self.remoteoffset(slot, device))
+        if not used or check == self.NO_CHECK:
+            return None
+        return check
+
+    def sideoffset(self, slot, device):
+        """The offset of the side bitmap of a device of the network in
+        slot"""
+        return (slot * self.slot_size + self.SIDE_OFFSET +
+                device // 32 * self.side_format.size)
+
+    def getpeers(self, network, side):
+        """Get the (ip, port) of each device on a side (UAS_SIDE or
+        GCS_SIDE) of a network"""
+        (token_slot, slot) = self.findtoken(network)
+        if slot is None or not 0 <= side < self.MAX_DEVICES // 32:
+            return ()
+        (bitmap, ) = self.side_format.unpack_from(
+            self.mem, self.sideoffset(slot, side * 32))
+        peers = []
+        device = side * 32
+        while bitmap:
+            if bitmap & 1:
+                (ip, port, check, used,
+                 lastseen) = self.remote_format.unpack_from(
+                    self.mem, self.remoteoffset(slot, device))
+                if used:
+                    peers.append((socket.inet_ntoa(ip), port))
+            bitmap >>= 1
+            device += 1
+        return peers
+
+    def seen(self, network, device, now=None):
+        """Record that a packet has been recieved from a device"""
+        if self.timeout is None or not 0 <= device < self.MAX_DEVICES:
+            return
+        (token_slot, slot) = self.findtoken(network)
+        if slot is not None:
+            self.seen_format.pack_into(
+                self.mem, self.remoteoffset(slot, device) + self.SEEN_OFFSET,
+                time.monotonic() if now is None else now)
+
+    def expire(self, now=None):
+        """Remove the devices that haven't been seen for the timeout, from
+        the next part of the table. Call every tick from one process.
+        Returns the number removed"""
+        if now is None:
+            now = time.monotonic()
+        count = 0
+        with self.lock:
+            for i in range(0, self.sweep_size):
+                slot = self.sweep
+                self.sweep = (self.sweep + 1) % self.slots
+                fields = self.network_format.unpack_from(
+                    self.mem, slot * self.slot_size)
+                if fields[0] != self.USED:
+                    continue
+                # the devices in the side bitmaps
+                for (side, bitmap) in enumerate(fields[4:]):
+                    device = side * 32
+                    while bitmap:
+                        if bitmap & 1:
+                            lastseen = self.seen_format.unpack_from(
+                                self.mem, self.remoteoffset(slot, device) +
+                                self.SEEN_OFFSET)[0]
+                            if now - lastseen >= self.timeout:
+                                self.dropremote(fields[2], device)
+                                count += 1
+                        bitmap >>= 1
+                        device += 1
+            self.expired.value += count
+        return count
+
     def removeremote(self, network, device):
-        """Remove a remote from the database"""
-        try:
-            del self.dict[str(network) + "-" + str(device)]
-        except KeyError:
+        """Remove a remote from the database. The token is freed when
+        the last remote using it is removed"""
+        if not 0 <= device < self.MAX_DEVICES:
+            return None
+        with self.lock:
+            self.dropremote(network, device)
+
+    def dropremote(self, network, device):
+        """Remove a remote. The caller holds the lock"""
+        (token_slot, slot) = self.findtoken(network)
+        if slot is None:
+            return None
+        offset = self.remoteoffset(slot, device)
+        if not self.remote_format.unpack_from(self.mem, offset)[3]:
             return None
+        side = self.sideoffset(slot, device)
+        (bitmap, ) = self.side_format.unpack_from(self.mem, side)
+        self.side_format.pack_into(self.mem, side,
+                                   bitmap & ~(1 << (device % 32)))
+        self.remote_format.pack_into(self.mem, offset, bytes(4), 0, 0, 0, 0)
+        count = slot * self.slot_size + self.COUNT_OFFSET
+        self.mem[count] -= 1
+        if self.mem[count] == 0:
+            self.mem[slot * self.slot_size] = self.DELETED
+            self.mem[self.token_offset +
+                     token_slot * self.token_format.size] = self.DELETED
+            self.count.value -= 1
+            self.deleted.value += 1
+            self.deleted_tokens.value += 1
+            if (self.deleted.value >= self.max_deleted or
+                    self.deleted_tokens.value >= self.max_deleted):
+                self.compact()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Link scheduler
+#  Chooses which of a client's links (ifaces) carry each data packet, from
+#  estimates of each link's round trip time and loss
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+
+# Via pip
+
+# In this repo
+
+# the policies of a Linkscheduler
+SEND_ALL = 'all'            # every link
+BEST_ONLY = 'best'          # the best link
+BEST_TWO = 'besttwo'        # the best two links
+DEGRADED_ALL = 'degraded'   # the best link, or every link if it's degraded
+PRIORITY = 'priority'       # links in the order added, until a healthy one
+POLICIES = (SEND_ALL, BEST_ONLY, BEST_TWO, DEGRADED_ALL, PRIORITY)
+
+
+class Linkstats():
+    """The round trip time (RTT), jitter and loss estimates of a link,
+    from the probes sent on it that were answered or not. The RTT is
+    smoothed as in TCP (RFC 6298), the jitter is the smoothed change in
+    RTT between probes (as RFC 3550) and the loss is a moving average of
+    probes lost"""
+    __slots__ = ('srtt', 'rttvar', 'jitter', 'lastrtt', 'loss', 'probes',
+                 'sentcount', 'lostcount', 'missed')
+
+    def __init__(self):
+        # sec, or None until a probe is answered
+        self.srtt = None
+        self.rttvar = 0.0
+        self.jitter = 0.0
+        self.lastrtt = None
+        # the fraction of probes lost
+        self.loss = 0.0
+        # sequence number -> time sent, of the probes not yet answered
+        self.probes = {}
+        self.sentcount = 0
+        self.lostcount = 0
+        # the probes lost since the last one answered
+        self.missed = 0
+
+    def sent(self, seq, now):
+        """A probe seq was sent at now"""
+        self.probes[seq] = now
+        self.sentcount += 1
+
+    def answered(self, seq, now, sent=None):
+        """Returns the RTT of the probe seq answered at now, or None if
+        it's not one waiting for an answer. sent is the time the probe was
+        sent, if the answer carries it. Then an answer that comes after
+        the probe was counted lost still gives the RTT"""
+        waiting = self.probes.pop(seq, None)
+        if sent is None:
+            sent = waiting
+        if sent is None:
+            return None
+        self.missed = 0
+        rtt = now - sent
+        if self.lastrtt is not None:
+            self.jitter += (abs(rtt - self.lastrtt) - self.jitter) / 16
+        self.lastrtt = rtt
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += (abs(self.srtt - rtt) - self.rttvar) / 4
+            self.srtt += (rtt - self.srtt) / 8
+        if waiting is not None:
+            self.loss -= self.loss / 8
+        return rtt
+
+    def expire(self, now, timeout):
+        """Count the probes unanswered after timeout (sec) as lost.
+        Returns whether there were any"""
+        lost = [seq for (seq, sent) in self.probes.items()
+                if now - sent > timeout]
+        for seq in lost:
+            del self.probes[seq]
+            self.loss += (1 - self.loss) / 8
+            self.lostcount += 1
+            self.missed += 1
+        return len(lost) > 0
+
+
+class Linkscheduler():
+    """Chooses the links to send each data packet on. A link is any
+    hashable object, added in priority order (highest first).
+    A link is healthy if its loss is at most max_loss and its smoothed RTT
+    at most max_rtt. Links are ranked healthy first, then by their
+    expected time to deliver a packet, srtt / (1 - loss). A link with no
+    answered probes yet is taken as healthy, and ranked after the healthy
+    links measured"""
+    def __init__(self, policy=SEND_ALL, max_rtt=1.0, max_loss=0.1,
+                 probe_timeout=2.0):
+        if policy not in POLICIES:
+            raise ValueError("Unknown link policy " + str(policy))
+        self.policy = policy
+        self.max_rtt = max_rtt
+        self.max_loss = max_loss
+        self.probe_timeout = probe_timeout
+        # link -> Linkstats, in priority order
+        self.links = {}
+        # the last choice, until the links or their estimates change
+        self.chosen = None
+        self.nextexpire = 0
+
+    def addlink(self, link):
+        self.links[link] = Linkstats()
+        self.chosen = None
+
+    def removelink(self, link):
+        self.links.pop(link, None)
+        self.chosen = None
+
+    def probesent(self, link, seq, now):
+        """A probe with sequence number seq was sent on link at now"""
+        stats = self.links.get(link)
+        if stats is not None:
+            stats.sent(seq, now)
+
+    def probeanswered(self, link, seq, now, sent=None):
+        """The answer to probe seq arrived on link at now, with the time
+        it was sent if it carries it. Returns the RTT or None if it wasn't
+        a probe waiting for an answer"""
+        stats = self.links.get(link)
+        if stats is None:
+            return None
+        rtt = stats.answered(seq, now, sent)
+        if rtt is not None:
+            self.chosen = None
+        return rtt
+
+    def ishealthy(self, link):
+        stats = self.links[link]
+        return (stats.loss <= self.max_loss and
+                (stats.srtt is None or stats.srtt <= self.max_rtt))
+
+    def rank(self):
+        """The links, best first"""
+        def cost(link):
+            stats = self.links[link]
+            if stats.srtt is None:
+                return (not self.ishealthy(link), float('inf'))
+            return (not self.ishealthy(link),
+                    stats.srtt / max(1 - stats.loss, 0.01))
+        # sorted() is stable, so equal links stay in priority order
+        return sorted(self.links, key=cost)
+
+    def expire(self, now):
+        """Count the probes unanswered after probe_timeout as lost"""
+        self.nextexpire = now + 0.1
+        for stats in self.links.values():
+            if stats.expire(now, self.probe_timeout):
+                self.chosen = None
+
+    def choose(self, now):
+        """The list of links to send a data packet on at now"""
+        if now >= self.nextexpire:
+            self.expire(now)
+        if self.chosen is None:
+            self.chosen = self.schedule()
+        return self.chosen
+
+    def schedule(self):
+        """The links to send on, by policy"""
+        if self.policy == SEND_ALL or len(self.links) < 2:
+            return list(self.links)
+        if self.policy == PRIORITY:
+            chosen = []
+            for link in self.links:
+                chosen.append(link)
+                if self.ishealthy(link):
+                    break
+            return chosen
+        ranked = self.rank()
+        if self.policy == BEST_ONLY:
+            return ranked[:1]
+        if self.policy == BEST_TWO:
+            return ranked[:2]
+        # DEGRADED_ALL
+        if self.ishealthy(ranked[0]):
+            return ranked[:1]
+        return ranked
+
+    def getstats(self, link):
+        """The Linkstats of a link, or None if it's not one"""
+        return self.links.get(link)
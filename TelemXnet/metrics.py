@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Server metrics
+#  Counters and histograms of the server's traffic, exported in the
+#  Prometheus text format over HTTP or to a file
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+import bisect
+import hashlib
+import http.server
+import os
+import threading
+
+# Via pip
+
+# In this repo
+
+# the counters of the server, and their descriptions
+COUNTERS = {
+    'bad_packets': "Packets that failed to decode or verify",
+    'unknown_route': "Packets for a network with no registered devices",
+    'refused_check': "Packets with an integrity check not allowed",
+    'unknown_device': "Packets from a device that isn't registered",
+    'check_mismatch': "Packets with a different check to the device's",
+    'table_full': "CL_BEGINs refused as the routing table was full",
+    'pings': "CL_SVRPING packets",
+    'duplicates': "Copies of packets not forwarded",
+    'dropped_source': "Packets dropped as their client was over its rate",
+    'dropped_network': "Packets dropped as their network was over its rate",
+    'shed': "Packets dropped as the server was over its rate",
+    'rejected': "Datagrams rejected as not a packet, before decoding",
+    'blocklisted': "Sources blocked for sending invalid packets",
+    'blocked': "Packets dropped as their source was blocked",
+}
+
+# the per network counters
+NETWORK_COUNTERS = [('packets_in', "Packets recieved"),
+                    ('bytes_in', "Bytes recieved"),
+                    ('packets_out', "Packets forwarded"),
+                    ('bytes_out', "Bytes forwarded")]
+
+
+def networklabel(network):
+    """The label of a network in the metrics - the start of the SHA-256
+    of its NetworkID, which can't be used to route packets"""
+    return hashlib.sha256(network).hexdigest()[0:16]
+
+
+class Histogram():
+    """Counts of observed values in buckets, as a Prometheus histogram.
+    buckets is the sorted list of upper bounds"""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels=''):
+        """The lines of the histogram, in the Prometheus text format"""
+        lines = []
+        total = 0
+        for (bound, count) in zip(self.buckets + ['+Inf'], self.counts):
+            total += count
+            lines.append(name + '_bucket{' + labels + 'le="' + str(bound) +
+                         '"} ' + str(total))
+        lines.append(name + '_sum ' + str(self.sum))
+        lines.append(name + '_count ' + str(self.count))
+        return lines
+
+
+class Metrics():
+    """The counters, histograms and gauges of a server. Updates are plain
+    increments with no lock, so from the threaded engine the odd update
+    may be lost.
+    getnetwork(token) is the NetworkID of a network in the routing table,
+    or None if it has gone. The counters of networks that have gone are
+    dropped when exported. The token is a routing credential, so networks
+    are labelled with a hash of the NetworkID instead"""
+    def __init__(self, prefix='telemxnet_', getnetwork=None):
+        self.prefix = prefix
+        self.getnetwork = getnetwork
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        # network token -> list of NETWORK_COUNTERS
+        self.networks = {}
+        # name -> (description, Histogram)
+        self.histograms = {}
+        # name -> (description, function returning the value)
+        self.gauges = {}
+
+    def inc(self, name, count=1):
+        """Add to a counter"""
+        self.counters[name] += count
+
+    def network(self, network):
+        """The list of counters of a network, to add to"""
+        counters = self.networks.get(network)
+        if counters is None:
+            counters = self.networks.setdefault(network,
+                                                [0] * len(NETWORK_COUNTERS))
+        return counters
+
+    def removenetwork(self, network):
+        """Drop the counters of a network that has gone"""
+        self.networks.pop(network, None)
+
+    def prune(self):
+        """Drop the counters of all the networks that have gone, and
+        return the (label, counters) of the rest"""
+        networks = []
+        for (token, counters) in list(self.networks.items()):
+            network = (token if self.getnetwork is None
+                       else self.getnetwork(token))
+            if network is None:
+                self.removenetwork(token)
+            else:
+                networks.append((networklabel(network), counters))
+        return networks
+
+    def histogram(self, name, description, buckets):
+        """Add a histogram, and return it"""
+        histogram = Histogram(buckets)
+        self.histograms[name] = (description, histogram)
+        return histogram
+
+    def gauge(self, name, description, func):
+        """Add a gauge, whose value is func() when exported"""
+        self.gauges[name] = (description, func)
+
+    def render(self):
+        """All the metrics, in the Prometheus text format"""
+        lines = []
+        for (name, description) in COUNTERS.items():
+            fullname = self.prefix + name + '_total'
+            lines += ['# HELP ' + fullname + ' ' + description,
+                      '# TYPE ' + fullname + ' counter',
+                      fullname + ' ' + str(self.counters[name])]
+        networks = self.prune()
+        for (i, (name, description)) in enumerate(NETWORK_COUNTERS):
+            name = self.prefix + 'network_' + name + '_total'
+            lines += ['# HELP ' + name + ' ' + description + ' per network',
+                      '# TYPE ' + name + ' counter']
+            lines += [name + '{network="' + label + '"} ' +
+                      str(counters[i]) for (label, counters) in networks]
+        for (name, (description, histogram)) in self.histograms.items():
+            name = self.prefix + name
+            lines += ['# HELP ' + name + ' ' + description,
+                      '# TYPE ' + name + ' histogram']
+            lines += histogram.render(name)
+        for (name, (description, func)) in self.gauges.items():
+            name = self.prefix + name
+            lines += ['# HELP ' + name + ' ' + description,
+                      '# TYPE ' + name + ' gauge',
+                      name + ' ' + str(func())]
+        return '\n'.join(lines) + '\n'
+
+
+class StatsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        """Return the metrics for any path"""
+        body = self.server.metrics.render().encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Statsserver():
+    """Serves the metrics over HTTP, for Prometheus to scrape or to
+    curl"""
+    def __init__(self, metrics, address="127.0.0.1", port=16280):
+        self.server = http.server.ThreadingHTTPServer((address, port),
+                                                      StatsHandler)
+        self.server.metrics = metrics
+        self.server_thread = threading.Thread(
+            target=self.server.serve_forever)
+
+    def run(self):
+        self.server_thread.start()
+
+    def close(self):
+        if self.server_thread.is_alive():
+            self.server.shutdown()
+        self.server.server_close()
+
+
+class Statsfile():
+    """Writes the metrics to a file every interval seconds, for the
+    Prometheus node exporter textfile collector"""
+    def __init__(self, metrics, path, interval=10):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.runwriter)
+
+    def write(self):
+        """Write the file. It is replaced in one go, so it's never seen
+        half written"""
+        with open(self.path + '.tmp', 'w') as f:
+            f.write(self.metrics.render())
+        os.replace(self.path + '.tmp', self.path)
+
+    def runwriter(self):
+        while not self.stop.wait(self.interval):
+            self.write()
+
+    def run(self):
+        self.thread.start()
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+        self.write()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Rate limits
+#  Token buckets limiting the packet rate of each source and network, and
+#  of the whole server
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+
+# Via pip
+
+# In this repo
+
+
+def evictoldest(entries):
+    """Remove the oldest entry of a dict, to keep it bounded"""
+    try:
+        entries.pop(next(iter(entries)), None)
+    except (StopIteration, RuntimeError):
+        # emptied or changed by another thread
+        pass
+
+
+class Tokenbucket():
+    """Allows rate packets/sec on average, and bursts of up to burst
+    packets (default is 1 sec worth)"""
+    __slots__ = ('rate', 'burst', 'level', 'last')
+
+    def __init__(self, rate, burst=None, now=0.0):
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+        self.level = self.burst
+        self.last = now
+
+    def take(self, now, reserve=0):
+        """Take a token at time now (sec). Returns False if there isn't
+        one to spare, leaving reserve tokens in the bucket"""
+        level = min(self.burst, self.level + (now - self.last) * self.rate)
+        self.last = now
+        if level < 1 + reserve:
+            self.level = level
+            return False
+        self.level = level - 1
+        return True
+
+
+class Bucketmap():
+    """A Tokenbucket per key. The oldest bucket is removed when the map
+    would grow past max_entries, so a flood of new keys can't use up the
+    memory, or wipe out the buckets of the other keys"""
+    def __init__(self, rate, burst=None, max_entries=65536):
+        self.rate = rate
+        self.burst = burst
+        self.max_entries = max_entries
+        self.buckets = {}
+
+    def take(self, key, now):
+        """Take a token from the bucket of key at time now (sec)"""
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_entries:
+                evictoldest(self.buckets)
+            bucket = Tokenbucket(self.rate, self.burst, now)
+            self.buckets[key] = bucket
+        return bucket.take(now)
+
+
+class Ratelimits():
+    """The rate limits of a server, in packets/sec. Each is None for no
+    limit. source_rate is per (ip, port) of a client and network_rate per
+    network. max_rate is for the whole server - when it is exceeded, data
+    packets are dropped first, leaving reserve (a fraction of a second's
+    worth of packets) for control packets.
+    Like the metrics, the buckets are not locked, so are approximate under
+    the threaded engine"""
+    def __init__(self, source_rate=None, network_rate=None, max_rate=None,
+                 reserve=0.2):
+        self.sources = None
+        if source_rate is not None:
+            self.sources = Bucketmap(source_rate)
+        self.networks = None
+        if network_rate is not None:
+            self.networks = Bucketmap(network_rate)
+        self.server = None
+        if max_rate is not None:
+            self.server = Tokenbucket(max_rate)
+            self.reserve = max_rate * reserve
+
+    def checksource(self, address, now):
+        """Returns False if a packet from address is over its limit"""
+        return self.sources is None or self.sources.take(address, now)
+
+    def checknetwork(self, network, now):
+        """Returns False if a packet of network (its session token) is
+        over its limit"""
+        return self.networks is None or self.networks.take(network, now)
+
+    def checkload(self, control, now):
+        """Returns False if a packet should be shed as the server is over
+        its limit. control is True for control packets"""
+        if self.server is None:
+            return True
+        return self.server.take(now, 0 if control else self.reserve)
+
+
+class Blocklist():
+    """Blocks the sources (ip, port) that send invalid packets - more than
+    burst of them, then more than rate/sec - for block_time sec. The
+    source address of a UDP packet is easily spoofed, so a source can be
+    exempted from blocking, and the oldest block is removed when there
+    are more than max_entries"""
+    def __init__(self, rate=1, burst=20, block_time=60, max_entries=65536):
+        self.errors = Bucketmap(rate, burst, max_entries)
+        self.block_time = block_time
+        self.max_entries = max_entries
+        # source -> time (sec) it is blocked until
+        self.blocked = {}
+
+    def isblocked(self, address, now):
+        """Returns True if address is blocked at time now (sec)"""
+        until = self.blocked.get(address)
+        if until is None:
+            return False
+        if now < until:
+            return True
+        self.blocked.pop(address, None)
+        return False
+
+    def invalid(self, address, now, exempt=None):
+        """Record an invalid packet from address at time now (sec).
+        Returns True if this blocks the address. If exempt(address) is
+        True, it is not blocked and gets a full allowance again"""
+        if self.errors.take(address, now):
+            return False
+        if exempt is not None and exempt(address):
+            self.errors.buckets.pop(address, None)
+            return False
+        if len(self.blocked) >= self.max_entries:
+            evictoldest(self.blocked)
+        self.blocked[address] = now + self.block_time
+        # a full allowance again once unblocked
+        self.errors.buckets.pop(address, None)
+        return True
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Sliding window of recieved sequence numbers
+#  For passing on the first copy (or first few copies) of each packet,
+#  in any order
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+
+# Via pip
+
+# In this repo
+
+
+class Seqwindow():
+    """A bitmap of which of the last size sequence numbers have been
+    recieved. Sequence numbers wrap around at 65536, so a sequence number
+    up to half way round ahead of the newest is newer, otherwise it's
+    older. Older than the window is a late copy (eg. from a lagging link)
+    unless restart of them in a row are recieved, meaning the sender has
+    restarted"""
+    def __init__(self, size=1024, modulus=65536, restart=32):
+        self.size = size
+        self.modulus = modulus
+        self.restart = restart
+        self.mask = (1 << size) - 1
+        # the newest sequence number, and a bitmap of the sequence numbers
+        # before it. Bit n is set if newest-n has been recieved
+        self.newest = None
+        self.bitmap = 0
+        # the number of sequence numbers in a row older than the window
+        self.stale = 0
+
+    def checkseq(self, seq):
+        """Returns True the first time seq is recieved, False if it's a
+        repeat or older than the window. After restart in a row older than
+        the window, the sender has restarted, so starts a new window"""
+        if self.newest is None:
+            self.newest = seq
+            self.bitmap = 1
+            return True
+
+        ahead = (seq - self.newest) % self.modulus
+        if ahead < self.modulus // 2 or self.modulus - ahead < self.size:
+            self.stale = 0
+        if ahead == 0:
+            return False
+        if ahead < self.modulus // 2:
+            # newer - slide the window forward
+            if ahead < self.size:
+                self.bitmap = ((self.bitmap << ahead) | 1) & self.mask
+            else:
+                self.bitmap = 1
+            self.newest = seq
+            return True
+
+        behind = self.modulus - ahead
+        if behind >= self.size:
+            # too old, so a late copy unless the sender has restarted
+            self.stale += 1
+            if self.stale < self.restart:
+                return False
+            self.stale = 0
+            self.newest = seq
+            self.bitmap = 1
+            return True
+        if self.bitmap & (1 << behind):
+            return False
+        self.bitmap |= 1 << behind
+        return True
+
+
+class Seqcounter():
+    """As Seqwindow, but counts how many times each of the last size
+    sequence numbers has been recieved. size must divide the modulus"""
+    def __init__(self, size=1024, modulus=65536, restart=32):
+        self.size = size
+        self.modulus = modulus
+        self.restart = restart
+        # the newest sequence number, and the count of each sequence
+        # number in the window, at seq % size
+        self.newest = None
+        self.counts = bytearray(size)
+        # the number of sequence numbers in a row older than the window
+        self.stale = 0
+
+    def countseq(self, seq):
+        """Returns the number of times seq has been recieved before (up
+        to 255), or 255 if it's older than the window. After restart in a
+        row older than the window, the sender has restarted, so starts a
+        new window"""
+        if self.newest is None:
+            self.newest = seq
+        ahead = (seq - self.newest) % self.modulus
+        if ahead < self.modulus // 2 or self.modulus - ahead < self.size:
+            self.stale = 0
+        if 0 < ahead < self.modulus // 2:
+            # newer - slide the window forward, clearing the counts of the
+            # sequence numbers skipped over
+            if ahead < self.size:
+                start = (self.newest + 1) % self.size
+                end = start + ahead
+                if end <= self.size:
+                    self.counts[start:end] = bytes(ahead)
+                else:
+                    self.counts[start:] = bytes(self.size - start)
+                    self.counts[:end - self.size] = bytes(end - self.size)
+            else:
+                self.counts = bytearray(self.size)
+            self.newest = seq
+        elif ahead != 0 and self.modulus - ahead >= self.size:
+            # too old, so a late copy unless the sender has restarted
+            self.stale += 1
+            if self.stale < self.restart:
+                return 255
+            self.stale = 0
+            self.counts = bytearray(self.size)
+            self.newest = seq
+
+        count = self.counts[seq % self.size]
+        if count < 255:
+            self.counts[seq % self.size] = count + 1
+        return count
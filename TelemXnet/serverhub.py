@@ -23,11 +23,15 @@
 #
 
 # Default python libs
+import asyncio
 import threading
+import itertools
+import multiprocessing
 import socket
 import select
 import errno
 import socketserver
+import time
 
 # Via pip
 #from gevent.server import DatagramServer
@@ -36,57 +40,272 @@ import socketserver
 
 # In this repo
 from TelemXnet import unipacket
+from TelemXnet import batchio
 from TelemXnet import devicedict
+from TelemXnet import metrics
+from TelemXnet import ratelimit
+from TelemXnet import seqwindow
 from TelemXnet import util
 
 
-devicedb = devicedict.Devicedict()
+devicedb = devicedict.Devicedict(unipacket.TOKEN_LENGTH)
+# pool of packet decode buffers, shared between the handler threads
+rxbuffers = []
+# histogram buckets of the handler latency (sec) and fan-out size
+LATENCY_BUCKETS = [0.00001, 0.00002, 0.00005, 0.0001, 0.0002, 0.0005,
+                   0.001, 0.002, 0.005, 0.01]
+FANOUT_BUCKETS = [0, 1, 2, 4, 8, 16, 32]
 
-class ThreadedUDPRequestHandler(socketserver.BaseRequestHandler):
-        
-    def handle(self):
+
+class Router():
+    """The receive/route/send path of the server, shared by each of the
+    engines. The engine passes in each recieved datagram and a function
+    to send datagrams with"""
+
+    def __init__(self, checks=None, key=None, verify='all', sample_rate=100,
+                 db=None, copies=None, limits=None, blocklist=None):
+        """Contstructor. limits is a ratelimit.Ratelimits, or None for no
+        limits. blocklist is a ratelimit.Blocklist of the sources sending
+        invalid packets, or None for no blocking. See ServerHub for the
+        other options"""
+        if verify not in ('all', 'sample', 'control'):
+            raise ValueError("Unknown verify mode " + str(verify))
+        # the packet codec holds no per-packet state, so is shared. It
+        # only accepts the allowed checks, which by default are HMAC with
+        # a key, or the unkeyed checks without one
+        self.pkt = unipacket.Unipacket(key=key, accept=checks)
+        self.checks = sorted(self.pkt.accept)
+        # codecs for replying to clients with their own integrity check
+        self.pkts = {check: unipacket.Unipacket(check, key)
+                     for check in self.checks}
+        self.verify = verify
+        self.sample_rate = sample_rate
+        self.verify_count = itertools.count()
+        self.devicedb = devicedb if db is None else db
+        # copies forwarded of each sequence number, per (network, hub)
+        self.copies = copies
+        self.seqcounters = {}
+        # the networks of the counters are checked when there are this
+        # many, as routes can go without a CL_END
+        self.prune_at = 64
+        self.limits = limits
+        self.blocklist = blocklist
+        # (ip, port) -> (token, device) of the clients that have
+        # registered, which are never blocked
+        self.registered = {}
+        self.metrics = metrics.Metrics(
+            getnetwork=lambda token: self.devicedb.getnetwork(token))
+        self.latency = self.metrics.histogram(
+            'handler_seconds', "Time to handle a packet", LATENCY_BUCKETS)
+        self.fanout = self.metrics.histogram(
+            'fanout_size', "Clients each data packet is forwarded to",
+            FANOUT_BUCKETS)
+        self.metrics.gauge('route_networks', "Networks in the routing table",
+                           self.devicedb.size)
+        self.metrics.gauge('expired_routes', "Devices removed as idle",
+                           self.devicedb.getexpired)
+        if blocklist is not None:
+            self.metrics.gauge('blocked_sources', "Sources blocked",
+                               lambda: len(blocklist.blocked))
+
+    def sampleverify(self):
+        """Returns True if the next data packet should have its check
+        value verified, depending on the verify mode"""
+        if self.verify == 'all':
+            return True
+        if self.verify == 'sample':
+            return next(self.verify_count) % self.sample_rate == 0
+        return False
+
+    def handle(self, data, client_address, sendto):
         """Handle a recived packet - process it and send it out
-        to any applicable clients"""
-        self.pkt = unipacket.Unipacket()
+        to any applicable clients via sendto(data, address)"""
+        start = time.perf_counter()
+        self.handlepacket(data, client_address, sendto, start)
+        self.latency.observe(time.perf_counter() - start)
+
+    def handlepacket(self, data, client_address, sendto, now):
+        """handle(), without the timing. now is the time (sec) the packet
+        was recieved, for the rate limits"""
         # assume single complete packet has been recieved
         # send the id's to database
-        data = self.request[0]
         if not data:
             return
+        if self.blocklist and self.blocklist.isblocked(client_address, now):
+            self.metrics.inc('blocked')
+            return
+        # reject junk before any decoding
+        if not self.pkt.precheck(data):
+            self.metrics.inc('rejected')
+            self.invalid(client_address, now)
+            return
+        if self.limits and not self.limits.checksource(client_address, now):
+            self.metrics.inc('dropped_source')
+            return
 
-        socket = self.request[1]
-        
-        client_address = self.client_address
-        recv_data = self.pkt.recoverpacket(data)
+        # only the header is needed to route the packet
+        recv_data = self.pkt.recoverheader(data)
+        if not recv_data:
+            self.metrics.inc('bad_packets')
+            self.invalid(client_address, now)
+            return
+        if self.limits:
+            # per session token, so a network has one bucket whichever
+            # header it uses, and only networks in the routing table have
+            # one, so made up NetworkIDs can't push theirs out
+            token = self.networktoken(recv_data)
+            if (token is not None and
+                    not self.limits.checknetwork(token, now)):
+                self.metrics.inc('dropped_network')
+                return
+            if not self.limits.checkload(recv_data.DeviceID < 0, now):
+                self.metrics.inc('shed')
+                return
+
+        # control packets (-ve DeviceID) are always fully verified, data
+        # packets depend on the verify mode of the server
+        if recv_data.DeviceID >= 0 and not self.sampleverify():
+            self.route(sendto, client_address, data, recv_data)
+            return
+
+        # decode into a buffer from the pool, so the packet fields are
+        # not copied out
+        try:
+            rxbuf = rxbuffers.pop()
+        except IndexError:
+            rxbuf = self.pkt.newbuffer()
+        recv_data = self.pkt.recoverpacket_into(data, rxbuf)
 
         # bad packet
         if not recv_data:
-            print("bad data")
+            self.metrics.inc('bad_packets')
+            self.invalid(client_address, now)
+        else:
+            self.route(sendto, client_address, data, recv_data)
+        rxbuffers.append(rxbuf)
+
+    def networktoken(self, recv_data):
+        """Returns the session token of the network of a packet, or None
+        if the network is not in the routing table"""
+        if recv_data.Flags & unipacket.FLAG_TOKEN:
+            token = bytes(recv_data.NetworkID)
+            if self.devicedb.getnetwork(token) is None:
+                return None
+            return token
+        return self.devicedb.gettoken(bytes(recv_data.NetworkID))
+
+    def invalid(self, client_address, now):
+        """Count an invalid packet from a client against the blocklist"""
+        if self.blocklist and self.blocklist.invalid(client_address, now,
+                                                     self.isregistered):
+            self.metrics.inc('blocklisted')
+
+    def isregistered(self, client_address):
+        """Returns True if a device is registered from client_address. Its
+        packets may be spoofed, but it still mustn't be blocked"""
+        entry = self.registered.get(client_address)
+        if entry is None:
+            return False
+        if self.devicedb.getremote(*entry) == tuple(client_address):
+            return True
+        self.registered.pop(client_address, None)
+        return False
+
+    def route(self, sendto, client_address, data, recv_data):
+        """Process a decoded packet and send it out to any applicable
+        clients"""
+
+        # Control packet if -ve and CL_BEGIN - add a client, using the
+        # integrity check algorithm of the CL_BEGIN for that device
+        check = recv_data.Flags & unipacket.CHECK_MASK
+        begin = (recv_data.DeviceID < 0 and
+                 recv_data.Payload in (b'CL_BEGIN', b'CL_BEGIN+TOKEN'))
+        # unverified packets haven't been through the codec, so are
+        # checked here too
+        if check not in self.checks:
+            self.metrics.inc('refused_check')
             return
 
+        # the database is keyed on the session token of the network. Packets
+        # with a compact header carry the token instead of the NetworkID
+        if recv_data.Flags & unipacket.FLAG_TOKEN:
+            network_id = bytes(recv_data.NetworkID)
+            if self.devicedb.getnetwork(network_id) is None:
+                self.metrics.inc('unknown_route')
+                return
+        elif begin:
+            network_id = self.devicedb.newtoken(bytes(recv_data.NetworkID))
+            if network_id is None:
+                self.metrics.inc('table_full')
+                return
+        else:
+            network_id = self.devicedb.gettoken(bytes(recv_data.NetworkID))
+            if network_id is None:
+                self.metrics.inc('unknown_route')
+                return
+        counters = self.metrics.network(network_id)
+        counters[0] += 1
+        counters[1] += len(data)
+
         # search through db for any clients to send to
         # UAV side id device 0-31, GCS side 32-63
 
-        # Control packet if -ve and CL_BEGIN - add a client
-        if recv_data.DeviceID < 0 and recv_data.Payload == b'CL_BEGIN':
+        if begin:
             # control packet
             # print("Got Control Packet from " + str(recv_data.NetworkID) + "-"
             #  + str(-recv_data.DeviceID))
-            devicedb.addremote(recv_data.NetworkID, -recv_data.DeviceID,
-                                    client_address[0], client_address[1])
+            if (len(self.seqcounters) + len(self.metrics.networks) >=
+                    self.prune_at):
+                self.prune()
+            self.devicedb.addremote(network_id, -recv_data.DeviceID,
+                                    client_address[0], client_address[1],
+                                    check)
+            if self.blocklist:
+                if len(self.registered) >= self.blocklist.max_entries:
+                    ratelimit.evictoldest(self.registered)
+                self.registered[tuple(client_address)] = (
+                    network_id, -recv_data.DeviceID)
+            # reply with the session token if the client asked for it
+            if recv_data.Payload == b'CL_BEGIN+TOKEN':
+                msg = self.pkts[check].buildpacket(
+                    bytes(recv_data.NetworkID), recv_data.DeviceID,
+                    recv_data.Sequence, b'CL_TOKEN' + network_id)
+                sendto(msg, client_address)
+                counters[2] += 1
+                counters[3] += len(msg)
             return
+        # all other packets must be from a registered device, using the
+        # integrity check it registered with
+        reg_check = self.devicedb.getcheck(network_id,
+                                           abs(recv_data.DeviceID))
+        if reg_check is None:
+            self.metrics.inc('unknown_device')
+            return
+        if reg_check != check:
+            self.metrics.inc('check_mismatch')
+            return
+        self.devicedb.seen(network_id, abs(recv_data.DeviceID))
         # control packet to remove client
         if recv_data.DeviceID < 0 and recv_data.Payload == b'CL_END':
             # control packet
             # print("Got Control Packet from " + str(recv_data.NetworkID) + "-"
             #  + str(-recv_data.DeviceID))
-            devicedb.removeremote(recv_data.NetworkID, -recv_data.DeviceID)
+            self.devicedb.removeremote(network_id, -recv_data.DeviceID)
+            if self.devicedb.getnetwork(network_id) is None:
+                for key in [key for key in self.seqcounters
+                            if key[0] == network_id]:
+                    self.seqcounters.pop(key, None)
+                self.metrics.removenetwork(network_id)
             return
-        # control packet for a server ping - just return the same packet
-        if recv_data.DeviceID < 0 and recv_data.Payload == b'CL_SVRPING':
-            print("Got ping from seq " + str(recv_data.Sequence))
-            self.senddevice(socket, recv_data.NetworkID, -recv_data.DeviceID,
-                            data)
+        # control packet for a server ping, or a client's link probe (with
+        # its timestamp after) - just return the same packet
+        if (recv_data.DeviceID < 0 and
+                recv_data.Payload[:10] == b'CL_SVRPING'):
+            self.metrics.inc('pings')
+            if self.senddevice(sendto, network_id, -recv_data.DeviceID,
+                               data):
+                counters[2] += 1
+                counters[3] += len(data)
             return
         # print("Got " + str(recv_data.NetworkID) + "-" +
         # str(recv_data.DeviceID) + " from " + str(self.client_address[0]) +
@@ -95,45 +314,331 @@ class ThreadedUDPRequestHandler(socketserver.BaseRequestHandler):
         # only return non-server packets (ie. device_id >= 0)
         if recv_data.DeviceID >= 0 and recv_data.DeviceID < 32:
             # packet from UAS side
-            for i in range(32, 63):
-                self.senddevice(socket, recv_data.NetworkID, i, data)
+            side = devicedict.GCS_SIDE
         elif recv_data.DeviceID >= 0:
             # packet from GCS side
-            for i in range(1, 31):
-                self.senddevice(socket, recv_data.NetworkID, i, data)
+            side = devicedict.UAS_SIDE
+        else:
+            return
+        # a client sends a copy of each packet on each of its links. Only
+        # forward the first few. Each hub has its own sequence numbers
+        if self.copies is not None:
+            key = (network_id, recv_data.DeviceID // unipacket.HUB_DEVICES)
+            counter = self.seqcounters.get(key)
+            if counter is None:
+                counter = self.seqcounters.setdefault(key,
+                                                      seqwindow.Seqcounter())
+            if counter.countseq(recv_data.Sequence) >= self.copies:
+                self.metrics.inc('duplicates')
+                return
+        peers = self.devicedb.getpeers(network_id, side)
+        for address in peers:
+            sendto(data, address)
+        self.fanout.observe(len(peers))
+        counters[2] += len(peers)
+        counters[3] += len(peers) * len(data)
 
-    def senddevice(self, socket, network_id, device_id, data):
-        """Send a packet to a client via a database lookup"""
-        (ip_ret, port) = devicedb.getremote(network_id, device_id)
+    def prune(self):
+        """Drop the sequence counters and metrics of the networks that
+        have gone from the routing table, eg. by expiry"""
+        for key in list(self.seqcounters):
+            if self.devicedb.getnetwork(key[0]) is None:
+                self.seqcounters.pop(key, None)
+        self.metrics.prune()
+        self.prune_at = max(64, 2 * (len(self.seqcounters) +
+                                     len(self.metrics.networks)))
+
+    def senddevice(self, sendto, network_id, device_id, data):
+        """Send a packet to a client via a database lookup. Returns True
+        if the client was found"""
+        (ip_ret, port) = self.devicedb.getremote(network_id, device_id)
 
         if ip_ret and port:
             ret_address = (ip_ret, port)
-            #t = threading.Thread(target=socket.sendto, args=(data, ret_address))
-            #t.start()
-            socket.sendto(data, ret_address)
+            sendto(data, ret_address)
             # print("Sent ")
+            return True
+        return False
+
+
+def runexpiry(db, stop):
+    """Expire the idle routes of a database every tick, until stop is
+    set"""
+    while not stop.wait(db.tick):
+        db.expire()
+
+
+class ThreadedUDPRequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        """Handle a recived packet in its own thread"""
+        self.server.router.handle(self.request[0], self.client_address,
+                                  self.request[1].sendto)
+
 
 class ThreadedUDPServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
     pass
-    
+
+
+class AsyncUDPProtocol(asyncio.DatagramProtocol):
+    """Handles all recived packets on a single event loop"""
+
+    def __init__(self, router):
+        self.router = router
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.router.handle(data, addr, self.transport.sendto)
+
+
 class ServerHub():
     """This class is a small UAVNet server. All clients connect to this. The
     server will route packets as required to the clients"""
 
-    def __init__(self, address="127.0.0.1", portin=16250):
+    def __init__(self, address="127.0.0.1", portin=16250, checks=None,
+                 key=None, verify='all', sample_rate=100, engine='threaded',
+                 reuseport=False, db=None, route_timeout=None, copies=None,
+                 stats_port=None, stats_file=None, stats_interval=10,
+                 source_rate=None, network_rate=None, max_rate=None,
+                 block_time=None, stats_ip="127.0.0.1"):
         """Contstructor. Can override the IP and port that the server is
-        bound to"""
-        self.server = ThreadedUDPServer((address, portin), ThreadedUDPRequestHandler)
-        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        bound to. checks is the list of integrity check algorithms that
+        clients may send with (default is only unipacket.CHECK_HMAC if
+        there's a key, otherwise the unkeyed checks). key is the shared
+        secret for clients using unipacket.CHECK_HMAC.
+        verify sets which packets have their check value verified before
+        forwarding - 'all', 'sample' (1 in every sample_rate data packets)
+        or 'control' (control packets only). Control packets are always
+        verified. Unverified packets are still checked at the far end.
+        engine is 'threaded' (a new thread per packet), 'asyncio' (all
+        packets handled on one event loop) or 'batched' (one thread,
+        sending and recieving many packets per syscall - see batchio).
+        reuseport lets other servers bind the same port, and db is the
+        device database to use instead of the module one - see
+        ShardedServerHub.
+        If route_timeout (sec) is given, the server has its own device
+        database, and removes devices that haven't sent a packet for that
+        long.
+        copies is the number of copies of each data packet (the same
+        sequence number from the same hub, one per link of the hub -
+        see unipacket.HUB_DEVICES) that are forwarded. Default is all of them. Unverified
+        packets are counted too, so use more than 1 copy if not verifying
+        all packets.
+        The metrics of the server (see metrics.Metrics) are served over
+        HTTP on stats_port of stats_ip (default is localhost only), and/or
+        written to the stats_file every stats_interval (sec), in the
+        Prometheus text format.
+        source_rate, network_rate and max_rate limit the packets/sec from
+        each client (ip, port), of each network and of the whole server
+        (see ratelimit.Ratelimits). Packets over the limits are dropped
+        before being decoded. Default is no limits.
+        If block_time (sec) is given, a client (ip, port) that keeps
+        sending invalid packets is blocked for that long, unless a device
+        is registered from it. Default is never"""
+        if engine not in ('threaded', 'asyncio', 'batched'):
+            raise ValueError("Unknown engine " + str(engine))
+        self.expiry_thread = None
+        if route_timeout is not None and db is None:
+            db = devicedict.Devicedict(unipacket.TOKEN_LENGTH, route_timeout)
+            self.expiry_stop = threading.Event()
+            self.expiry_thread = threading.Thread(
+                target=runexpiry, args=(db, self.expiry_stop))
+        limits = None
+        if (source_rate is not None or network_rate is not None or
+                max_rate is not None):
+            limits = ratelimit.Ratelimits(source_rate, network_rate,
+                                          max_rate)
+        blocklist = None
+        if block_time:
+            blocklist = ratelimit.Blocklist(block_time=block_time)
+        self.router = Router(checks, key, verify, sample_rate, db, copies,
+                             limits, blocklist)
+        self.statsserver = None
+        if stats_port is not None:
+            self.statsserver = metrics.Statsserver(self.router.metrics,
+                                                   stats_ip, stats_port)
+        self.statsfile = None
+        if stats_file is not None:
+            self.statsfile = metrics.Statsfile(self.router.metrics,
+                                               stats_file, stats_interval)
+        self.engine = engine
+        if engine == 'threaded':
+            self.server = ThreadedUDPServer((address, portin),
+                                            ThreadedUDPRequestHandler,
+                                            bind_and_activate=False)
+            if reuseport:
+                self.server.socket.setsockopt(socket.SOL_SOCKET,
+                                              socket.SO_REUSEPORT, 1)
+            try:
+                self.server.server_bind()
+            except OSError:
+                self.server.server_close()
+                raise
+            self.server.router = self.router
+            self.server_thread = threading.Thread(
+                target=self.server.serve_forever)
+        else:
+            # bind now, so any error is raised here as per the threaded
+            # engine
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if reuseport:
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT,
+                                     1)
+            try:
+                self.sock.bind((address, portin))
+            except OSError:
+                self.sock.close()
+                raise
+        if engine == 'asyncio':
+            self.loop = asyncio.new_event_loop()
+            self.server_thread = threading.Thread(target=self.runloop)
+        elif engine == 'batched':
+            self.batchsock = batchio.Batchsocket(self.sock)
+            self.stop = threading.Event()
+            self.server_thread = threading.Thread(target=self.runbatched)
+
+    def runloop(self):
+        """Run the asyncio engine until close()"""
+        asyncio.set_event_loop(self.loop)
+        (transport, protocol) = self.loop.run_until_complete(
+            self.loop.create_datagram_endpoint(
+                lambda: AsyncUDPProtocol(self.router), sock=self.sock))
+        self.loop.run_forever()
+        transport.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+
+    def runbatched(self):
+        """Run the batched engine until close(). Each wakeup handles all
+        the waiting datagrams, then sends all the datagrams to forward"""
+        outgoing = []
+
+        def sendto(data, address):
+            outgoing.append((data, address))
+
+        while not self.stop.is_set():
+            for (data, address) in self.batchsock.recvbatch(0.1):
+                self.router.handle(data, address, sendto)
+            if outgoing:
+                self.batchsock.sendbatch(outgoing)
+                outgoing.clear()
+        self.sock.close()
 
     def run(self):
         """Start running the server"""
         #self.server_thread.start()
         # self.server_thread.daemon = True
         self.server_thread.start()
+        if self.expiry_thread:
+            self.expiry_thread.start()
+        if self.statsserver:
+            self.statsserver.run()
+        if self.statsfile:
+            self.statsfile.run()
 
     def close(self):
         """Shutdown the server"""
         #self.server_thread.exit()
         # print("Server shutdown")
-        self.server.shutdown()
+        if self.expiry_thread and self.expiry_thread.is_alive():
+            self.expiry_stop.set()
+            self.expiry_thread.join()
+        if self.statsserver:
+            self.statsserver.close()
+        if self.statsfile and self.statsfile.thread.is_alive():
+            self.statsfile.close()
+        if self.engine == 'threaded':
+            self.server.shutdown()
+            self.server.server_close()
+        elif self.engine == 'batched':
+            if self.server_thread.is_alive():
+                self.stop.set()
+                self.server_thread.join()
+            else:
+                self.sock.close()
+        else:
+            if self.server_thread.is_alive():
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                self.server_thread.join()
+            else:
+                self.sock.close()
+
+
+class ShardedServerHub():
+    """A ServerHub running in several worker processes, to use more than
+    one core. The workers all bind the same port with SO_REUSEPORT, so the
+    kernel spreads the clients between them, and share a routing table in
+    shared memory. Any worker can forward to any client"""
+
+    def __init__(self, address="127.0.0.1", portin=16250, checks=None,
+                 key=None, verify='all', sample_rate=100, engine='threaded',
+                 workers=2, max_networks=1024, route_timeout=None,
+                 copies=None, stats_port=None, stats_file=None,
+                 stats_interval=10, source_rate=None, network_rate=None,
+                 max_rate=None, block_time=None, stats_ip="127.0.0.1"):
+        """Contstructor. workers is the number of worker processes and
+        max_networks the size of the shared routing table. See ServerHub
+        for the other options. The copies of a packet are counted by each
+        worker, so up to copies are forwarded per worker.
+        Each worker has its own metrics, served on stats_port plus the
+        worker number and written to stats_file.<worker number>.
+        The rate limits are kept by each worker too. A client always goes
+        to the same worker, but a network may be spread over several, so
+        gets up to network_rate per worker. max_rate is split between the
+        workers"""
+        self.devicedb = devicedict.Shareddevicedict(unipacket.TOKEN_LENGTH,
+                                                    max_networks,
+                                                    route_timeout)
+        ctx = multiprocessing.get_context('fork')
+        self.stop = ctx.Event()
+        # the idle routes are expired by this process
+        self.expiry_thread = None
+        if route_timeout is not None:
+            self.expiry_thread = threading.Thread(
+                target=runexpiry, args=(self.devicedb, self.stop))
+        self.ready = ctx.Barrier(workers + 1)
+        # the ServerHub options of each worker
+        options = [dict(checks=checks, key=key, verify=verify,
+                        sample_rate=sample_rate, engine=engine,
+                        copies=copies, stats_interval=stats_interval,
+                        source_rate=source_rate, network_rate=network_rate,
+                        block_time=block_time, stats_ip=stats_ip,
+                        max_rate=None if max_rate is None
+                        else max_rate / workers,
+                        stats_port=None if stats_port is None
+                        else stats_port + i,
+                        stats_file=None if stats_file is None
+                        else stats_file + '.' + str(i))
+                   for i in range(0, workers)]
+        self.workers = [ctx.Process(target=self.runworker,
+                                    args=(address, portin, options[i]))
+                        for i in range(0, workers)]
+
+    def runworker(self, address, portin, options):
+        """Run a worker process until close()"""
+        srv = ServerHub(address, portin, reuseport=True, db=self.devicedb,
+                        **options)
+        srv.run()
+        self.ready.wait()
+        self.stop.wait()
+        srv.close()
+
+    def run(self):
+        """Start running the server, returns once all the workers are
+        running"""
+        for worker in self.workers:
+            worker.start()
+        self.ready.wait()
+        if self.expiry_thread:
+            self.expiry_thread.start()
+
+    def close(self):
+        """Shutdown the server"""
+        self.stop.set()
+        for worker in self.workers:
+            worker.join()
+        if self.expiry_thread and self.expiry_thread.is_alive():
+            self.expiry_thread.join()
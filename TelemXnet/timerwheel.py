@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Hierarchical timer wheel
+#  For expiring many timers with O(1) work per timer
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+
+# Via pip
+
+# In this repo
+
+
+class Timerwheel():
+    """A hierarchy of wheels of slots. Each slot of the lowest wheel is
+    one tick, each slot of the next wheel is a whole turn of the wheel
+    below, and so on. A timer is put in the lowest wheel that reaches its
+    deadline, and moved down a wheel when that wheel turns round to it.
+    Deadlines past the top wheel (slots**levels ticks ahead) go off at
+    the end of it"""
+    def __init__(self, tick=1.0, slots=64, levels=3, now=0.0):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[[] for i in range(0, slots)]
+                       for level in range(0, levels)]
+        # the number of the last tick that has gone
+        self.current = int(now / tick)
+
+    def place(self, when, item):
+        """Put an item due at tick number when (not before the current
+        tick) into its wheel slot"""
+        when = min(when, self.current + self.slots ** self.levels - 1)
+        level = 0
+        while when - self.current >= self.slots ** (level + 1):
+            level += 1
+        slot = (when // self.slots ** level) % self.slots
+        self.wheels[level][slot].append((when, item))
+
+    def add(self, deadline, item):
+        """Add a timer for item, to go off at deadline (seconds). A
+        deadline that has gone goes off at the next tick"""
+        self.place(max(int(deadline / self.tick), self.current + 1), item)
+
+    def advance(self, now):
+        """Move the wheel on to now (seconds). Returns the items of the
+        timers that have gone off"""
+        expired = []
+        target = int(now / self.tick)
+        while self.current < target:
+            self.current += 1
+            # at the start of a turn of a wheel, move the timers in the
+            # next slot of the wheel above down
+            for level in range(self.levels - 1, 0, -1):
+                if self.current % self.slots ** level == 0:
+                    slot = (self.current // self.slots ** level) % self.slots
+                    timers = self.wheels[level][slot]
+                    self.wheels[level][slot] = []
+                    for (when, item) in timers:
+                        self.place(when, item)
+            slot = self.current % self.slots
+            expired.extend(item for (when, item) in self.wheels[0][slot])
+            self.wheels[0][slot] = []
+        return expired
@@ -30,55 +30,130 @@ import queue
 import threading
 import multiprocessing
 import collections
+import time
 
 # Via pip
 
 # In this repo
 from TelemXnet import util
 
+# the requested size (bytes) of the socket recieve buffers. The kernel may
+# cap it (net.core.rmem_max on Linux)
+RCVBUF_SIZE = 1 << 20
+
+# the policies of a full Packetqueue - drop the oldest packet, the new
+# packet, or those older than max_age (then the oldest)
+DROP_OLDEST = 'oldest'
+DROP_NEWEST = 'newest'
+DROP_EXPIRED = 'age'
+POLICIES = (DROP_OLDEST, DROP_NEWEST, DROP_EXPIRED)
+
+
+class Packetqueue():
+    """A bounded FIFO of packets, for a link that may stall. Holds up to
+    maxlen packets, dropping one by policy when full. Packets older than
+    max_age (sec) are never returned. dropped counts the packets dropped.
+    One thread may append while another pops. Both may drop packets from
+    the head, so the lock is held while a packet is checked and dropped"""
+    def __init__(self, maxlen=256, policy=DROP_OLDEST, max_age=None):
+        if policy not in POLICIES:
+            raise ValueError("Unknown policy " + str(policy))
+        if policy == DROP_EXPIRED and max_age is None:
+            raise ValueError("The " + policy + " policy needs a max_age")
+        self.maxlen = maxlen
+        self.policy = policy
+        self.max_age = max_age
+        # (time queued, packet)
+        self.packets = collections.deque()
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.packets)
+
+    def append(self, packet, now=None):
+        """Add a packet, queued at now (time.monotonic())"""
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            if len(self.packets) >= self.maxlen:
+                if self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return
+                if self.policy == DROP_EXPIRED:
+                    self.dropexpired(now)
+                while len(self.packets) >= self.maxlen:
+                    self.packets.popleft()
+                    self.dropped += 1
+            self.packets.append((now, packet))
+
+    def popleft(self, now=None):
+        """Remove and return the oldest packet, or None if there are
+        none"""
+        with self.lock:
+            if self.max_age is not None:
+                self.dropexpired(time.monotonic() if now is None else now)
+            if not self.packets:
+                return None
+            return self.packets.popleft()[1]
+
+    def expire(self, now):
+        """Drop the packets older than max_age"""
+        with self.lock:
+            self.dropexpired(now)
+
+    def dropexpired(self, now):
+        """expire(), with the lock held"""
+        packets = self.packets
+        while packets and now - packets[0][0] > self.max_age:
+            packets.popleft()
+            self.dropped += 1
+
+
 class Udpxciever(threading.Thread):
     """This a a UDP transciever for sending and recieving data packets
     to a UAVNet server"""
-    def __init__(self, address, port, iface="127.0.0.1"):
+    def __init__(self, address, port, iface="127.0.0.1", max_queue=256,
+                 policy=DROP_OLDEST, max_age=None):
+        """The Tx and Rx queues are Packetqueues of up to max_queue
+        packets, with the drop policy and max_age (sec)"""
         threading.Thread.__init__(self)
         self.iface = iface
         self.rem = (address, port)
-        self.rxbuffer = b''
-        self.packetsRx = collections.deque()
-        self.packetsTx = collections.deque()
+        self.packetsRx = Packetqueue(max_queue, policy, max_age)
+        self.packetsTx = Packetqueue(max_queue, policy, max_age)
         # self.manager = Manager()
-        self.protocol_header = b'\x00'
         self.isExit = False
 
     def run(self):
         """Start the transciever"""
         self.xmittersocket = udpclient(self.rem[0], self.rem[1], self.iface)
-        
-        #keep trying to rx packets...
+
+        # each datagram is a packet, so on each wake all waiting datagrams
+        # are read in and all queued packets sent
         while not self.isExit:
-            curdata = self.xmittersocket.recv()
-            if curdata:
-                self.rxbuffer  += curdata
-                #print("buf is " + str(self.rxbuffer) + "chars")
-                
-            if self.protocol_header in self.rxbuffer:
-                indStart = self.rxbuffer.find(self.protocol_header)
-                indEnd = self.rxbuffer.find(self.protocol_header, indStart+1)
-                
-                if indStart != -1 and indEnd != -1:
-                    # print("rxqueue put at, " + str(util.gettimestamp()))
-                    nxtpkt = self.rxbuffer[indStart:indEnd+1]
-                    if len(self.rxbuffer) > indEnd:
-                        self.rxbuffer = self.rxbuffer[indEnd+1:]
-                    else:
-                        self.rxbuffer = b''
-                    self.packetsRx.append(nxtpkt)
-                    
-            if len(self.packetsTx) > 0:
-                self.xmittersocket.write(self.packetsTx.popleft())
-                
+            select.select([self.xmittersocket], [], [], 0.0001)
+            self.queuerx()
+
+            sent = 0
+            packet = self.packetsTx.popleft()
+            while packet is not None:
+                self.xmittersocket.write(packet)
+                sent += 1
+                if sent % 64 == 0:
+                    # the replies to a long burst may overflow the socket
+                    # buffer before it's all sent
+                    self.queuerx()
+                packet = self.packetsTx.popleft()
+
         self.xmittersocket.close()
 
+    def queuerx(self):
+        """Move the waiting datagrams to the Rx queue"""
+        now = time.monotonic()
+        for packet in self.xmittersocket.recvall(None):
+            self.packetsRx.append(packet, now)
+
     def getiface(self):
         """Get the IP interface used by this transciever"""
         return self.iface
@@ -98,28 +173,73 @@ class Udpxciever(threading.Thread):
         """Read the latest data packet from the queue
         Only returns a single packet at a time
         """
-        if len(self.packetsRx) > 0:
-            return self.packetsRx.popleft()
-        else:
-            return None
+        return self.packetsRx.popleft()
+
+    def getqueuestats(self):
+        """The depth and packets dropped of the Tx and Rx queues"""
+        return {'tx_depth': len(self.packetsTx),
+                'tx_dropped': self.packetsTx.dropped,
+                'rx_depth': len(self.packetsRx),
+                'rx_dropped': self.packetsRx.dropped}
 
 
 class udpclient():
-    '''A UDP socket'''
+    '''A UDP socket. It can also be used in place of a Udpxciever, by
+    a caller waiting on it with select or selectors'''
     def __init__(self, ip, port, iface):
+        self.iface = iface
         self.port = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.port.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # room for a burst of packets, between reads
+        self.port.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF_SIZE)
         self.port.bind((iface, 0))
         self.port.setblocking(False)
         #self.port.settimeout(0.001)
         self.ip = ip
         self.portr = port
         self.port.connect((self.ip, self.portr))
+        # recieved into, and reused for each datagram
+        self.rxbuf = bytearray(util.getRxPacketSize())
+        self.rxview = memoryview(self.rxbuf)
 
     def close(self):
         """Close the socket"""
         self.port.close()
 
+    def fileno(self):
+        """The file descriptor of the socket, to wait on"""
+        return self.port.fileno()
+
+    def getiface(self):
+        """Get the IP interface used by this socket"""
+        return self.iface
+
+    def writepacket(self, packet):
+        """Transmit a packet now, as Udpxciever.writepacket()"""
+        self.write(packet)
+
+    def getqueuestats(self):
+        """As Udpxciever.getqueuestats(). There are no queues, just the
+        socket buffers"""
+        return {'tx_depth': 0, 'tx_dropped': 0,
+                'rx_depth': 0, 'rx_dropped': 0}
+
+    def recvall(self, limit=64):
+        """Return a list of the datagrams waiting, up to limit of them
+        (None for no limit), without waiting"""
+        datagrams = []
+        while limit is None or len(datagrams) < limit:
+            try:
+                count = self.port.recv_into(self.rxbuf)
+            except BlockingIOError:
+                break
+            except ConnectionRefusedError:
+                # from an earlier send, when the server wasn't running
+                continue
+            if count > 0:
+                datagrams.append(self.rxview[:count].tobytes())
+        return datagrams
+
     def recv(self):
         """Return any data in the buffer. If not data in buffer, return null"""
         #r, _, _ = select.select([self.port], [], [], 0.0001)
@@ -25,8 +25,12 @@
 
 # Default python libs
 import hashlib
+import hmac
+import struct
+import zlib
+import collections
 from construct import Struct, RawCopy, Byte, Bytes
-from construct import Int8sb, Int16ub, this, Checksum
+from construct import Int8sb, Int16ub, this, Checksum, Terminated
 
 # Via pip
 from cobs import cobsr
@@ -34,57 +38,521 @@ from cobs import cobsr
 # in this repo
 
 
+# Packet format version, in the top two bits of the Flags byte
+PROTOCOL_VERSION = 0x40
+VERSION_MASK = 0xC0
+
+# Integrity check algorithms, in the bottom three bits of the Flags byte
+CHECK_SHA256 = 0
+CHECK_CRC32 = 1
+CHECK_BLAKE2S = 2
+CHECK_HMAC = 3
+CHECK_MASK = 0x07
+
+# Length in bytes of the check value of each algorithm
+CHECK_LENGTHS = {CHECK_SHA256: 4, CHECK_CRC32: 4, CHECK_BLAKE2S: 4,
+                 CHECK_HMAC: 8}
+CHECK_NAMES = {'sha256': CHECK_SHA256, 'crc32': CHECK_CRC32,
+               'blake2s': CHECK_BLAKE2S, 'hmac': CHECK_HMAC}
+
+# Flags bit for a compact header, with a session token in place of the
+# NetworkID
+FLAG_TOKEN = 0x08
+TOKEN_LENGTH = 4
+
+# Flags bit for a payload of several length-prefixed datagrams, see
+# coalesce()
+FLAG_COALESCED = 0x10
+
+# Flags bit for a payload compressed with raw deflate, see Unipacket's zdict.
+# The compressed data follows the ZDICT_ID_LENGTH byte id of the dictionary
+FLAG_COMPRESSED = 0x20
+ZDICT_ID_LENGTH = 2
+
+# All of the header type and payload Flags bits
+FLAG_MASK = FLAG_TOKEN | FLAG_COALESCED | FLAG_COMPRESSED
+
+# DeviceIDs are given to hubs in blocks of HUB_DEVICES, one per iface, so
+# the hub that sent a packet is DeviceID // HUB_DEVICES. Every iface of a
+# hub sends the same packet with the same sequence number
+HUB_DEVICES = 8
+
+# The decoded fields of a packet, as returned by the fast codec
+Packetfields = collections.namedtuple('Packetfields', ['Flags', 'NetworkID',
+                                                       'DeviceID', 'Sequence',
+                                                       'Payload_length',
+                                                       'Payload'])
+
+
+class Packetview(object):
+    """The fields of a packet decoded by Unipacket.recoverpacket_into().
+    NetworkID and Payload are memoryviews into the decode buffer, so are
+    only valid until that buffer is next decoded into. A FLAG_COMPRESSED
+    Payload is decompressed into a new bytes instead"""
+    __slots__ = ('Flags', 'NetworkID', 'DeviceID', 'Sequence',
+                 'Payload_length', 'Payload')
+
+    def __init__(self, flags, net_id, dev_id, seq, pay_len, payload):
+        self.Flags = flags
+        self.NetworkID = net_id
+        self.DeviceID = dev_id
+        self.Sequence = seq
+        self.Payload_length = pay_len
+        self.Payload = payload
+
+
 class Unipacket(object):
     """A single packet of data over UAVNet. A packet contains:
-    -NetworkID (32 bytes)
+    -Flags (1 byte) - protocol version, header and payload type and
+    integrity check algorithm
+    -NetworkID (32 bytes), or a session token (4 bytes) assigned by the
+    server in reply to a CL_BEGIN
     -Sending DeviceID (1-31 for UAV, 32-63 for GCS)
     -Sequence no (32 bytes) (at 1000 packets/sec, lasts 49 days)
     -Payload data (plus length)
-    The packet includes a 8 byte CRC (sha-256 based)at the end.
+    The packet includes an integrity check at the end. This is 4 bytes of
+    SHA-256, CRC32 or BLAKE2s, or 8 bytes of a keyed HMAC-SHA256.
     It also is put through COBS/R to ensure no 0x00 bytes in packet.
     Each packet has a 0x00 header
     Payload is a max 255-32-32-8-1-8 =  174 bytes
+    Packets are built and parsed via precompiled struct layouts. The
+    construct definition (message_format) is kept as the reference
+    implementation, see buildpacket_ref() and recoverpacket_ref()
     """
-    def __init__(self):
+    def __init__(self, check=CHECK_SHA256, key=None, zdict=None,
+                 accept=None):
+        """Constructor. check is the integrity check algorithm used for
+        built packets. key is the shared secret for CHECK_HMAC. Received
+        packets are verified with whichever algorithm they were built
+        with, if it is in accept - the default is only CHECK_HMAC with a
+        key, as anyone can make an unkeyed check value, or the unkeyed
+        checks without one. zdict is the preset dictionary for
+        FLAG_COMPRESSED payloads (see tools/zdictbuild.py), which must be
+        the same at both ends"""
+        if check not in CHECK_LENGTHS:
+            raise ValueError("Unknown integrity check " + str(check))
+        if check == CHECK_HMAC and not key:
+            raise ValueError("HMAC integrity check requires a key")
+        if accept is None:
+            accept = ([CHECK_HMAC] if key else
+                      [chk for chk in CHECK_LENGTHS if chk != CHECK_HMAC])
+        for chk in accept:
+            if chk not in CHECK_LENGTHS:
+                raise ValueError("Unknown integrity check " + str(chk))
+            if chk == CHECK_HMAC and not key:
+                raise ValueError("HMAC integrity check requires a key")
+        self.accept = frozenset(accept)
+
         self.protocol_header = b'\x00'
+        self.check = check
+        self.key = key
+        self.flags = PROTOCOL_VERSION | check
+
+        # raw deflate, so there's no zlib header or trailer. The primed
+        # (de)compressors are copied for each payload rather than loading
+        # the dictionary every time. Payloads are tiny, so a small window
+        # and hash table keep the copies cheap. Only the last 4kB of zdict
+        # is used. A payload compressed with a different dictionary would
+        # decompress to garbage, so it starts with the (truncated) CRC32
+        # of the dictionary
+        self.zdict = zdict
+        self.zdict_id = (zlib.crc32(zdict or b'') & 0xFFFF).to_bytes(
+            ZDICT_ID_LENGTH, byteorder='big')
+        if zdict:
+            self.compressor = zlib.compressobj(9, zlib.DEFLATED, -12, 2,
+                                               zlib.Z_DEFAULT_STRATEGY, zdict)
+            self.decompressor = zlib.decompressobj(-12, zdict)
+        else:
+            self.compressor = zlib.compressobj(9, zlib.DEFLATED, -12, 2)
+            self.decompressor = zlib.decompressobj(-12)
+
+        # the integrity check functions. HMAC is only available with a key
+        self.checkfuncs = {
+            CHECK_SHA256: lambda data: hashlib.sha256(data).digest()[0:4],
+            CHECK_CRC32: lambda data: self.crc_format.pack(zlib.crc32(data)),
+            CHECK_BLAKE2S: lambda data: hashlib.blake2s(data,
+                                                        digest_size=4).digest()
+        }
+        if key:
+            self.checkfuncs[CHECK_HMAC] = lambda data: hmac.digest(
+                key, data, 'sha256')[0:8]
+        self.checkfunc = self.checkfuncs[check]
+        # new hash objects of the checks other than CRC32, so the state
+        # after the fields shared by several packets can be copied
+        self.hashfuncs = {
+            CHECK_SHA256: hashlib.sha256,
+            CHECK_BLAKE2S: lambda: hashlib.blake2s(digest_size=4)
+        }
+        if key:
+            self.hashfuncs[CHECK_HMAC] = lambda: hmac.new(key,
+                                                          digestmod='sha256')
+
+        # length of the check value for each possible Flags byte, or 0 if
+        # a packet with those Flags can't be verified or isn't accepted
+        self.check_lengths = [0] * 256
+        for chk in self.accept:
+            for flags in range(0, FLAG_MASK + 1, CHECK_MASK + 1):
+                self.check_lengths[PROTOCOL_VERSION | flags |
+                                   chk] = CHECK_LENGTHS[chk]
+
+        # reference definition of the packet format. The fast codec below
+        # must stay byte-for-byte compatible with this
         self.message_format = Struct(
             "fields" / RawCopy(Struct(
-                "NetworkID" / Bytes(32),
+                "Flags" / Byte,
+                "NetworkID" / Bytes(lambda this: TOKEN_LENGTH
+                                    if this.Flags & FLAG_TOKEN else 32),
                 "DeviceID" / Int8sb,
                 "Sequence" / Int16ub,
                 "Payload_length" / Byte,
                 "Payload" / Bytes(this.Payload_length)
             )),
-            "checksum" / Checksum(Bytes(4), lambda data:
-                                  hashlib.sha256(data).digest()[0:4],
+            "checksum" / Checksum(Bytes(lambda this: CHECK_LENGTHS[
+                                      this.fields.value.Flags & CHECK_MASK]),
+                                  lambda data:
+                                  self.makecheck(data[0] & CHECK_MASK, data),
                                   this.fields.data),
+            # nothing after the check value
+            Terminated,
         )
+        # precompiled layout of the fixed fields for the fast codec, with
+        # a NetworkID or a session token
+        self.header_format = struct.Struct(">B32sbHB")
+        self.token_format = struct.Struct(">B" + str(TOKEN_LENGTH) + "sbHB")
+        # the fields after the NetworkID or token
+        self.route_format = struct.Struct(">bHB")
+        self.crc_format = struct.Struct(">I")
+        # pre-packed DeviceID bytes, indexed by DeviceID
+        self.device_bytes = {dev_id: dev_id.to_bytes(1, byteorder='big',
+                                                     signed=True)
+                             for dev_id in range(-64, 65)}
+
+        # COBS/R never makes the data shorter, and adds at most 1 byte in
+        # 254, so bound the length of a frame (with its 0x00 delimiters).
+        # The shortest is per Flags byte, longer than any frame if a packet
+        # with those Flags can't be verified
+        raw_len = self.header_format.size + 255 + max(CHECK_LENGTHS.values())
+        self.max_frame = raw_len + raw_len // 254 + 1 + 2
+        self.min_frames = [self.max_frame + 1] * 256
+        for (flags, chk_len) in enumerate(self.check_lengths):
+            if chk_len:
+                self.min_frames[flags] = (self.getheaderformat(flags).size +
+                                          chk_len + 2)
 
     def maxPayloadSize(self):
         """Returns the max payload size, 254 minus the headers"""
         return 254 - 32 - 8 - 16 - 1 - 4
-        
-    def buildpacket(self, _id, _device, _sequence, _payload):
-        """Construct a packet based on the networkID, deviceID, timestamp
-        and payload. Returns a series of bytes prepended with the header"""
 
-        if (len(_id) != 32 or _device < -64 or _device > 64 or
-                not isinstance(_sequence, int) or
-                len(_payload) < 1):
+    def getheaderformat(self, flags):
+        """Returns the struct layout of the fixed fields of a packet with
+        the given Flags byte"""
+        if flags & FLAG_TOKEN:
+            return self.token_format
+        return self.header_format
+
+    def coalesce(self, datagrams):
+        """Returns a payload holding all of the datagrams, each prefixed
+        with its length, to be sent with FLAG_COALESCED"""
+        return b''.join(bytes([len(datagram)]) + datagram
+                        for datagram in datagrams)
+
+    def splitpayload(self, payload):
+        """Split a FLAG_COALESCED payload back into its datagrams. Returns
+        a list of datagrams, or None if the payload is invalid"""
+        datagrams = []
+        pos = 0
+        while pos < len(payload):
+            end = pos + 1 + payload[pos]
+            if payload[pos] == 0 or end > len(payload):
+                return None
+            datagrams.append(bytes(payload[pos + 1:end]))
+            pos = end
+        return datagrams
+
+    def compresspayload(self, payload, flags):
+        """If flags has FLAG_COMPRESSED, compress the payload. Returns the
+        (payload, flags) to send, with FLAG_COMPRESSED cleared if the
+        payload does not get any smaller"""
+        if not flags & FLAG_COMPRESSED:
+            return (payload, flags)
+        comp = self.compressor.copy()
+        compressed = self.zdict_id + comp.compress(payload) + comp.flush()
+        if len(compressed) < len(payload):
+            return (compressed, flags)
+        return (payload, flags & ~FLAG_COMPRESSED)
+
+    def decompresspayload(self, payload):
+        """Decompress a FLAG_COMPRESSED payload. Returns None if the
+        payload is invalid, larger than 255 bytes or compressed with a
+        different dictionary"""
+        if payload[:ZDICT_ID_LENGTH] != self.zdict_id:
+            return None
+        decomp = self.decompressor.copy()
+        try:
+            data = decomp.decompress(payload[ZDICT_ID_LENGTH:], 256)
+        except zlib.error:
+            return None
+        if not decomp.eof or len(data) == 0 or len(data) > 255:
+            return None
+        return data
+
+    def makecheck(self, check, data):
+        """Returns the integrity check value of data for the algorithm
+        check, or None if it can't be made"""
+        try:
+            return self.checkfuncs[check](data)
+        except KeyError:
+            return None
+
+    def checkpacket(self, _id, _device, _sequence, _payload):
+        """Check the fields of a packet to be built are sane"""
+        return not ((len(_id) != 32 and len(_id) != TOKEN_LENGTH) or
+                    _device < -64 or _device > 64 or
+                    not isinstance(_sequence, int) or
+                    len(_payload) < 1)
+
+    def buildpacket(self, _id, _device, _sequence, _payload, _flags=0):
+        """Construct a packet based on the networkID (or session token),
+        deviceID, timestamp and payload. _flags are any payload Flags bits,
+        ie. FLAG_COALESCED or FLAG_COMPRESSED. Returns a series of bytes
+        prepended with the header"""
+
+        if not self.checkpacket(_id, _device, _sequence, _payload):
             return None
+        (_payload, _flags) = self.compresspayload(_payload, _flags)
 
         # create the message
-        pkt_struct = dict(fields=dict(value=dict(NetworkID=_id,
-                          DeviceID=_device, Sequence=_sequence,
+        if len(_id) == TOKEN_LENGTH:
+            raw = self.token_format.pack(self.flags | _flags | FLAG_TOKEN, _id,
+                                         _device, _sequence,
+                                         len(_payload)) + _payload
+        else:
+            raw = self.header_format.pack(self.flags | _flags, _id, _device,
+                                          _sequence, len(_payload)) + _payload
+        raw += self.checkfunc(raw)
+
+        # put the message through cobs/r and put a header on the message
+        return self.protocol_header + cobsr.encode(raw) + self.protocol_header
+
+    def buildpackets(self, _id, _devices, _sequence, _payload, _flags=0):
+        """Construct the same packet for a list of deviceIDs. Only the
+        DeviceID differs between the packets, so the checking and packing
+        of the other fields is only done once. Only the checksum and
+        COBS/R encoding are done per packet, and the check value of the
+        fields before the DeviceID is also only done once.
+        Returns a list of packets in the same order as _devices"""
+
+        if not self.checkpacket(_id, 0, _sequence, _payload):
+            return None
+        for dev_id in _devices:
+            if dev_id < -64 or dev_id > 64:
+                return None
+        (_payload, _flags) = self.compresspayload(_payload, _flags)
+
+        # the fields either side of the DeviceID are the same in every packet
+        if len(_id) == TOKEN_LENGTH:
+            fields = self.token_format.pack(self.flags | _flags | FLAG_TOKEN,
+                                            _id, 0, _sequence, len(_payload))
+        else:
+            fields = self.header_format.pack(self.flags | _flags, _id, 0,
+                                             _sequence, len(_payload))
+        head = fields[:len(_id) + 1]
+        tail = fields[len(_id) + 2:] + _payload
+
+        pkts = []
+        if self.check == CHECK_CRC32:
+            head_crc = zlib.crc32(head)
+            for dev_id in _devices:
+                rest = self.device_bytes[dev_id] + tail
+                raw = b''.join((head, rest, self.crc_format.pack(
+                    zlib.crc32(rest, head_crc))))
+                pkts.append(b''.join((self.protocol_header,
+                                      cobsr.encode(raw),
+                                      self.protocol_header)))
+        else:
+            head_hash = self.hashfuncs[self.check]()
+            head_hash.update(head)
+            chk_len = CHECK_LENGTHS[self.check]
+            for dev_id in _devices:
+                rest = self.device_bytes[dev_id] + tail
+                dev_hash = head_hash.copy()
+                dev_hash.update(rest)
+                raw = b''.join((head, rest, dev_hash.digest()[0:chk_len]))
+                pkts.append(b''.join((self.protocol_header,
+                                      cobsr.encode(raw),
+                                      self.protocol_header)))
+        return pkts
+
+    def precheck(self, pkt):
+        """Cheap checks that a datagram could be a packet, with nothing
+        decoded - the 0x00 delimiters, the length and the Flags byte. The
+        Flags byte is always the 2nd byte of the COBS/R data, as it is
+        never 0x00"""
+        return (3 <= len(pkt) <= self.max_frame and pkt[0] == 0 and
+                pkt[-1] == 0 and len(pkt) >= self.min_frames[pkt[2]])
+
+    def decodeframe(self, pkt):
+        """Check the header and footer of a packet and de-cobs/r it.
+        Returns None if it's not a valid frame"""
+
+        # check the header and footer is still here
+        if len(pkt) < 2 or pkt[0] != 0 or pkt[-1] != 0:
+            return None
+
+        # strip away the 0x00 header and de-cobs/r it
+        try:
+            return cobsr.decode(pkt[1:-1])
+        except cobsr.DecodeError:
+            return None
+
+    def recoverpacket(self, pkt):
+        """De-construct a packet, check it's CRC and return a Packetfields
+        tuple containing the fields."""
+
+        recv_packet = self.decodeframe(pkt)
+        if recv_packet is None:
+            return None
+
+        # parse the fixed fields
+        if len(recv_packet) < 1:
+            return None
+        hdr_format = self.getheaderformat(recv_packet[0])
+        hdr_len = hdr_format.size
+        if len(recv_packet) < hdr_len:
+            return None
+        (flags, net_id, dev_id, seq,
+         pay_len) = hdr_format.unpack_from(recv_packet)
+        chk_len = self.check_lengths[flags]
+        data_len = hdr_len + pay_len
+        # nothing may follow the check value
+        if chk_len == 0 or len(recv_packet) != data_len + chk_len:
+            return None
+
+        # verify the check value
+        chk = self.checkfuncs[flags & CHECK_MASK](
+            memoryview(recv_packet)[:data_len])
+        if not hmac.compare_digest(chk,
+                                   recv_packet[data_len:data_len + chk_len]):
+            return None
+
+        payload = recv_packet[hdr_len:data_len]
+        if flags & FLAG_COMPRESSED:
+            payload = self.decompresspayload(payload)
+            if payload is None:
+                return None
+            pay_len = len(payload)
+
+        return Packetfields(flags, net_id, dev_id, seq, pay_len, payload)
+
+    def recoverheader(self, pkt):
+        """Recover just the fixed fields at the start of a packet, for
+        routing. Only the start of the packet is de-cobs/r'd, so the cost
+        does not depend on the payload size. The check value is NOT
+        verified. Returns a Packetfields with a Payload of None, or None if
+        the header is invalid"""
+
+        # check the header and footer is still here
+        if len(pkt) < 2 or pkt[0] != 0 or pkt[-1] != 0:
+            return None
+
+        # each decoded byte takes at most 2 encoded bytes, so this is
+        # enough to recover the largest header
+        hdr_len = self.header_format.size
+        end = len(pkt) - 1
+        if end > 2 * hdr_len + 2:
+            end = 2 * hdr_len + 2
+        try:
+            head = cobsr.decode(pkt[1:end])
+        except cobsr.DecodeError:
+            return None
+
+        # if the packet was cut short, the last decoded byte is not valid
+        head_len = len(head) if end == len(pkt) - 1 else len(head) - 1
+        if head_len < 1:
+            return None
+        hdr_format = self.getheaderformat(head[0])
+        if head_len < hdr_format.size:
+            return None
+        (flags, net_id, dev_id, seq,
+         pay_len) = hdr_format.unpack_from(head)
+        if self.check_lengths[flags] == 0:
+            return None
+
+        return Packetfields(flags, net_id, dev_id, seq, pay_len, None)
+
+    def newbuffer(self):
+        """Returns a bytearray large enough for recoverpacket_into() to
+        decode any packet into"""
+        return bytearray(self.header_format.size + 255 +
+                         max(CHECK_LENGTHS.values()))
+
+    def recoverpacket_into(self, pkt, buf):
+        """As recoverpacket(), but the packet is decoded into the
+        preallocated bytearray buf (see newbuffer()). Returns a Packetview
+        that refers to buf rather than copying the fields out, so is only
+        valid until buf is next decoded into. buf is never resized"""
+
+        recv_packet = self.decodeframe(pkt)
+        if recv_packet is None:
+            return None
+
+        # copy into the buffer and parse the fixed fields
+        rx_len = len(recv_packet)
+        if rx_len < 1:
+            return None
+        flags = recv_packet[0]
+        hdr_len = self.getheaderformat(flags).size
+        if rx_len < hdr_len or rx_len > len(buf):
+            return None
+        buf[:rx_len] = recv_packet
+        id_end = hdr_len - self.route_format.size
+        (dev_id, seq, pay_len) = self.route_format.unpack_from(buf, id_end)
+        chk_len = self.check_lengths[flags]
+        data_len = hdr_len + pay_len
+        # nothing may follow the check value
+        if chk_len == 0 or rx_len != data_len + chk_len:
+            return None
+
+        # verify the check value
+        buf_view = memoryview(buf)
+        chk = self.checkfuncs[flags & CHECK_MASK](buf_view[:data_len])
+        if not hmac.compare_digest(chk,
+                                   buf_view[data_len:data_len + chk_len]):
+            return None
+
+        payload = buf_view[hdr_len:data_len]
+        if flags & FLAG_COMPRESSED:
+            payload = self.decompresspayload(payload)
+            if payload is None:
+                return None
+            pay_len = len(payload)
+
+        return Packetview(flags, buf_view[1:id_end], dev_id, seq, pay_len,
+                          payload)
+
+    def buildpacket_ref(self, _id, _device, _sequence, _payload, _flags=0):
+        """As buildpacket(), but via the reference construct definition.
+        Much slower - use for testing only"""
+
+        if not self.checkpacket(_id, _device, _sequence, _payload):
+            return None
+
+        # create the message
+        (_payload, _flags) = self.compresspayload(_payload, _flags)
+        flags = self.flags | _flags
+        if len(_id) == TOKEN_LENGTH:
+            flags |= FLAG_TOKEN
+        pkt_struct = dict(fields=dict(value=dict(Flags=flags,
+                          NetworkID=_id, DeviceID=_device, Sequence=_sequence,
                           Payload_length=len(_payload), Payload=_payload)))
         raw = self.message_format.build(pkt_struct)
 
         # put the message through cobs/r and put a header on the message
         return self.protocol_header + cobsr.encode(raw) + self.protocol_header
 
-    def recoverpacket(self, pkt):
-        """De-construct a packet, check it's CRC and return a struct
-        containing the fields."""
+    def recoverpacket_ref(self, pkt):
+        """As recoverpacket(), but via the reference construct definition.
+        Returns a construct Container. Much slower - use for testing only"""
 
         # check the header and footer is still here
         if pkt[0] != int.from_bytes(self.protocol_header, byteorder='big'):
@@ -103,9 +571,23 @@ class Unipacket(object):
         except Exception:
             return None
 
-        # verify the hash code
-        chk = hashlib.sha256(pkt_struct.fields.data).digest()[0:4]
+        # check the version
+        if (pkt_struct.fields.value.Flags &
+                ~(CHECK_MASK | FLAG_MASK)) != PROTOCOL_VERSION:
+            return None
+
+        # verify the check value, if it is an accepted one
+        check = pkt_struct.fields.value.Flags & CHECK_MASK
+        if check not in self.accept:
+            return None
+        chk = self.makecheck(check, pkt_struct.fields.data)
         if chk != pkt_struct.checksum:
             return None
 
-        return pkt_struct.fields.value
+        fields = pkt_struct.fields.value
+        if fields.Flags & FLAG_COMPRESSED:
+            fields.Payload = self.decompresspayload(fields.Payload)
+            if fields.Payload is None:
+                return None
+            fields.Payload_length = len(fields.Payload)
+        return fields
@@ -9,6 +9,7 @@ setup(name='TelemXnet',
       author_email='stephen_dade@hotmail.com',
       url='http://www.TelemXnet.com',
       install_requires=['cobs', 'netifaces', 'construct'],
+      extras_require={'bulk': ['numpy']},
       test_suite="tests",
       classifiers=['Development Status :: 4 - Beta',
                    'Environment :: Console',
@@ -19,7 +20,10 @@ setup(name='TelemXnet',
                    'Topic :: Scientific/Engineering'
                   ],
       license='GPLv3',
-      py_modules=['TelemXnet.clienthub', 'TelemXnet.devicedict', 'TelemXnet.serverhub', 
-                  'TelemXnet.udpxciever', 'TelemXnet.unipacket', 'TelemXnet.util'],
+      py_modules=['TelemXnet.batchio', 'TelemXnet.bulkdecode', 'TelemXnet.clienthub',
+                  'TelemXnet.devicedict', 'TelemXnet.linksched', 'TelemXnet.metrics',
+                  'TelemXnet.ratelimit', 'TelemXnet.serverhub', 'TelemXnet.seqwindow',
+                  'TelemXnet.timerwheel', 'TelemXnet.udpxciever', 'TelemXnet.unipacket',
+                  'TelemXnet.util'],
       scripts=['TelemXnet-Client.py', 'TelemXnet-Server.py']
      )
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Unit tests for Batchsocket
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+import unittest
+import socket
+import os
+
+# via pip
+
+# in this repo
+from TelemXnet import batchio
+
+
+class BatchsocketTestCase(unittest.TestCase):
+    native = True
+
+    def setUp(self):
+        if self.native and not batchio.HAVE_MMSG:
+            self.skipTest("recvmmsg/sendmmsg not available")
+        self.sockA = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sockB = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sockA.bind(("127.0.0.1", 0))
+        self.sockB.bind(("127.0.0.1", 0))
+        self.batchA = batchio.Batchsocket(self.sockA, 8, native=self.native)
+        self.batchB = batchio.Batchsocket(self.sockB, 8, native=self.native)
+
+    def recvall(self):
+        datagrams = []
+        while True:
+            batch = self.batchB.recvbatch(0.1)
+            if not batch:
+                return datagrams
+            self.assertTrue(len(batch) <= 8, "Batch too big")
+            datagrams += batch
+
+    def test_sendrecv(self):
+        # more than a batch, of different lengths
+        datagrams = [(os.urandom(i + 1), self.sockB.getsockname())
+                     for i in range(0, 20)]
+        self.batchA.sendbatch(datagrams)
+        self.assertEqual(self.recvall(),
+                         [(data, self.sockA.getsockname())
+                          for (data, address) in datagrams],
+                         "Datagrams incorrect")
+
+    def test_calls(self):
+        datagrams = [(os.urandom(10), self.sockB.getsockname())
+                     for i in range(0, 16)]
+        self.batchA.sendbatch(datagrams)
+        self.assertEqual(len(self.recvall()), 16, "Datagrams lost")
+        if self.native:
+            self.assertEqual(self.batchA.calls, 2, "Not sent in batches")
+        else:
+            self.assertEqual(self.batchA.calls, 16, "Incorrect call count")
+
+    def test_nodata(self):
+        self.assertEqual(self.batchB.recvbatch(0.01), [], "Phantom data")
+
+    def test_toobig(self):
+        data = os.urandom(3000)
+        self.batchA.sendbatch([(data, self.sockB.getsockname())])
+        self.assertEqual(len(self.recvall()[0][0]), 2048,
+                         "Big datagram not sent")
+
+    def tearDown(self):
+        self.sockA.close()
+        self.sockB.close()
+
+
+class BatchsocketFallbackTestCase(BatchsocketTestCase):
+    """The same tests, with a syscall per datagram"""
+    native = False
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Unit tests for Bulkdecoder
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+import unittest
+import random
+import os
+
+# via pip
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# in this repo
+from TelemXnet import unipacket
+if numpy is not None:
+    from TelemXnet import bulkdecode
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class BulkdecoderTestCase(unittest.TestCase):
+    def setUp(self):
+        key = os.urandom(16)
+        self.pkts = [unipacket.Unipacket(check, key)
+                     for check in unipacket.CHECK_LENGTHS]
+        self.pkt = unipacket.Unipacket(key=key,
+                                       accept=unipacket.CHECK_LENGTHS)
+        self.decoder = bulkdecode.Bulkdecoder(key, batch_size=100,
+                                              accept=unipacket.CHECK_LENGTHS)
+
+    def makeframes(self, number):
+        # lots of 0x00 and 0xFF, to exercise the COBS/R edge cases
+        frames = []
+        for i in range(0, number):
+            network_id = bytes(random.choice([0, 1, 255])
+                               for j in range(random.choice(
+                                   [32, unipacket.TOKEN_LENGTH])))
+            payload = bytes(random.choice([0, 7, 255])
+                            for j in range(random.randint(1, 255)))
+            frames.append(random.choice(self.pkts).buildpacket(
+                network_id, random.randint(-64, 64), random.randint(0, 65535),
+                payload))
+        return frames
+
+    def assertMatches(self, frames):
+        (fields, data) = self.decoder.decode(b''.join(frames))
+        self.assertEqual(len(fields), len(frames), "Incorrect frame count")
+        for (frame, field) in zip(frames, fields):
+            ret_pkt = self.pkt.recoverpacket(frame)
+            self.assertEqual(ret_pkt is not None, field['Valid'],
+                             "Incorrect Valid")
+            if ret_pkt is None:
+                continue
+            offset = field['Payload_offset']
+            self.assertEqual(ret_pkt.Flags, field['Flags'], "Incorrect Flags")
+            self.assertEqual(ret_pkt.NetworkID,
+                             bytes(field['NetworkID'][:len(ret_pkt.NetworkID)]),
+                             "Incorrect NetworkID")
+            self.assertEqual(ret_pkt.DeviceID, field['DeviceID'],
+                             "Incorrect DeviceID")
+            self.assertEqual(ret_pkt.Sequence, field['Sequence'],
+                             "Incorrect Sequence")
+            self.assertEqual(ret_pkt.Payload,
+                             data[offset:offset +
+                                  field['Payload_length']].tobytes(),
+                             "Incorrect Payload")
+
+    def test_decode(self):
+        self.assertMatches(self.makeframes(500))
+
+    def test_corrupt(self):
+        frames = self.makeframes(500)
+        for i in range(0, len(frames), 3):
+            # corrupt a single (non-delimiter) byte
+            frame = bytearray(frames[i])
+            pos = random.randint(1, len(frame) - 2)
+            frame[pos] = frame[pos] % 255 + 1
+            frames[i] = bytes(frame)
+        self.assertMatches(frames)
+
+    def test_junk(self):
+        (fields, data) = self.decoder.decode(b'\x00\x05\x01\x02\x00\x00' +
+                                             os.urandom(1000))
+        self.assertFalse(fields['Valid'].any(), "Junk frame valid")
+        (fields, data) = self.decoder.decode(b'')
+        self.assertEqual(len(fields), 0, "Empty capture has frames")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -26,6 +26,7 @@
 import time
 import unittest
 import os
+import random
 import socket
 #from gevent import socket
 #from gevent import monkey
@@ -35,9 +36,12 @@ import socket
 # in this repo
 from TelemXnet import serverhub
 from TelemXnet import clienthub
+from TelemXnet import linksched
 
 
 class ClienthubTestCase(unittest.TestCase):
+    engine = 'threaded'
+
     def setUp(self):
         # start a server
         self.srv = serverhub.ServerHub("127.0.0.1", 16250)
@@ -58,8 +62,10 @@ class ClienthubTestCase(unittest.TestCase):
         self.ExtUAS.settimeout(0.5)
         
         #and the clients themselves
-        self.GCSClient = clienthub.Clienthub(("127.0.0.1", 14550), ("127.0.0.1", 16250), self.network_id, 33)
-        self.UASClient = clienthub.Clienthub(("127.0.0.1", 14560), ("127.0.0.1", 16250), self.network_id, 2)
+        self.GCSClient = clienthub.Clienthub(("127.0.0.1", 14550), ("127.0.0.1", 16250), self.network_id, 33,
+                                             engine=self.engine)
+        self.UASClient = clienthub.Clienthub(("127.0.0.1", 14560), ("127.0.0.1", 16250), self.network_id, 2,
+                                             engine=self.engine)
         time.sleep(0.05)
 
     def test_noOtherSide(self):
@@ -107,6 +113,37 @@ class ClienthubTestCase(unittest.TestCase):
         self.assertEqual(b'3y85b21398p5bv3p12956c19p3cb', ret_gcs_msg, "Message UAS -> GCS not passed")
         self.assertEqual(b'o683bwp39846cb1p', ret_uas_msg, "Message GCS -> UAS not passed")
         
+    def test_TwoClientscoalesce(self):
+        # create two clients, the GCS coalescing its packets
+        self.GCSClient.coalesce_delay = 0.05
+        self.GCSClient.addinterface("127.0.0.1")
+        self.UASClient.addinterface("127.0.0.1")
+        self.GCSClient.start()
+        self.UASClient.start()
+        time.sleep(0.01)
+
+        # and send some packets
+        self.ExtUAS.sendto(b'3984c0', ("127.0.0.1", 14560))
+        self.ExtGCS.sendto(b'q87o73t4', ("127.0.0.1", 14550))
+        time.sleep(0.01)
+        ret_gcs_msg = self.ExtGCS.recv(255)
+        ret_uas_msg = self.ExtUAS.recv(255)
+        self.assertEqual(b'3984c0', ret_gcs_msg, "Message UAS -> GCS not passed")
+        self.assertEqual(b'q87o73t4', ret_uas_msg, "Message GCS -> UAS not passed")
+
+        # a burst of packets is sent in one frame, and split on arrival
+        msgs = [os.urandom(random.randint(1, 40)) for i in range(0, 6)]
+        for msg in msgs:
+            self.ExtGCS.sendto(msg, ("127.0.0.1", 14550))
+        ret_uas_msgs = [self.ExtUAS.recv(255) for msg in msgs]
+        self.assertEqual(msgs, ret_uas_msgs, "Messages GCS -> UAS not passed")
+
+        # an empty datagram is skipped, not sent in the frame
+        for msg in (b'abc', b'', b'defg'):
+            self.ExtGCS.sendto(msg, ("127.0.0.1", 14550))
+        ret_uas_msgs = [self.ExtUAS.recv(255) for i in range(0, 2)]
+        self.assertEqual([b'abc', b'defg'], ret_uas_msgs, "Messages GCS -> UAS not passed")
+
     def test_TwoClientsmultiiface(self):
         # create two clients
         self.GCSClient.addinterface("127.0.0.1")
@@ -160,6 +197,53 @@ class ClienthubTestCase(unittest.TestCase):
         self.assertEqual(b'wp3498n5vwop8yriunrb98', ret_gcs_msg, "Message UAS -> GCS not passed2")
         self.assertEqual(b'93842n823', ret_uas_msg, "Message GCS -> UAS not passed2")
 
+    def test_TwoClientsbestlink(self):
+        # the GCS has two ifaces, but only sends data on the best one
+        self.GCSClient.link_policy = linksched.BEST_ONLY
+        self.GCSClient.addinterface("127.0.0.1")
+        self.GCSClient.addinterface("127.0.0.1")
+        self.UASClient.addinterface("127.0.0.1")
+        self.GCSClient.start()
+        self.UASClient.start()
+        time.sleep(0.01)
+
+        self.ExtGCS.sendto(b'q87o73t4', ("127.0.0.1", 14550))
+        self.ExtUAS.sendto(b'3984c0', ("127.0.0.1", 14560))
+        time.sleep(0.01)
+        ret_gcs_msg = self.ExtGCS.recv(255)
+        ret_uas_msg = self.ExtUAS.recv(255)
+        self.assertEqual(b'3984c0', ret_gcs_msg, "Message UAS -> GCS not passed")
+        self.assertEqual(b'q87o73t4', ret_uas_msg, "Message GCS -> UAS not passed")
+
+        networks = self.srv.router.metrics.networks
+        packets_in = sum(counters[0] for counters in networks.values())
+        msgs = [os.urandom(random.randint(1, 40)) for i in range(0, 5)]
+        for msg in msgs:
+            self.ExtGCS.sendto(msg, ("127.0.0.1", 14550))
+        ret_uas_msgs = [self.ExtUAS.recv(255) for msg in msgs]
+        # the threaded server may reorder them
+        self.assertEqual(sorted(msgs), sorted(ret_uas_msgs),
+                         "Messages GCS -> UAS not passed")
+        self.assertEqual(sum(counters[0] for counters in networks.values()) -
+                         packets_in, 5, "Data not sent on one iface")
+
+    def test_linkstats(self):
+        # a client probing every 50ms
+        self.GCSClient.probe_interval = 0.05
+        self.assertEqual(self.GCSClient.getlinkstats(), [],
+                         "Link stats before start")
+        self.GCSClient.addinterface("127.0.0.1")
+        self.GCSClient.start()
+        time.sleep(0.3)
+
+        links = self.GCSClient.getlinkstats()
+        self.assertEqual(len(links), 1, "Incorrect number of links")
+        self.assertEqual(links[0]['devid'], 33, "Incorrect devid")
+        self.assertEqual(links[0]['iface'], "127.0.0.1", "Incorrect iface")
+        self.assertGreaterEqual(links[0]['probes'], 3, "Probes not sent")
+        self.assertIsNotNone(links[0]['rtt'], "No RTT measured")
+        self.assertLess(links[0]['rtt'], 50, "RTT too long")
+
     def test_TwoClientsNoIface(self):
         # create two clients
         self.GCSClient.start()
@@ -227,8 +311,10 @@ class ClienthubTestCase(unittest.TestCase):
 
         # build a second network
         networktwo = os.urandom(32)
-        self.GCSClienttwo = clienthub.Clienthub(("127.0.0.1", 14450), ("127.0.0.1", 16250), networktwo, 32)
-        self.UASClienttwo = clienthub.Clienthub(("127.0.0.1", 14460), ("127.0.0.1", 16250), networktwo, 1)
+        self.GCSClienttwo = clienthub.Clienthub(("127.0.0.1", 14450), ("127.0.0.1", 16250), networktwo, 32,
+                                                engine=self.engine)
+        self.UASClienttwo = clienthub.Clienthub(("127.0.0.1", 14460), ("127.0.0.1", 16250), networktwo, 1,
+                                                engine=self.engine)
         self.GCSClienttwo.addinterface("127.0.0.1")
         self.UASClienttwo.addinterface("127.0.0.1")
         self.GCSClienttwo.start()
@@ -265,6 +351,62 @@ class ClienthubTestCase(unittest.TestCase):
         self.assertEqual(b'40mv089q38', ret_gcs_msg_two, "Message2 UAS -> GCS not passed")
         self.assertEqual(b'w93980586b', ret_uas_msg_two, "Message2 GCS -> UAS not passed")
 
+    def test_twogcshubs(self):
+        # a second GCS hub on the same network, with its own sequence
+        # numbers
+        self.GCSClient.addinterface("127.0.0.1")
+        self.UASClient.addinterface("127.0.0.1")
+        self.GCSClient.start()
+        self.UASClient.start()
+        self.GCSClienttwo = clienthub.Clienthub(("127.0.0.1", 14450), ("127.0.0.1", 16250), self.network_id, 40,
+                                                engine=self.engine)
+        self.GCSClienttwo.addinterface("127.0.0.1")
+        self.GCSClienttwo.start()
+        self.ExtGCStwo = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.ExtGCStwo.settimeout(0.5)
+        time.sleep(0.01)
+
+        self.ExtUAS.sendto(b'3984c0', ("127.0.0.1", 14560))
+        time.sleep(0.01)
+
+        # the first packet from each has the same sequence number
+        self.ExtGCS.sendto(b'q87o73t4', ("127.0.0.1", 14550))
+        time.sleep(0.01)
+        self.ExtGCStwo.sendto(b'w93980586b', ("127.0.0.1", 14450))
+        time.sleep(0.01)
+
+        self.assertEqual(b'q87o73t4', self.ExtUAS.recv(255), "Message GCS -> UAS not passed")
+        self.assertEqual(b'w93980586b', self.ExtUAS.recv(255), "Message2 GCS -> UAS not passed")
+
+    def test_reregister(self):
+        self.GCSClient.probe_interval = 0.2
+        self.UASClient.probe_interval = 0.2
+        self.GCSClient.addinterface("127.0.0.1")
+        self.UASClient.addinterface("127.0.0.1")
+        self.GCSClient.start()
+        self.UASClient.start()
+        time.sleep(0.01)
+        self.ExtGCS.sendto(b'q87o73t4', ("127.0.0.1", 14550))
+        self.ExtUAS.sendto(b'3984c0', ("127.0.0.1", 14560))
+        self.assertEqual(b'3984c0', self.ExtGCS.recv(255), "Message UAS -> GCS not passed")
+        self.assertEqual(b'q87o73t4', self.ExtUAS.recv(255), "Message GCS -> UAS not passed")
+
+        # expire the routes, so the clients' probes go unanswered until
+        # they register again
+        devicedb = self.srv.router.devicedb
+        token = devicedb.gettoken(self.network_id)
+        devicedb.removeremote(token, 2)
+        devicedb.removeremote(token, 33)
+        self.ExtGCS.settimeout(0.2)
+        for i in range(0, 30):
+            self.ExtUAS.sendto(b'w93980586b', ("127.0.0.1", 14560))
+            try:
+                ret_gcs_msg = self.ExtGCS.recv(255)
+                break
+            except socket.timeout:
+                ret_gcs_msg = None
+        self.assertEqual(b'w93980586b', ret_gcs_msg, "Message UAS -> GCS not passed after route lost")
+
     def tearDown(self):
         self.ExtGCS.close()
         self.GCSClient.join()
@@ -282,5 +424,47 @@ class ClienthubTestCase(unittest.TestCase):
         self.srv.close()
         time.sleep(0.01)
 
+
+class ClienthubSelectorTestCase(ClienthubTestCase):
+    engine = 'selector'
+
+    def test_badengine(self):
+        with self.assertRaises(ValueError):
+            clienthub.Clienthub(("127.0.0.1", 14570), ("127.0.0.1", 16250),
+                                self.network_id, 2, engine='gevent')
+
+    def test_heldlocal(self):
+        # datagrams for a local client that hasn't spoken yet are held,
+        # but only for hold_age
+        self.GCSClient.hold_age = 0.2
+        self.GCSClient.addinterface("127.0.0.1")
+        self.UASClient.addinterface("127.0.0.1")
+        self.GCSClient.start()
+        self.UASClient.start()
+        time.sleep(0.01)
+
+        self.ExtUAS.sendto(b'stale', ("127.0.0.1", 14560))
+        time.sleep(0.3)
+        self.ExtUAS.sendto(b'fresh', ("127.0.0.1", 14560))
+        time.sleep(0.01)
+        self.ExtGCS.sendto(b'q87o73t4', ("127.0.0.1", 14550))
+        time.sleep(0.01)
+
+        self.assertEqual(b'fresh', self.ExtGCS.recv(255),
+                         "Held message not passed")
+        self.assertEqual(b'q87o73t4', self.ExtUAS.recv(255),
+                         "Message GCS -> UAS not passed")
+        self.ExtGCS.settimeout(0.1)
+        with self.assertRaises(socket.timeout):
+            self.ExtGCS.recv(255)
+
+    def test_badqueuepolicy(self):
+        with self.assertRaises(ValueError):
+            clienthub.Clienthub(("127.0.0.1", 14570), ("127.0.0.1", 16250),
+                                self.network_id, 2, queue_policy='random')
+        with self.assertRaises(ValueError):
+            clienthub.Clienthub(("127.0.0.1", 14570), ("127.0.0.1", 16250),
+                                self.network_id, 2, queue_policy='age')
+
 if __name__ == '__main__':
     unittest.main()
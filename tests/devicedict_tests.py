@@ -26,6 +26,8 @@
 import unittest
 import random
 import os
+import multiprocessing
+import time
 
 # via pip
 
@@ -63,5 +65,249 @@ class DevicedatabaseTestCase(unittest.TestCase):
         (ip, port) = self.diccy.getremote(network_id, device_id)
         self.assertEqual((ip, port), (None, None), "Delete errored")
 
+    def test_check(self):
+        device_id = random.randint(-64, 64)
+        network_id = os.urandom(32)
+        self.assertEqual(self.diccy.getcheck(network_id, device_id), None,
+                         "Error with no device")
+        self.diccy.addremote(network_id, device_id, "127.0.0.1", 16250, 2)
+        self.assertEqual(self.diccy.getcheck(network_id, device_id), 2,
+                         "Can't get check")
+        self.diccy.removeremote(network_id, device_id)
+        self.assertEqual(self.diccy.getcheck(network_id, device_id), None,
+                         "Delete errored")
+
+    def test_token(self):
+        device_id = random.randint(1, 64)
+        network_id = os.urandom(32)
+        self.assertEqual(self.diccy.gettoken(network_id), None,
+                         "Error with no token")
+        token = self.diccy.newtoken(network_id)
+        self.assertEqual(len(token), 4, "Incorrect token length")
+        self.assertEqual(self.diccy.newtoken(network_id), token,
+                         "Token not reused")
+        self.assertEqual(self.diccy.getnetwork(token), network_id,
+                         "Can't get network")
+
+        # the token is freed with the last remote using it
+        self.diccy.addremote(token, device_id, "127.0.0.1", 16250)
+        self.diccy.addremote(token, device_id, "127.0.0.1", 16251)
+        self.diccy.addremote(token, -device_id, "127.0.0.1", 16252)
+        self.diccy.removeremote(token, device_id)
+        self.assertEqual(self.diccy.gettoken(network_id), token,
+                         "Token freed too early")
+        self.diccy.removeremote(token, -device_id)
+        self.assertEqual(self.diccy.gettoken(network_id), None,
+                         "Token not freed")
+        self.assertEqual(self.diccy.getnetwork(token), None,
+                         "Token not freed")
+
+    def test_getpeers(self):
+        network_id = os.urandom(32)
+        self.assertEqual(list(self.diccy.getpeers(network_id,
+                                                  devicedict.GCS_SIDE)), [],
+                         "Error with no peers")
+        self.diccy.addremote(network_id, 1, "127.0.0.1", 16250)
+        self.diccy.addremote(network_id, 31, "127.0.0.1", 16251)
+        self.diccy.addremote(network_id, 32, "127.0.0.1", 16252)
+        self.diccy.addremote(network_id, 63, "127.0.0.1", 16253)
+        self.diccy.addremote(network_id, 63, "127.0.0.1", 16254)
+        self.assertEqual(sorted(self.diccy.getpeers(network_id,
+                                                    devicedict.UAS_SIDE)),
+                         [("127.0.0.1", 16250), ("127.0.0.1", 16251)],
+                         "Can't get UAS side")
+        self.assertEqual(sorted(self.diccy.getpeers(network_id,
+                                                    devicedict.GCS_SIDE)),
+                         [("127.0.0.1", 16252), ("127.0.0.1", 16254)],
+                         "Can't get GCS side")
+
+        self.diccy.removeremote(network_id, 31)
+        self.diccy.removeremote(network_id, 32)
+        self.assertEqual(list(self.diccy.getpeers(network_id,
+                                                  devicedict.UAS_SIDE)),
+                         [("127.0.0.1", 16250)], "Remove errored")
+        self.assertEqual(list(self.diccy.getpeers(network_id,
+                                                  devicedict.GCS_SIDE)),
+                         [("127.0.0.1", 16254)], "Remove errored")
+    def test_expire(self):
+        diccy = devicedict.Devicedict(timeout=10)
+        now = time.monotonic()
+        network_id = os.urandom(32)
+        token = diccy.newtoken(network_id)
+        diccy.addremote(token, 1, "127.0.0.1", 16250)
+        diccy.addremote(token, 32, "127.0.0.1", 16251)
+
+        # a device that's been seen is kept
+        diccy.seen(token, 32, now + 8)
+        self.assertEqual(diccy.expire(now + 5), 0, "Expired too early")
+        self.assertEqual(diccy.expire(now + 11), 1, "Not expired")
+        self.assertEqual(diccy.getremote(token, 1), (None, None),
+                         "Not expired")
+        self.assertEqual(diccy.getremote(token, 32), ("127.0.0.1", 16251),
+                         "Seen device expired")
+
+        # until it's idle too. Then the token is freed
+        self.assertEqual(diccy.expire(now + 19), 1, "Not expired")
+        self.assertEqual(diccy.gettoken(network_id), None, "Token not freed")
+        self.assertEqual(diccy.expired, 2, "Expiries not counted")
+
+class ShareddevicedictTestCase(unittest.TestCase):
+    def setUp(self):
+        self.diccy = devicedict.Shareddevicedict(max_networks=4)
+
+    def test_adddevice(self):
+        device_id = random.randint(0, 127)
+        token = self.diccy.newtoken(os.urandom(32))
+        self.diccy.addremote(token, device_id, "127.0.0.1", 16250, 1)
+
+        (ip, port) = self.diccy.getremote(token, device_id)
+        self.assertEqual((ip, port), ("127.0.0.1", 16250), "Can't get IP:port")
+        self.assertEqual(self.diccy.getcheck(token, device_id), 1,
+                         "Can't get check")
+        self.assertEqual(self.diccy.getremote(token, (device_id + 1) % 128),
+                         (None, None), "Error with no device")
+        self.assertEqual(self.diccy.getremote(os.urandom(4), device_id),
+                         (None, None), "Error with no network")
+
+    def test_token(self):
+        device_id = random.randint(1, 63)
+        network_id = os.urandom(32)
+        self.assertEqual(self.diccy.gettoken(network_id), None,
+                         "Error with no token")
+        token = self.diccy.newtoken(network_id)
+        self.assertEqual(len(token), 4, "Incorrect token length")
+        self.assertEqual(self.diccy.newtoken(network_id), token,
+                         "Token not reused")
+        self.assertEqual(self.diccy.getnetwork(token), network_id,
+                         "Can't get network")
+
+        # the token is freed with the last remote using it
+        self.diccy.addremote(token, device_id, "127.0.0.1", 16250)
+        self.diccy.addremote(token, device_id, "127.0.0.1", 16251)
+        self.diccy.addremote(token, device_id + 64, "127.0.0.1", 16252)
+        self.diccy.removeremote(token, device_id)
+        self.assertEqual(self.diccy.gettoken(network_id), token,
+                         "Token freed too early")
+        self.diccy.removeremote(token, device_id + 64)
+        self.assertEqual(self.diccy.gettoken(network_id), None,
+                         "Token not freed")
+        self.assertEqual(self.diccy.getnetwork(token), None,
+                         "Token not freed")
+
+    def test_full(self):
+        network_ids = [os.urandom(32) for i in range(0, 5)]
+        tokens = [self.diccy.newtoken(network_id)
+                  for network_id in network_ids]
+        self.assertEqual(tokens[4], None, "Table overfilled")
+
+        # freeing a network makes space for another
+        self.diccy.addremote(tokens[0], 1, "127.0.0.1", 16250)
+        self.diccy.removeremote(tokens[0], 1)
+        self.assertNotEqual(self.diccy.newtoken(network_ids[4]), None,
+                            "Space not freed")
+        for (network_id, token) in zip(network_ids[1:4], tokens[1:4]):
+            self.assertEqual(self.diccy.getnetwork(token), network_id,
+                             "Can't get network")
+
+    def test_churn(self):
+        diccy = devicedict.Shareddevicedict(max_networks=64)
+        live = {}
+        for i in range(0, 16):
+            network_id = os.urandom(32)
+            live[network_id] = diccy.newtoken(network_id)
+            diccy.addremote(live[network_id], 1, "127.0.0.1", 16250 + i)
+
+        # networks coming and going leave DELETED slots behind
+        for i in range(0, 2000):
+            token = diccy.newtoken(os.urandom(32))
+            diccy.addremote(token, 1, "127.0.0.1", 16250)
+            diccy.removeremote(token, 1)
+
+        # which are compacted, so a miss doesn't probe the whole table
+        for offset in (0, diccy.token_offset):
+            size = (diccy.slot_size if offset == 0 else
+                    diccy.token_format.size)
+            states = [diccy.mem[offset + slot * size]
+                      for slot in range(0, diccy.slots)]
+            self.assertLess(states.count(diccy.DELETED), diccy.slots // 4,
+                            "Not compacted")
+            self.assertLessEqual(len(states) - states.count(diccy.EMPTY),
+                                 len(live) + diccy.slots // 4,
+                                 "Miss probes too far")
+        for i in range(0, 100):
+            self.assertEqual(diccy.gettoken(os.urandom(32)), None,
+                             "Unknown network found")
+            self.assertEqual(diccy.getnetwork(os.urandom(4)), None,
+                             "Unknown token found")
+
+        # and the networks still there are not lost
+        for (i, (network_id, token)) in enumerate(live.items()):
+            self.assertEqual(diccy.gettoken(network_id), token,
+                             "Can't get token")
+            self.assertEqual(diccy.getnetwork(token), network_id,
+                             "Can't get network")
+            self.assertEqual(diccy.getremote(token, 1),
+                             ("127.0.0.1", 16250 + i), "Can't get remote")
+        self.assertEqual(diccy.size(), len(live), "Incorrect size")
+
+    def test_processes(self):
+        # a remote added by another process is seen by this one
+        network_id = os.urandom(32)
+        proc = multiprocessing.get_context('fork').Process(
+            target=lambda: self.diccy.addremote(
+                self.diccy.newtoken(network_id), 5, "10.0.0.1", 16250))
+        proc.start()
+        proc.join()
+        token = self.diccy.gettoken(network_id)
+        self.assertEqual(self.diccy.getremote(token, 5), ("10.0.0.1", 16250),
+                         "Remote not shared")
+    def test_getpeers(self):
+        network_id = self.diccy.newtoken(os.urandom(32))
+        self.assertEqual(list(self.diccy.getpeers(network_id,
+                                                  devicedict.GCS_SIDE)), [],
+                         "Error with no peers")
+        self.diccy.addremote(network_id, 1, "127.0.0.1", 16250)
+        self.diccy.addremote(network_id, 31, "127.0.0.1", 16251)
+        self.diccy.addremote(network_id, 32, "127.0.0.1", 16252)
+        self.diccy.addremote(network_id, 63, "127.0.0.1", 16253)
+        self.diccy.addremote(network_id, 63, "127.0.0.1", 16254)
+        self.assertEqual(sorted(self.diccy.getpeers(network_id,
+                                                    devicedict.UAS_SIDE)),
+                         [("127.0.0.1", 16250), ("127.0.0.1", 16251)],
+                         "Can't get UAS side")
+        self.assertEqual(sorted(self.diccy.getpeers(network_id,
+                                                    devicedict.GCS_SIDE)),
+                         [("127.0.0.1", 16252), ("127.0.0.1", 16254)],
+                         "Can't get GCS side")
+
+        self.diccy.removeremote(network_id, 31)
+        self.diccy.removeremote(network_id, 32)
+        self.assertEqual(list(self.diccy.getpeers(network_id,
+                                                  devicedict.UAS_SIDE)),
+                         [("127.0.0.1", 16250)], "Remove errored")
+        self.assertEqual(list(self.diccy.getpeers(network_id,
+                                                  devicedict.GCS_SIDE)),
+                         [("127.0.0.1", 16254)], "Remove errored")
+    def test_expire(self):
+        diccy = devicedict.Shareddevicedict(max_networks=4, timeout=10)
+        now = time.monotonic()
+        network_id = os.urandom(32)
+        token = diccy.newtoken(network_id)
+        diccy.addremote(token, 1, "127.0.0.1", 16250)
+        diccy.addremote(token, 32, "127.0.0.1", 16251)
+        diccy.seen(token, 32, now + 8)
+
+        # each expire() sweeps part of the table
+        for i in range(0, diccy.slots):
+            diccy.expire(now + 11)
+        self.assertEqual(diccy.getremote(token, 1), (None, None),
+                         "Not expired")
+        self.assertEqual(diccy.getremote(token, 32), ("127.0.0.1", 16251),
+                         "Seen device expired")
+        for i in range(0, diccy.slots):
+            diccy.expire(now + 19)
+        self.assertEqual(diccy.gettoken(network_id), None, "Token not freed")
+        self.assertEqual(diccy.expired.value, 2, "Expiries not counted")
+
 if __name__ == '__main__':
     unittest.main()
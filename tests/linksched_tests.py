@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Unit tests for linksched
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+# Default python libs
+import unittest
+
+# via pip
+
+# in this repo
+from TelemXnet import linksched
+
+
+class LinkstatsTestCase(unittest.TestCase):
+    def test_rtt(self):
+        stats = linksched.Linkstats()
+        stats.sent(1, 10.0)
+        self.assertAlmostEqual(stats.answered(1, 10.2), 0.2,
+                               msg="Incorrect RTT")
+        self.assertAlmostEqual(stats.srtt, 0.2, msg="Incorrect srtt")
+        # a repeat answer is ignored
+        self.assertIsNone(stats.answered(1, 10.4), "Repeat answer used")
+        stats.sent(2, 11.0)
+        stats.answered(2, 11.6)
+        self.assertAlmostEqual(stats.srtt, 0.25, msg="srtt not smoothed")
+
+    def test_loss(self):
+        stats = linksched.Linkstats()
+        stats.sent(1, 10.0)
+        stats.sent(2, 11.0)
+        self.assertTrue(stats.expire(12.5, 2.0), "Probe not lost")
+        self.assertAlmostEqual(stats.loss, 0.125, msg="Incorrect loss")
+        self.assertEqual(list(stats.probes), [2], "Probe not expired")
+        self.assertEqual(stats.missed, 1, "Missed probe not counted")
+        stats.answered(2, 12.6)
+        self.assertLess(stats.loss, 0.125, "Loss not reduced")
+        self.assertEqual(stats.missed, 0, "Missed probes not cleared")
+
+
+    def test_jitter(self):
+        stats = linksched.Linkstats()
+        for (seq, rtt) in enumerate([0.1, 0.2, 0.1, 0.2]):
+            stats.sent(seq, seq)
+            stats.answered(seq, seq + rtt)
+        self.assertGreater(stats.jitter, 0.01, "Jitter not measured")
+        self.assertLess(stats.jitter, 0.1, "Jitter not smoothed")
+
+    def test_lateanswer(self):
+        stats = linksched.Linkstats()
+        stats.sent(1, 10.0)
+        stats.expire(13.0, 2.0)
+        # the answer carries when it was sent, so still gives the RTT
+        self.assertAlmostEqual(stats.answered(1, 13.5, 10.0), 3.5,
+                               msg="Incorrect RTT")
+        self.assertAlmostEqual(stats.loss, 0.125, msg="Loss changed")
+        self.assertEqual((stats.sentcount, stats.lostcount), (1, 1),
+                         "Incorrect counts")
+
+
+class LinkschedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.links = ['a', 'b', 'c']
+
+    def makescheduler(self, policy):
+        """A scheduler with links a (slow), b (fast) and c (fast, lossy)"""
+        scheduler = linksched.Linkscheduler(policy)
+        for link in self.links:
+            scheduler.addlink(link)
+        for seq in range(0, 8):
+            for (link, rtt) in zip(self.links, [0.3, 0.05, 0.04]):
+                scheduler.probesent(link, seq, seq)
+                if link != 'c' or seq % 2:
+                    scheduler.probeanswered(link, seq, seq + rtt)
+        scheduler.choose(20.0)
+        return scheduler
+
+    def test_all(self):
+        scheduler = self.makescheduler(linksched.SEND_ALL)
+        self.assertEqual(scheduler.choose(20.0), self.links, "Not all")
+
+    def test_best(self):
+        scheduler = self.makescheduler(linksched.BEST_ONLY)
+        self.assertFalse(scheduler.ishealthy('c'), "Loss not measured")
+        self.assertEqual(scheduler.choose(20.0), ['b'], "Not the best")
+
+    def test_besttwo(self):
+        scheduler = self.makescheduler(linksched.BEST_TWO)
+        # c is faster than a, but loses too many packets
+        self.assertEqual(scheduler.choose(20.0), ['b', 'a'],
+                         "Not the best two")
+
+    def test_degraded(self):
+        scheduler = self.makescheduler(linksched.DEGRADED_ALL)
+        self.assertEqual(scheduler.choose(20.0), ['b'], "Not the best")
+        # b starts losing probes, so the next best
+        for seq in range(8, 10):
+            scheduler.probesent('b', seq, 20.0)
+        self.assertEqual(scheduler.choose(23.0), ['a'], "Not the next best")
+        # then a, so none are healthy
+        for seq in range(8, 10):
+            scheduler.probesent('a', seq, 23.0)
+        self.assertEqual(sorted(scheduler.choose(26.0)), self.links,
+                         "Not all when degraded")
+
+    def test_priority(self):
+        scheduler = self.makescheduler(linksched.PRIORITY)
+        self.assertEqual(scheduler.choose(20.0), ['a'], "Not the first")
+        scheduler.links['a'].loss = 0.5
+        scheduler.chosen = None
+        self.assertEqual(scheduler.choose(20.0), ['a', 'b'],
+                         "Not redundant when degraded")
+
+    def test_unmeasured(self):
+        scheduler = linksched.Linkscheduler(linksched.BEST_ONLY)
+        scheduler.addlink('a')
+        scheduler.addlink('b')
+        self.assertEqual(scheduler.choose(0.0), ['a'], "Not the first")
+        scheduler.probesent('b', 1, 0.0)
+        scheduler.probeanswered('b', 1, 0.1)
+        self.assertEqual(scheduler.choose(0.1), ['b'], "Not the measured")
+        scheduler.removelink('b')
+        self.assertEqual(scheduler.choose(0.1), ['a'], "Link not removed")
+
+    def test_badpolicy(self):
+        with self.assertRaises(ValueError):
+            linksched.Linkscheduler('random')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Unit tests for Metrics
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+import os
+import tempfile
+import unittest
+
+# via pip
+
+# in this repo
+from TelemXnet import metrics
+
+
+class HistogramTestCase(unittest.TestCase):
+    def test_observe(self):
+        histogram = metrics.Histogram([1, 5, 10])
+        for value in [0, 1, 2, 5, 7, 100]:
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 2, 1, 1], "Wrong buckets")
+        self.assertEqual(histogram.count, 6, "Wrong count")
+        self.assertEqual(histogram.sum, 115, "Wrong sum")
+        # the buckets are cumulative when exported
+        self.assertEqual(histogram.render('h'),
+                         ['h_bucket{le="1"} 2', 'h_bucket{le="5"} 4',
+                          'h_bucket{le="10"} 5', 'h_bucket{le="+Inf"} 6',
+                          'h_sum 115', 'h_count 6'], "Wrong export")
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.networks = {b'\x01\x02\x03\x04': b'\xaa' * 32}
+        self.metrics = metrics.Metrics(getnetwork=self.networks.get)
+
+    def test_counters(self):
+        self.metrics.inc('bad_packets')
+        self.metrics.inc('bad_packets', 2)
+        counters = self.metrics.network(b'\x01\x02\x03\x04')
+        counters[0] += 1
+        counters[1] += 20
+        self.metrics.gauge('route_networks', "Networks", lambda: 7)
+        lines = self.metrics.render().splitlines()
+        self.assertIn('telemxnet_bad_packets_total 3', lines,
+                      "Counter incorrect")
+        self.assertIn('telemxnet_unknown_route_total 0', lines,
+                      "Counter not exported")
+        label = metrics.networklabel(b'\xaa' * 32)
+        self.assertIn('telemxnet_network_bytes_in_total{network="' + label +
+                      '"} 20', lines, "Network counter incorrect")
+        # the token is a routing credential, so isn't exported
+        self.assertNotIn('01020304', '\n'.join(lines), "Token exported")
+        self.assertIn('telemxnet_route_networks 7', lines, "Gauge incorrect")
+
+    def test_removenetwork(self):
+        self.metrics.network(b'\x01\x02\x03\x04')[0] += 1
+        self.metrics.network(b'\x05\x06\x07\x08')[0] += 1
+        self.metrics.network(b'\x09\x0a\x0b\x0c')[0] += 1
+        self.metrics.removenetwork(b'\x09\x0a\x0b\x0c')
+        text = self.metrics.render()
+        self.assertIn(metrics.networklabel(b'\xaa' * 32), text,
+                      "Network counters missing")
+        self.assertEqual(text.count('{network='), len(metrics.NETWORK_COUNTERS),
+                         "Gone network exported")
+        self.assertEqual(list(self.metrics.networks), [b'\x01\x02\x03\x04'],
+                         "Gone network not dropped")
+
+    def test_statsfile(self):
+        self.metrics.inc('pings')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'telemxnet.prom')
+            statsfile = metrics.Statsfile(self.metrics, path, 0.05)
+            statsfile.run()
+            statsfile.close()
+            with open(path) as f:
+                text = f.read()
+            self.assertEqual(os.listdir(tmpdir), ['telemxnet.prom'],
+                             "Temporary file left")
+        self.assertEqual(text, self.metrics.render(), "Wrong file contents")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Unit tests for the rate limits
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+import unittest
+
+# via pip
+
+# in this repo
+from TelemXnet import ratelimit
+
+
+class TokenbucketTestCase(unittest.TestCase):
+    def test_burst(self):
+        bucket = ratelimit.Tokenbucket(10, 5, 100.0)
+        passed = [bucket.take(100.0) for i in range(0, 8)]
+        self.assertEqual(passed, [True] * 5 + [False] * 3, "Burst incorrect")
+
+    def test_rate(self):
+        bucket = ratelimit.Tokenbucket(10, 1, 100.0)
+        # 100 packets/sec for 2 sec, only 10/sec pass
+        passed = sum(bucket.take(100.0 + i * 0.01) for i in range(0, 200))
+        self.assertAlmostEqual(passed, 20, delta=1, msg="Rate incorrect")
+        # idle time refills only up to the burst
+        self.assertTrue(bucket.take(200.0), "Not refilled")
+        self.assertFalse(bucket.take(200.0), "Refilled past the burst")
+
+    def test_reserve(self):
+        bucket = ratelimit.Tokenbucket(10, 10, 100.0)
+        passed = [bucket.take(100.0, 2) for i in range(0, 10)]
+        self.assertEqual(passed.count(True), 8, "Reserve taken")
+        self.assertTrue(bucket.take(100.0), "Reserve not left")
+
+
+class RatelimitsTestCase(unittest.TestCase):
+    def test_sources(self):
+        limits = ratelimit.Ratelimits(source_rate=5)
+        passed = [limits.checksource(("10.0.0.1", 1000), 1.0)
+                  for i in range(0, 10)]
+        self.assertEqual(passed.count(True), 5, "Source not limited")
+        self.assertTrue(limits.checksource(("10.0.0.1", 1001), 1.0),
+                        "Other source limited")
+        self.assertTrue(limits.checknetwork(b'net', 1.0),
+                        "Network limited with no limit")
+
+    def test_maxentries(self):
+        buckets = ratelimit.Bucketmap(5, max_entries=100)
+        for i in range(0, 1000):
+            buckets.take(i, 1.0)
+        self.assertLessEqual(len(buckets.buckets), 100, "Map not bounded")
+        # the oldest buckets are removed, not all of them
+        self.assertNotIn(899, buckets.buckets, "Oldest bucket not removed")
+        self.assertIn(999, buckets.buckets, "Newest bucket removed")
+        self.assertEqual(len(buckets.buckets), 100, "Map cleared")
+
+    def test_shed(self):
+        # over the server limit, data is dropped before control packets
+        limits = ratelimit.Ratelimits(max_rate=100, reserve=0.2)
+        data = [limits.checkload(False, 1.0) for i in range(0, 100)]
+        control = [limits.checkload(True, 1.0) for i in range(0, 100)]
+        self.assertEqual(data.count(True), 80, "Data not shed")
+        self.assertEqual(control.count(True), 20, "Control not let through")
+
+
+
+class BlocklistTestCase(unittest.TestCase):
+    def test_block(self):
+        blocklist = ratelimit.Blocklist(rate=1, burst=5, block_time=10)
+        address = ("10.0.0.1", 1000)
+        blocked = [blocklist.invalid(address, 1.0) for i in range(0, 6)]
+        self.assertEqual(blocked, [False] * 5 + [True], "Not blocked")
+        self.assertTrue(blocklist.isblocked(address, 5.0), "Not blocked")
+        self.assertFalse(blocklist.isblocked(("10.0.0.1", 1001), 5.0),
+                         "Other source blocked")
+        # and unblocked after the block time
+        self.assertFalse(blocklist.isblocked(address, 11.0), "Not unblocked")
+        self.assertEqual(blocklist.blocked, {}, "Block not removed")
+
+    def test_exempt(self):
+        blocklist = ratelimit.Blocklist(rate=1, burst=5, block_time=10)
+        address = ("10.0.0.1", 1000)
+        blocked = [blocklist.invalid(address, 1.0, lambda addr: True)
+                   for i in range(0, 20)]
+        self.assertFalse(any(blocked), "Exempt source blocked")
+        self.assertFalse(blocklist.isblocked(address, 1.0),
+                         "Exempt source blocked")
+
+    def test_maxentries(self):
+        # the oldest blocks are removed, not all of them
+        blocklist = ratelimit.Blocklist(rate=1, burst=1, block_time=10,
+                                        max_entries=100)
+        for i in range(0, 200):
+            for j in range(0, 2):
+                blocklist.invalid(("10.0.0.1", i), 1.0)
+        self.assertEqual(len(blocklist.blocked), 100, "Map not bounded")
+        self.assertFalse(blocklist.isblocked(("10.0.0.1", 99), 1.0),
+                         "Oldest block not removed")
+        self.assertTrue(blocklist.isblocked(("10.0.0.1", 100), 1.0),
+                        "Newer block removed")
+
+    def test_rate(self):
+        # an occasional invalid packet is never blocked
+        blocklist = ratelimit.Blocklist(rate=1, burst=5, block_time=10)
+        blocked = [blocklist.invalid(("10.0.0.1", 1000), i * 2.0)
+                   for i in range(0, 100)]
+        self.assertFalse(any(blocked), "Blocked below the rate")
+
+
+if __name__ == '__main__':
+    unittest.main()
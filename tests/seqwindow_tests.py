@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Unit tests for Seqwindow
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+import unittest
+import random
+
+# via pip
+
+# in this repo
+from TelemXnet import seqwindow
+
+
+class SeqwindowTestCase(unittest.TestCase):
+    def setUp(self):
+        self.window = seqwindow.Seqwindow(64)
+
+    def test_inorder(self):
+        for seq in range(0, 200):
+            self.assertTrue(self.window.checkseq(seq), "New seq dropped")
+            self.assertFalse(self.window.checkseq(seq), "Repeat seq passed")
+
+    def test_outoforder(self):
+        # two links, each delivering every packet, with jitter
+        seqs = list(range(1000, 1300))
+        arrivals = []
+        for link in range(0, 2):
+            arrivals += [(seq + random.uniform(0, 20), seq) for seq in seqs]
+        passed = [seq for (time, seq) in sorted(arrivals)
+                  if self.window.checkseq(seq)]
+        self.assertEqual(sorted(passed), seqs, "Not every seq passed once")
+
+    def test_wraparound(self):
+        seqs = [(65500 + i) % 65536 for i in range(0, 100)]
+        for seq in seqs:
+            self.assertTrue(self.window.checkseq(seq), "New seq dropped")
+        for seq in seqs[-50:]:
+            self.assertFalse(self.window.checkseq(seq), "Repeat seq passed")
+
+    def test_restart(self):
+        for seq in range(5000, 5100):
+            self.window.checkseq(seq)
+        # older than the window, so dropped until there's enough in a row
+        # that the sender has restarted
+        for seq in range(0, 31):
+            self.assertFalse(self.window.checkseq(seq), "Old seq passed")
+        self.assertTrue(self.window.checkseq(31), "Restarted seq dropped")
+        self.assertTrue(self.window.checkseq(32), "Restarted seq dropped")
+        self.assertFalse(self.window.checkseq(31), "Repeat seq passed")
+
+    def test_lagging(self):
+        # one link delivering every packet, and another far behind it
+        passed = []
+        for seq in range(0, 3000):
+            if self.window.checkseq(seq):
+                passed.append(seq)
+            if seq >= 1500 and self.window.checkseq(seq - 1500):
+                passed.append(seq - 1500)
+        self.assertEqual(passed, list(range(0, 3000)),
+                         "Lagging copies passed")
+
+
+class SeqcounterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.counter = seqwindow.Seqcounter(64)
+
+    def test_copies(self):
+        # three links, each delivering every packet, with jitter
+        seqs = [(65400 + i) % 65536 for i in range(0, 300)]
+        arrivals = []
+        for link in range(0, 3):
+            arrivals += [(i + random.uniform(0, 20), seq)
+                         for (i, seq) in enumerate(seqs)]
+        counts = {}
+        for (time, seq) in sorted(arrivals):
+            self.assertEqual(self.counter.countseq(seq), counts.get(seq, 0),
+                             "Incorrect count")
+            counts[seq] = counts.get(seq, 0) + 1
+
+    def test_slide(self):
+        self.counter.countseq(10)
+        self.counter.countseq(11)
+        # the counts are cleared as the window moves past them
+        self.counter.countseq(10 + 64)
+        self.assertEqual(self.counter.countseq(11), 1, "Count lost")
+        self.counter.countseq(11 + 64 + 63)
+        self.assertEqual(self.counter.countseq(11 + 64), 0,
+                         "Count not cleared")
+
+    def test_restart(self):
+        for seq in range(5000, 5100):
+            self.counter.countseq(seq)
+        # older than the window, so counted as seen until there's enough
+        # in a row that the sender has restarted
+        for seq in range(0, 31):
+            self.assertEqual(self.counter.countseq(seq), 255,
+                             "Old seq not counted")
+        self.assertEqual(self.counter.countseq(31), 0, "Restarted seq counted")
+        self.assertEqual(self.counter.countseq(31), 1,
+                         "Repeat seq not counted")
+
+    def test_lagging(self):
+        # one link delivering every packet, and another far behind it
+        for seq in range(0, 3000):
+            self.assertEqual(self.counter.countseq(seq), 0, "New seq counted")
+            if seq >= 1500:
+                self.assertEqual(self.counter.countseq(seq - 1500), 255,
+                                 "Lagging copy not counted")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -27,10 +27,14 @@ import time
 import unittest
 import random
 import os
+import urllib.request
 
 # Via pip
 
 # in this repo
+from TelemXnet import devicedict
+from TelemXnet import metrics
+from TelemXnet import ratelimit
 from TelemXnet import unipacket
 from TelemXnet import udpxciever
 from TelemXnet import serverhub
@@ -38,10 +42,12 @@ from TelemXnet import util
 
 
 class ServerhubTestCase(unittest.TestCase):
+    engine = 'threaded'
+
     def setUp(self):
         # testing the serrver
         # print("Booting Server")
-        self.srv = serverhub.ServerHub()
+        self.srv = serverhub.ServerHub(engine=self.engine)
         self.srv.run()
         time.sleep(0.05)
 
@@ -65,6 +71,9 @@ class ServerhubTestCase(unittest.TestCase):
                                                       b"CL_BEGIN"))
         self.clientGCS.writepacket(self.makePacketrnd(network_id, -device_idGCS,
                                                       b"CL_BEGIN"))
+        # the queued packets are all sent at once, so wait for both sides
+        # to register before sending data
+        time.sleep(0.01)
 
         # send data packets
         basetime = util.gettimestamp()
@@ -87,6 +96,33 @@ class ServerhubTestCase(unittest.TestCase):
         self.assertEqual(msgUAS, retmsgGCS, "Message UAS -> GCS incorrect")
         self.assertEqual(msgGCS, retmsgUAS, "Message GCS -> UAS incorrect")
 
+    def test_edgedevices(self):
+        # the highest device on each side
+        network_id = os.urandom(32)
+        msgUAS = self.makePacketrnd(network_id, 31)
+        msgGCS = self.makePacketrnd(network_id, 63)
+
+        self.clientUAS.writepacket(self.makePacketrnd(network_id, -31,
+                                                      b"CL_BEGIN"))
+        self.clientGCS.writepacket(self.makePacketrnd(network_id, -63,
+                                                      b"CL_BEGIN"))
+        time.sleep(0.01)
+
+        basetime = util.gettimestamp()
+        self.clientUAS.writepacket(msgUAS)
+        self.clientGCS.writepacket(msgGCS)
+        retmsgGCS = self.readpackettime(self.clientGCS, basetime)
+        retmsgUAS = self.readpackettime(self.clientUAS, basetime)
+
+        self.clientUAS.writepacket(self.makePacketrnd(network_id, -31,
+                                                      b"CL_END"))
+        self.clientGCS.writepacket(self.makePacketrnd(network_id, -63,
+                                                      b"CL_END"))
+        time.sleep(0.001)
+
+        self.assertEqual(msgUAS, retmsgGCS, "Message UAS -> GCS incorrect")
+        self.assertEqual(msgGCS, retmsgUAS, "Message GCS -> UAS incorrect")
+
     def test_singleclientnoendpoint(self):
         # encode
         network_id = os.urandom(32)
@@ -129,6 +165,9 @@ class ServerhubTestCase(unittest.TestCase):
                                                       b'CL_BEGIN'))
         self.clientGCS.writepacket(self.makePacketrnd(network_id, -device_idGCS,
                                                       b'CL_BEGIN'))
+        # the queued packets are all sent at once, so wait for both sides
+        # to register before sending data
+        time.sleep(0.01)
 
         # send data packets
         basetime = util.gettimestamp()
@@ -165,6 +204,7 @@ class ServerhubTestCase(unittest.TestCase):
         # send initial packets
         self.clientUAS.writepacket(self.makePacketrnd(network_id, -device_idUAS,
                                                       b'CL_BEGIN'))
+        time.sleep(0.01)
 
         # send ping packet
         pingpkt = self.makePacketrnd(network_id, -device_idUAS, b'CL_SVRPING')
@@ -179,14 +219,152 @@ class ServerhubTestCase(unittest.TestCase):
         time.sleep(0.001)
         self.assertEqual(retping, pingpkt, "MessageP GCS -> GCS incorr")
 
-    def makePacketrnd(self, network_id, device_id, _payload=b''):
+    def test_serverprobe(self):
+        # encode
+        network_id = os.urandom(32)
+        device_idUAS = random.randint(1, 31)
+
+        # send initial packets
+        self.clientUAS.writepacket(self.makePacketrnd(network_id, -device_idUAS,
+                                                      b'CL_BEGIN'))
+        time.sleep(0.01)
+
+        # send a probe, which is a ping with a timestamp
+        probepkt = self.makePacketrnd(network_id, -device_idUAS,
+                                      b'CL_SVRPING' + os.urandom(8))
+        starttime = util.gettimestamp()
+        self.clientUAS.writepacket(probepkt)
+        time.sleep(0.001)
+        retprobe = self.readpackettime(self.clientUAS, starttime)
+
+        # send end packets
+        self.clientUAS.writepacket(self.makePacketrnd(network_id, -device_idUAS,
+                                                      b'CL_END'))
+        time.sleep(0.001)
+        self.assertEqual(retprobe, probepkt, "MessageP GCS -> GCS incorr")
+
+    def test_checkmismatch(self):
+        # encode
+        network_id = os.urandom(32)
+        device_idUAS = random.randint(1, 31)
+        device_idGCS = random.randint(32, 63)
+        crc = unipacket.CHECK_CRC32
+
+        # UAS registers with a CRC32 check
+        self.clientUAS.writepacket(self.makePacketrnd(network_id, -device_idUAS,
+                                                      b'CL_BEGIN', crc))
+        self.clientGCS.writepacket(self.makePacketrnd(network_id, -device_idGCS,
+                                                      b'CL_BEGIN'))
+        time.sleep(0.001)
+
+        # a packet from the UAS with a different check is dropped
+        self.clientUAS.writepacket(self.makePacketrnd(network_id, device_idUAS))
+        time.sleep(0.01)
+        self.assertEqual(None, self.clientGCS.readpacket(),
+                         "Message with wrong check passed")
+
+        # but not with the registered check
+        msgUAS = self.makePacketrnd(network_id, device_idUAS, b'', crc)
+        basetime = util.gettimestamp()
+        self.clientUAS.writepacket(msgUAS)
+        retmsgGCS = self.readpackettime(self.clientGCS, basetime)
+
+        # send end packets
+        self.clientUAS.writepacket(self.makePacketrnd(network_id, -device_idUAS,
+                                                      b'CL_END', crc))
+        self.clientGCS.writepacket(self.makePacketrnd(network_id, -device_idGCS,
+                                                      b'CL_END'))
+        time.sleep(0.001)
+        self.assertEqual(msgUAS, retmsgGCS, "Message UAS -> GCS incorrect")
+
+    def test_verifymode(self):
+        # encode
+        network_id = os.urandom(32)
+        device_idUAS = random.randint(1, 31)
+        device_idGCS = random.randint(32, 63)
+        msgUAS = self.makePacketrnd(network_id, device_idUAS)
+        badmsgUAS = msgUAS[:-3] + bytes([msgUAS[-3] % 255 + 1]) + msgUAS[-2:]
+
+        # send initial packets
+        self.clientUAS.writepacket(self.makePacketrnd(network_id, -device_idUAS,
+                                                      b'CL_BEGIN'))
+        self.clientGCS.writepacket(self.makePacketrnd(network_id, -device_idGCS,
+                                                      b'CL_BEGIN'))
+        time.sleep(0.001)
+
+        # a corrupt data packet is dropped when verifying all packets
+        self.clientUAS.writepacket(badmsgUAS)
+        time.sleep(0.01)
+        self.assertEqual(None, self.clientGCS.readpacket(),
+                         "Corrupt message passed")
+
+        # and forwarded as-is when only verifying control packets
+        self.srv.router.verify = 'control'
+        basetime = util.gettimestamp()
+        self.clientUAS.writepacket(badmsgUAS)
+        retmsgGCS = self.readpackettime(self.clientGCS, basetime)
+
+        # send end packets
+        self.clientUAS.writepacket(self.makePacketrnd(network_id, -device_idUAS,
+                                                      b'CL_END'))
+        self.clientGCS.writepacket(self.makePacketrnd(network_id, -device_idGCS,
+                                                      b'CL_END'))
+        time.sleep(0.001)
+        self.assertEqual(badmsgUAS, retmsgGCS, "Message UAS -> GCS incorrect")
+
+    def test_sessiontoken(self):
+        # encode
+        network_id = os.urandom(32)
+        device_idUAS = random.randint(1, 31)
+        device_idGCS = random.randint(32, 63)
+        pkt = unipacket.Unipacket()
+
+        # send initial packets, asking for a token
+        basetime = util.gettimestamp()
+        self.clientUAS.writepacket(self.makePacketrnd(network_id, -device_idUAS,
+                                                      b'CL_BEGIN+TOKEN'))
+        retmsgUAS = pkt.recoverpacket(self.readpackettime(self.clientUAS,
+                                                          basetime))
+        self.clientGCS.writepacket(self.makePacketrnd(network_id, -device_idGCS,
+                                                      b'CL_BEGIN+TOKEN'))
+        retmsgGCS = pkt.recoverpacket(self.readpackettime(self.clientGCS,
+                                                          basetime))
+        self.assertEqual(retmsgUAS.Payload[:8], b'CL_TOKEN', "No token")
+        token = retmsgUAS.Payload[8:]
+        self.assertEqual(len(token), unipacket.TOKEN_LENGTH, "Bad token")
+        self.assertEqual(retmsgGCS.Payload[8:], token, "Token not shared")
+
+        # send data packets with the compact header
+        msgUAS = self.makePacketrnd(token, device_idUAS)
+        msgUASfull = self.makePacketrnd(network_id, device_idUAS)
+        badmsgUAS = self.makePacketrnd(os.urandom(unipacket.TOKEN_LENGTH),
+                                       device_idUAS)
+        basetime = util.gettimestamp()
+        self.clientUAS.writepacket(badmsgUAS)
+        self.clientUAS.writepacket(msgUAS)
+        self.clientUAS.writepacket(msgUASfull)
+        retmsgGCS = self.readpackettime(self.clientGCS, basetime)
+        retmsgGCSfull = self.readpackettime(self.clientGCS, basetime)
+
+        # send end packets
+        self.clientUAS.writepacket(self.makePacketrnd(token, -device_idUAS,
+                                                      b'CL_END'))
+        self.clientGCS.writepacket(self.makePacketrnd(network_id, -device_idGCS,
+                                                      b'CL_END'))
+        time.sleep(0.001)
+        # the server threads may forward in either order
+        self.assertEqual({msgUAS, msgUASfull}, {retmsgGCS, retmsgGCSfull},
+                         "Message UAS -> GCS incorrect")
+
+    def makePacketrnd(self, network_id, device_id, _payload=b'',
+                      check=unipacket.CHECK_SHA256):
         seq = random.randint(0, 10000)
         if _payload == b'':
             payload = os.urandom(16)
         else:
             payload = _payload
 
-        pkt = unipacket.Unipacket()
+        pkt = unipacket.Unipacket(check)
         msg = pkt.buildpacket(network_id, device_id, seq, payload)
 
         return msg
@@ -202,6 +380,217 @@ class ServerhubTestCase(unittest.TestCase):
         self.assertTrue(delaytime < 600, "Response time is too long")
         return ret_msg
 
+    def test_routetimeout(self):
+        # a server that drops devices after 0.2 sec idle
+        srv = serverhub.ServerHub(portin=16251, engine=self.engine,
+                                  route_timeout=0.2)
+        srv.run()
+        client = udpxciever.Udpxciever("127.0.0.1", 16251)
+        client.start()
+        network_id = os.urandom(32)
+        client.writepacket(self.makePacketrnd(network_id, -5, b'CL_BEGIN'))
+        time.sleep(0.1)
+        devicedb = srv.router.devicedb
+        registered = devicedb.gettoken(network_id) is not None
+
+        # sending packets keeps it registered
+        for i in range(0, 4):
+            client.writepacket(self.makePacketrnd(network_id, 5))
+            time.sleep(0.1)
+        kept = devicedb.gettoken(network_id) is not None
+        time.sleep(0.5)
+        client.close()
+        srv.close()
+
+        self.assertTrue(registered, "Device not registered")
+        self.assertTrue(kept, "Active device expired")
+        self.assertEqual(devicedb.gettoken(network_id), None,
+                         "Idle device not expired")
+        self.assertEqual(devicedb.expired, 1, "Expiry not counted")
+
+    def test_copies(self):
+        # a server that forwards 1 copy of each packet
+        srv = serverhub.ServerHub(portin=16251, engine=self.engine, copies=1)
+        srv.run()
+        # a UAS and GCS with 2 links each
+        clients = [udpxciever.Udpxciever("127.0.0.1", 16251)
+                   for i in range(0, 4)]
+        for client in clients:
+            client.start()
+        network_id = os.urandom(32)
+        device_ids = [1, 2, 32, 33]
+        for (client, device_id) in zip(clients, device_ids):
+            client.writepacket(self.makePacketrnd(network_id, -device_id,
+                                                  b'CL_BEGIN'))
+        time.sleep(0.05)
+
+        # the UAS sends a packet on each link, with the same sequence number
+        pkt = unipacket.Unipacket()
+        for seq in range(0, 3):
+            clients[0].writepacket(pkt.buildpacket(network_id, 1, seq, b'a'))
+            clients[1].writepacket(pkt.buildpacket(network_id, 2, seq, b'a'))
+        time.sleep(0.1)
+        retmsgs = []
+        for client in clients[2:]:
+            msgs = []
+            msg = client.readpacket()
+            while msg is not None:
+                msgs.append(pkt.recoverpacket(msg).Sequence)
+                msg = client.readpacket()
+            retmsgs.append(sorted(msgs))
+
+        for (client, device_id) in zip(clients, device_ids):
+            client.writepacket(self.makePacketrnd(network_id, -device_id,
+                                                  b'CL_END'))
+        time.sleep(0.01)
+        for client in clients:
+            client.close()
+        srv.close()
+
+        self.assertEqual(retmsgs, [[0, 1, 2], [0, 1, 2]],
+                         "Not one copy per GCS link")
+
+    def test_stats(self):
+        # a server with its metrics on a HTTP port, and its own routing
+        # table
+        srv = serverhub.ServerHub(portin=16251, engine=self.engine,
+                                  route_timeout=60, stats_port=16280)
+        srv.run()
+        clients = [udpxciever.Udpxciever("127.0.0.1", 16251)
+                   for i in range(0, 2)]
+        for client in clients:
+            client.start()
+        network_id = os.urandom(32)
+        clients[0].writepacket(self.makePacketrnd(network_id, -1,
+                                                  b'CL_BEGIN'))
+        clients[1].writepacket(self.makePacketrnd(network_id, -32,
+                                                  b'CL_BEGIN'))
+        time.sleep(0.05)
+        for i in range(0, 3):
+            clients[0].writepacket(self.makePacketrnd(network_id, 1, b'data'))
+        # a corrupt packet, and one for a network with no devices
+        clients[0].writepacket(self.makePacketrnd(network_id, 1)[:-2] +
+                               b'x\x00')
+        clients[0].writepacket(self.makePacketrnd(os.urandom(32), 1))
+        time.sleep(0.1)
+        with urllib.request.urlopen("http://127.0.0.1:16280/metrics") as f:
+            stats = f.read().decode('utf8').splitlines()
+        token = srv.router.devicedb.gettoken(network_id).hex()
+        label = metrics.networklabel(network_id)
+
+        for client in clients:
+            client.close()
+        srv.close()
+
+        self.assertIn('telemxnet_bad_packets_total 1', stats,
+                      "Bad packet not counted")
+        self.assertIn('telemxnet_unknown_route_total 1', stats,
+                      "Unknown route not counted")
+        self.assertIn('telemxnet_network_packets_in_total{network="' + label +
+                      '"} 5', stats, "Packets in not counted")
+        self.assertIn('telemxnet_network_packets_out_total{network="' +
+                      label + '"} 3', stats, "Packets out not counted")
+        # the session token routes packets, so mustn't be exported
+        self.assertNotIn(token, '\n'.join(stats), "Token exported")
+        self.assertIn('telemxnet_fanout_size_count 3', stats,
+                      "Fan-out not counted")
+        self.assertIn('telemxnet_handler_seconds_count 7', stats,
+                      "Handler latency not counted")
+        self.assertIn('telemxnet_route_networks 1', stats,
+                      "Route table size incorrect")
+
+    def test_ratelimit(self):
+        # a server limiting each client to 50 packets/sec
+        srv = serverhub.ServerHub(portin=16251, engine=self.engine,
+                                  route_timeout=60, source_rate=50)
+        srv.run()
+        clients = [udpxciever.Udpxciever("127.0.0.1", 16251)
+                   for i in range(0, 4)]
+        for client in clients:
+            client.start()
+        # a flooding network and a quiet one
+        network_ids = [os.urandom(32), os.urandom(32)]
+        for (i, client) in enumerate(clients):
+            client.writepacket(self.makePacketrnd(network_ids[i // 2],
+                                                  -(i % 2) * 32 - 1,
+                                                  b'CL_BEGIN'))
+        time.sleep(0.05)
+        for i in range(0, 500):
+            clients[0].writepacket(self.makePacketrnd(network_ids[0], 1))
+        quiet = self.makePacketrnd(network_ids[1], 1)
+        clients[2].writepacket(quiet)
+        time.sleep(0.3)
+        flood = 0
+        while clients[1].readpacket() is not None:
+            flood += 1
+        retmsg = clients[3].readpacket()
+        dropped = srv.router.metrics.counters['dropped_source']
+
+        for client in clients:
+            client.close()
+        srv.close()
+
+        self.assertEqual(retmsg, quiet, "Quiet network starved")
+        self.assertLess(flood, 100, "Flood not limited")
+        self.assertEqual(flood + dropped, 500, "Drops not counted")
+
+    def test_blocklist(self):
+        # a client sending junk is blocked, but not the other clients, nor
+        # a registered client sending junk
+        srv = serverhub.ServerHub(portin=16251, engine=self.engine,
+                                  route_timeout=60, block_time=60)
+        srv.run()
+        clients = [udpxciever.Udpxciever("127.0.0.1", 16251)
+                   for i in range(0, 3)]
+        for client in clients:
+            client.start()
+        network_id = os.urandom(32)
+        for (client, device_id) in zip(clients[1:], [1, 32]):
+            client.writepacket(self.makePacketrnd(network_id, -device_id,
+                                                  b'CL_BEGIN'))
+        time.sleep(0.05)
+        for i in range(0, 50):
+            clients[0].writepacket(os.urandom(20))
+            clients[1].writepacket(os.urandom(20))
+        time.sleep(0.1)
+        msgs = [self.makePacketrnd(network_id, 2),
+                self.makePacketrnd(network_id, 1)]
+        clients[0].writepacket(self.makePacketrnd(network_id, -2,
+                                                  b'CL_BEGIN'))
+        time.sleep(0.05)
+        clients[0].writepacket(msgs[0])
+        clients[1].writepacket(msgs[1])
+        time.sleep(0.1)
+        retmsgs = []
+        msg = clients[2].readpacket()
+        while msg is not None:
+            retmsgs.append(msg)
+            msg = clients[2].readpacket()
+        counters = srv.router.metrics.counters
+
+        for client in clients:
+            client.close()
+        srv.close()
+
+        self.assertEqual(retmsgs, [msgs[1]], "Blocked client forwarded")
+        # blocked after the first 20 invalid packets
+        self.assertEqual(counters['rejected'], 71, "Junk not rejected")
+        self.assertEqual(counters['blocklisted'], 1, "Client not blocked")
+        self.assertEqual(counters['blocked'], 31,
+                         "Blocked packets not counted")
+
+    def test_noblocklist(self):
+        # blocking is off by default
+        srv = serverhub.ServerHub(portin=16251, engine=self.engine)
+        srv.run()
+        time.sleep(0.05)
+        srv.close()
+        self.assertEqual(srv.router.blocklist, None, "Blocking on")
+
+    def test_badengine(self):
+        with self.assertRaises(ValueError):
+            serverhub.ServerHub(portin=16251, engine='gevent')
+
     def tearDown(self):
         # print("Term")
         self.clientUAS.close()
@@ -209,5 +598,214 @@ class ServerhubTestCase(unittest.TestCase):
         self.srv.close()
         time.sleep(0.01)
 
+
+class ServerhubAsyncioTestCase(ServerhubTestCase):
+    """The same tests, on the asyncio engine"""
+    engine = 'asyncio'
+
+
+class ServerhubBatchedTestCase(ServerhubTestCase):
+    """The same tests, on the batched engine"""
+    engine = 'batched'
+
+
+class RouterTestCase(unittest.TestCase):
+    """The routing of packets, without a socket"""
+    def setUp(self):
+        self.key = os.urandom(16)
+        self.hmac = unipacket.Unipacket(unipacket.CHECK_HMAC, self.key)
+        self.crc = unipacket.Unipacket(unipacket.CHECK_CRC32)
+        self.network_id = os.urandom(32)
+        self.sent = []
+        self.uas = ("127.0.0.1", 1000)
+        self.gcs = ("127.0.0.1", 1001)
+
+    def sendto(self, data, address):
+        self.sent.append((data, address))
+
+    def makerouter(self, verify):
+        router = serverhub.Router([unipacket.CHECK_HMAC], self.key, verify,
+                                  db=devicedict.Devicedict())
+        for (address, device_id) in ((self.uas, 1), (self.gcs, 32)):
+            router.handle(self.hmac.buildpacket(self.network_id, -device_id,
+                                                0, b'CL_BEGIN'),
+                          address, self.sendto)
+        return router
+
+    def test_hmacforged(self):
+        for verify in ('all', 'control'):
+            router = self.makerouter(verify)
+            # keyless CRC32 packets, from a registered and an
+            # unregistered device, are not forwarded
+            for device_id in (1, 2):
+                router.handle(self.crc.buildpacket(self.network_id,
+                                                   device_id, 1, b'forged'),
+                              self.uas, self.sendto)
+            self.assertEqual(self.sent, [], "Forged packet forwarded")
+
+            # nor is an HMAC packet from an unregistered device
+            router.handle(self.hmac.buildpacket(self.network_id, 2, 1,
+                                                b'unknown'),
+                          self.uas, self.sendto)
+            self.assertEqual(self.sent, [], "Unregistered device forwarded")
+            self.assertEqual(router.metrics.counters['unknown_device'], 1,
+                             "Unregistered device not counted")
+
+            # but a registered device is
+            msg = self.hmac.buildpacket(self.network_id, 1, 1, b'genuine')
+            router.handle(msg, self.uas, self.sendto)
+            self.assertEqual(self.sent, [(msg, self.gcs)],
+                             "Message UAS -> GCS incorrect")
+            self.sent = []
+
+    def test_prune(self):
+        # routes that go without a CL_END, eg. by expiry, don't leave
+        # their sequence counters and metrics behind
+        db = devicedict.Devicedict()
+        router = serverhub.Router(db=db, copies=1)
+        pkt = unipacket.Unipacket()
+        for i in range(0, 200):
+            network_id = os.urandom(32)
+            for (address, device_id) in ((self.uas, 1), (self.gcs, 32)):
+                router.handle(pkt.buildpacket(network_id, -device_id, 0,
+                                              b'CL_BEGIN'),
+                              address, self.sendto)
+            router.handle(pkt.buildpacket(network_id, 1, 0, b'data'),
+                          self.uas, self.sendto)
+            token = db.gettoken(network_id)
+            db.removeremote(token, 1)
+            db.removeremote(token, 32)
+        self.assertEqual(len(self.sent), 200, "Data not forwarded")
+        self.assertLess(len(router.seqcounters), 64, "Counters not pruned")
+        self.assertLess(len(router.metrics.networks), 64,
+                        "Metrics not pruned")
+        router.prune()
+        self.assertEqual(router.seqcounters, {}, "Counters not pruned")
+        self.assertEqual(router.metrics.networks, {}, "Metrics not pruned")
+
+    def test_hubcopies(self):
+        router = serverhub.Router(db=devicedict.Devicedict(), copies=1)
+        pkt = unipacket.Unipacket()
+        gcslink = ("127.0.0.1", 1002)
+        gcstwo = ("127.0.0.1", 1003)
+        for (address, device_id) in ((self.uas, 2), (self.gcs, 33),
+                                     (gcslink, 34), (gcstwo, 40)):
+            router.handle(pkt.buildpacket(self.network_id, -device_id, 0,
+                                          b'CL_BEGIN'),
+                          address, self.sendto)
+        # two GCS hubs, each with its own sequence numbers
+        for (address, device_id) in ((self.gcs, 33), (gcstwo, 40)):
+            router.handle(pkt.buildpacket(self.network_id, device_id, 0,
+                                          b'data'),
+                          address, self.sendto)
+        self.assertEqual(len(self.sent), 2, "Other hub's packet dropped")
+        self.assertEqual(router.metrics.counters['duplicates'], 0,
+                         "Other hub's packet counted as a duplicate")
+
+        # a copy from another link of the hub is dropped, including one
+        # from a link lagging far behind
+        self.sent = []
+        for seq in range(1, 1600):
+            router.handle(pkt.buildpacket(self.network_id, 33, seq, b'data'),
+                          self.gcs, self.sendto)
+            if seq > 1500:
+                router.handle(pkt.buildpacket(self.network_id, 34,
+                                              seq - 1500, b'data'),
+                              gcslink, self.sendto)
+        self.assertEqual(len(self.sent), 1599, "Lagging copy forwarded")
+        self.assertEqual(router.metrics.counters['duplicates'], 99,
+                         "Lagging copy not counted as a duplicate")
+
+    def test_networklimit(self):
+        limits = ratelimit.Ratelimits(network_rate=6)
+        db = devicedict.Devicedict()
+        router = serverhub.Router(db=db, limits=limits)
+        pkt = unipacket.Unipacket()
+        for (address, device_id) in ((self.uas, 1), (self.gcs, 32)):
+            router.handle(pkt.buildpacket(self.network_id, -device_id, 0,
+                                          b'CL_BEGIN'),
+                          address, self.sendto)
+        # the full header and the token share the network's one bucket
+        token = db.gettoken(self.network_id)
+        for seq in range(0, 10):
+            router.handle(pkt.buildpacket((self.network_id, token)[seq % 2],
+                                          1, seq, b'data'),
+                          self.uas, self.sendto)
+        self.assertLess(len(self.sent), 10, "Network not limited")
+        self.assertEqual(len(limits.networks.buckets), 1,
+                         "Network has more than one bucket")
+
+        # and unknown networks have none
+        for seq in range(0, 100):
+            router.handle(pkt.buildpacket(os.urandom(32), 1, seq, b'data'),
+                          self.uas, self.sendto)
+        self.assertEqual(list(limits.networks.buckets), [token],
+                         "Unknown network has a bucket")
+
+    def test_defaultchecks(self):
+        router = serverhub.Router(key=self.key, db=devicedict.Devicedict())
+        self.assertEqual(router.checks, [unipacket.CHECK_HMAC],
+                         "Unkeyed checks allowed with a key")
+        router = serverhub.Router(db=devicedict.Devicedict())
+        self.assertNotIn(unipacket.CHECK_HMAC, router.checks,
+                         "HMAC allowed without a key")
+
+
+class ServerhubShardedTestCase(unittest.TestCase):
+    """Forwarding through several worker processes. Each client is
+    handled by one of the workers"""
+    makePacketrnd = ServerhubTestCase.makePacketrnd
+    readpackettime = ServerhubTestCase.readpackettime
+
+    def setUp(self):
+        self.srv = serverhub.ShardedServerHub(engine='asyncio', workers=3)
+        self.srv.run()
+
+    def test_manyclients(self):
+        # enough clients that they are spread over the workers
+        network_id = os.urandom(32)
+        clients = [udpxciever.Udpxciever("127.0.0.1", 16250)
+                   for i in range(0, 8)]
+        for client in clients:
+            client.start()
+        time.sleep(0.01)
+
+        # a UAS and 7 GCS's. The CL_BEGINs may go to different workers,
+        # so allow them all to be processed
+        device_ids = [1] + list(range(32, 39))
+        for (client, device_id) in zip(clients, device_ids):
+            client.writepacket(self.makePacketrnd(network_id, -device_id,
+                                                  b'CL_BEGIN'))
+        time.sleep(0.1)
+
+        msgUAS = self.makePacketrnd(network_id, 1)
+        basetime = util.gettimestamp()
+        clients[0].writepacket(msgUAS)
+        retmsgGCS = [self.readpackettime(client, basetime)
+                     for client in clients[1:]]
+
+        # and one GCS back to the UAS
+        msgGCS = self.makePacketrnd(network_id, 38)
+        basetime = util.gettimestamp()
+        clients[7].writepacket(msgGCS)
+        retmsgUAS = self.readpackettime(clients[0], basetime)
+
+        for (client, device_id) in zip(clients, device_ids):
+            client.writepacket(self.makePacketrnd(network_id, -device_id,
+                                                  b'CL_END'))
+        time.sleep(0.1)
+        for client in clients:
+            client.close()
+
+        self.assertEqual([msgUAS] * 7, retmsgGCS, "Message UAS -> GCS incorr")
+        self.assertEqual(msgGCS, retmsgUAS, "Message GCS -> UAS incorr")
+        # and the routes are freed
+        self.assertEqual(self.srv.devicedb.gettoken(network_id), None,
+                         "Token not freed")
+
+    def tearDown(self):
+        self.srv.close()
+        time.sleep(0.01)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Unit tests for Timerwheel
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+import unittest
+import random
+
+# via pip
+
+# in this repo
+from TelemXnet import timerwheel
+
+
+class TimerwheelTestCase(unittest.TestCase):
+    def setUp(self):
+        # 4 slots and 3 levels, so 64 ticks
+        self.wheel = timerwheel.Timerwheel(0.5, 4, 3, 100)
+
+    def runwheel(self, ticks, adds):
+        """Advance the wheel one tick at a time, adding the timers in
+        adds {tick: [deadline]} along the way. Returns {deadline: tick
+        it went off}"""
+        fired = {}
+        start = self.wheel.current
+        for tick in range(start, start + ticks):
+            for deadline in adds.get(tick, []):
+                self.wheel.add(deadline, deadline)
+            for deadline in self.wheel.advance((tick + 1) * 0.5):
+                fired[deadline] = tick + 1
+        return fired
+
+    def test_deadlines(self):
+        # timers on each level, added at different ticks
+        adds = {}
+        for i in range(0, 300):
+            tick = random.randint(200, 260)
+            adds.setdefault(tick, []).append(
+                (tick + random.randint(1, 63)) * 0.5 + random.random() * 0.01)
+        fired = self.runwheel(200, adds)
+        for deadlines in adds.values():
+            for deadline in deadlines:
+                self.assertEqual(fired[deadline], int(deadline / 0.5),
+                                 "Timer went off at the wrong tick")
+
+    def test_past(self):
+        # a deadline that has gone goes off at the next tick
+        self.wheel.add(10, "past")
+        self.assertEqual(self.wheel.advance(100.4), [])
+        self.assertEqual(self.wheel.advance(100.5), ["past"])
+
+    def test_toofar(self):
+        # past the top wheel goes off at the end of it
+        self.wheel.add(1000, "far")
+        self.assertEqual(self.runwheel(100, {}), {"far": 200 + 63})
+
+    def test_catchup(self):
+        # advancing many ticks at once
+        self.wheel.add(105, 1)
+        self.wheel.add(110, 2)
+        self.wheel.add(120, 3)
+        self.assertEqual(self.wheel.advance(115), [1, 2])
+        self.assertEqual(self.wheel.advance(130), [3])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -58,6 +58,81 @@ class UDPEchoServer(threading.Thread):
         self.isExit = True
 
 
+class PacketqueueTestCase(unittest.TestCase):
+    def test_dropoldest(self):
+        pktqueue = udpxciever.Packetqueue(4, udpxciever.DROP_OLDEST)
+        for i in range(0, 6):
+            pktqueue.append(bytes([i]))
+
+        self.assertEqual(len(pktqueue), 4, "Queue not bounded")
+        self.assertEqual(pktqueue.dropped, 2, "Drops not counted")
+        self.assertEqual([pktqueue.popleft() for i in range(0, 5)],
+                         [b'\x02', b'\x03', b'\x04', b'\x05', None],
+                         "Oldest not dropped")
+
+    def test_threads(self):
+        # both threads drop expired packets from the head. A fresh packet
+        # must never be dropped, nor a packet returned twice
+        pktqueue = udpxciever.Packetqueue(64, udpxciever.DROP_EXPIRED, 0.001)
+        popped = []
+
+        def popper():
+            while len(popped) < 5000:
+                packet = pktqueue.popleft()
+                if packet is not None:
+                    popped.append(packet)
+        thread = threading.Thread(target=popper)
+        thread.start()
+        count = 0
+        while thread.is_alive():
+            pktqueue.append(count)
+            count += 1
+        thread.join()
+        self.assertEqual(count, len(popped) + pktqueue.dropped +
+                         len(pktqueue), "Packets lost or duplicated")
+        self.assertEqual(popped, sorted(popped), "Packets out of order")
+
+    def test_dropnewest(self):
+        pktqueue = udpxciever.Packetqueue(4, udpxciever.DROP_NEWEST)
+        for i in range(0, 6):
+            pktqueue.append(bytes([i]))
+
+        self.assertEqual(pktqueue.dropped, 2, "Drops not counted")
+        self.assertEqual([pktqueue.popleft() for i in range(0, 4)],
+                         [b'\x00', b'\x01', b'\x02', b'\x03'],
+                         "Newest not dropped")
+
+    def test_dropexpired(self):
+        pktqueue = udpxciever.Packetqueue(4, udpxciever.DROP_EXPIRED, 1.0)
+        pktqueue.append(b'a', 0.0)
+        pktqueue.append(b'b', 0.5)
+        pktqueue.append(b'c', 1.2)
+        pktqueue.append(b'd', 1.3)
+        # full, so a and b (over 1 sec old) are dropped
+        pktqueue.append(b'e', 1.8)
+
+        self.assertEqual(pktqueue.dropped, 2, "Expired not dropped")
+        self.assertEqual(len(pktqueue), 3, "Expired not dropped")
+        # and c by the time it's read
+        self.assertEqual(pktqueue.popleft(2.25), b'd',
+                         "Expired packet returned")
+        self.assertEqual(pktqueue.dropped, 3, "Drops not counted")
+
+    def test_maxage(self):
+        pktqueue = udpxciever.Packetqueue(4, udpxciever.DROP_OLDEST, 0.5)
+        pktqueue.append(b'a', 0.0)
+
+        self.assertEqual(pktqueue.popleft(1.0), None,
+                         "Expired packet returned")
+        self.assertEqual(pktqueue.dropped, 1, "Drops not counted")
+
+    def test_badpolicy(self):
+        with self.assertRaises(ValueError):
+            udpxciever.Packetqueue(4, 'random')
+        with self.assertRaises(ValueError):
+            udpxciever.Packetqueue(4, udpxciever.DROP_EXPIRED)
+
+
 class UnipacketTestCase(unittest.TestCase):
     def setUp(self):
         # make a packet
@@ -109,16 +184,41 @@ class UnipacketTestCase(unittest.TestCase):
         self.msgtwo = self.pkt.buildpacket(self.network_id, self.device_id,
                                            self.sequence, b'fdfgdf')
         self.client.writepacket(self.msg)
-        # Send msgtwo in 2 parts
+        # Send msgtwo in 2 datagrams. Each is recieved as it was sent
         self.client.writepacket(self.msgtwo[0:10])
         self.client.writepacket(self.msgtwo[10:])
         time.sleep(0.01)
         ret_msg = self.client.readpacket()
         ret_msgtwo = self.client.readpacket()
+        ret_msgthree = self.client.readpacket()
 
         self.assertEqual(self.msg, ret_msg, "Message1 not passed in transit")
-        self.assertEqual(self.msgtwo, ret_msgtwo,
-                         "Message2 not passed in transit")
+        self.assertEqual(self.msgtwo[0:10], ret_msgtwo,
+                         "Message2 part 1 not passed in transit")
+        self.assertEqual(self.msgtwo[10:], ret_msgthree,
+                         "Message2 part 2 not passed in transit")
+
+    def test_packetsendrecieveburst(self):
+        msgs = [self.pkt.buildpacket(self.network_id, self.device_id, i,
+                                     os.urandom(16)) for i in range(0, 100)]
+        for msg in msgs:
+            self.client.writepacket(msg)
+        time.sleep(0.05)
+        ret_msgs = []
+        ret_msg = self.client.readpacket()
+        while ret_msg is not None:
+            ret_msgs.append(ret_msg)
+            ret_msg = self.client.readpacket()
+
+        self.assertEqual(msgs, ret_msgs, "Burst not passed in transit")
+
+    def test_queuestats(self):
+        self.client.writepacket(self.msg)
+        time.sleep(0.01)
+        self.assertEqual(self.client.getqueuestats(),
+                         {'tx_depth': 0, 'tx_dropped': 0,
+                          'rx_depth': 1, 'rx_dropped': 0},
+                         "Incorrect queue stats")
 
     def test_getiface(self):
         iface = self.client.getiface()
@@ -26,8 +26,10 @@
 import unittest
 import random
 import os
+import zlib
 
 # via pip
+from cobs import cobsr
 
 # in this repo
 from TelemXnet import unipacket
@@ -69,7 +71,8 @@ class UnipacketTestCase(unittest.TestCase):
 
     def test_corruptpacket(self):
         bad_msg = self.msg
-        bad_msg = bad_msg[:3] + b"+" + bad_msg[3+1:]
+        bad_msg = (bad_msg[:3] + bytes([bad_msg[3] % 255 + 1]) +
+                   bad_msg[3+1:])
         self.assertEqual(self.pkt.recoverpacket(bad_msg), None, "Bad CRC")
 
     def test_badpacket(self):
@@ -77,6 +80,104 @@ class UnipacketTestCase(unittest.TestCase):
         bad_msg = bad_msg[3:]
         self.assertEqual(self.pkt.recoverpacket(bad_msg), None, "Bad Packet")
 
+    def test_recoverinto(self):
+        buf = self.pkt.newbuffer()
+        buf_len = len(buf)
+        view = self.pkt.recoverpacket_into(self.msg, buf)
+        self.assertEqual(self.network_id, view.NetworkID, "Incorrect NetworkID")
+        self.assertEqual(self.device_id, view.DeviceID, "Incorrect DeviceID")
+        self.assertEqual(self.sequence, view.Sequence, "Incorrect Sequence")
+        self.assertEqual(self.payload, view.Payload, "Incorrect Payload")
+        self.assertTrue(view.Payload.obj is buf, "Payload not in buffer")
+
+        # the buffer is reused for the next packet
+        msg = self.pkt.buildpacket(self.network_id, self.device_id,
+                                   self.sequence, b'CL_BEGIN')
+        view = self.pkt.recoverpacket_into(msg, buf)
+        self.assertEqual(b'CL_BEGIN', view.Payload, "Incorrect Payload")
+        self.assertEqual(buf_len, len(buf), "Buffer resized")
+
+    def test_recoverintocorrupt(self):
+        buf = self.pkt.newbuffer()
+        bad_msg = (self.msg[:3] + bytes([self.msg[3] % 255 + 1]) +
+                   self.msg[3+1:])
+        self.assertEqual(self.pkt.recoverpacket_into(bad_msg, buf), None,
+                         "Bad CRC")
+        self.assertEqual(self.pkt.recoverpacket_into(self.msg[3:], buf), None,
+                         "Bad Packet")
+        self.assertEqual(self.pkt.recoverpacket_into(self.msg, bytearray(10)),
+                         None, "Packet larger than buffer")
+
+    def test_trailingbytes(self):
+        # a valid packet with junk after the check value
+        raw = cobsr.decode(self.msg[1:-1]) + os.urandom(3)
+        bad_msg = b'\x00' + cobsr.encode(raw) + b'\x00'
+        self.assertEqual(self.pkt.recoverpacket(bad_msg), None,
+                         "Trailing bytes accepted")
+        self.assertEqual(self.pkt.recoverpacket_into(bad_msg,
+                                                     self.pkt.newbuffer()),
+                         None, "Trailing bytes accepted")
+        self.assertEqual(self.pkt.recoverpacket_ref(bad_msg), None,
+                         "Trailing bytes accepted")
+
+    def test_recoverheader(self):
+        for i in range(0, 200):
+            network_id = bytes(random.choice([0, 1, 255]) for j in range(32))
+            payload = os.urandom(random.randint(1, 255))
+            msg = self.pkt.buildpacket(network_id, self.device_id,
+                                       self.sequence, payload)
+            hdr = self.pkt.recoverheader(msg)
+            self.assertEqual(network_id, hdr.NetworkID, "Incorrect NetworkID")
+            self.assertEqual(self.device_id, hdr.DeviceID, "Incorrect DeviceID")
+            self.assertEqual(self.sequence, hdr.Sequence, "Incorrect Sequence")
+            self.assertEqual(len(payload), hdr.Payload_length,
+                             "Incorrect Payload_length")
+
+    def test_recoverheaderbad(self):
+        self.assertEqual(self.pkt.recoverheader(self.msg[3:]), None,
+                         "Bad Packet")
+        self.assertEqual(self.pkt.recoverheader(self.msg[:20] + b'\x00'), None,
+                         "Short Packet")
+
+    def test_precheck(self):
+        # every valid packet passes, whatever its fields
+        for i in range(0, 200):
+            network_id = bytes(random.choice([0, 1, 255])
+                               for j in range(random.choice([4, 32])))
+            payload = bytes(random.choice([0, 1, 255])
+                            for j in range(random.randint(1, 255)))
+            msg = self.pkt.buildpacket(network_id, self.device_id,
+                                       self.sequence, payload)
+            self.assertTrue(self.pkt.precheck(msg), "Valid packet rejected")
+
+    def test_precheckbad(self):
+        self.assertFalse(self.pkt.precheck(b''), "Empty datagram passed")
+        self.assertFalse(self.pkt.precheck(self.msg[1:]), "No header passed")
+        self.assertFalse(self.pkt.precheck(self.msg[:-1]), "No footer passed")
+        self.assertFalse(self.pkt.precheck(self.msg[:20] + b'\x00'),
+                         "Short packet passed")
+        self.assertFalse(self.pkt.precheck(b'\x00' + b'\x01' * 400 +
+                                           b'\x00'), "Long packet passed")
+        # a Flags byte of an unknown version
+        self.assertFalse(self.pkt.precheck(self.msg[:2] + b'\x80' +
+                                           self.msg[3:]), "Bad Flags passed")
+
+    def test_buildpackets(self):
+        device_ids = [self.device_id, -self.device_id, 1, 32, -64, 64]
+        msgs = self.pkt.buildpackets(self.network_id, device_ids,
+                                     self.sequence, self.payload)
+        self.assertEqual(len(msgs), len(device_ids), "Incorrect packet count")
+        for (dev_id, msg) in zip(device_ids, msgs):
+            self.assertEqual(msg, self.pkt.buildpacket(self.network_id, dev_id,
+                                                       self.sequence,
+                                                       self.payload),
+                             "Incorrect packet for DeviceID")
+
+    def test_buildpacketsbaddeviceid(self):
+        msgs = self.pkt.buildpackets(self.network_id, [self.device_id, 68],
+                                     self.sequence, self.payload)
+        self.assertEqual(msgs, None, "Bad DeviceID")
+
     def test_baddeviceid(self):
         bad_device_id = 68
         msg = self.pkt.buildpacket(self.network_id, bad_device_id,
@@ -101,5 +202,339 @@ class UnipacketTestCase(unittest.TestCase):
                                    self.sequence, bad_payload)
         self.assertEqual(msg, None, "Bad Payload")
 
+
+    def test_coalesce(self):
+        datagrams = [os.urandom(random.randint(1, 40)) for i in range(0, 4)]
+        payload = self.pkt.coalesce(datagrams)
+        msg = self.pkt.buildpacket(self.network_id, self.device_id,
+                                   self.sequence, payload,
+                                   unipacket.FLAG_COALESCED)
+        ret_pkt = self.pkt.recoverpacket(msg)
+        self.assertTrue(ret_pkt.Flags & unipacket.FLAG_COALESCED,
+                        "Incorrect Flags")
+        self.assertEqual(self.pkt.splitpayload(ret_pkt.Payload), datagrams,
+                         "Incorrect datagrams")
+        view = self.pkt.recoverpacket_into(msg, self.pkt.newbuffer())
+        self.assertEqual(self.pkt.splitpayload(view.Payload), datagrams,
+                         "Incorrect datagrams")
+
+    def test_splitpayloadbad(self):
+        self.assertEqual(self.pkt.splitpayload(b'\x04abc'), None,
+                         "Short datagram")
+        self.assertEqual(self.pkt.splitpayload(b'\x01a\x00'), None,
+                         "Empty datagram")
+
+
+class UnipacketCompressTestCase(unittest.TestCase):
+    """Tests of compressed payloads"""
+    def setUp(self):
+        self.zdict = b'HEARTBEAT ATTITUDE GLOBAL_POSITION_INT' * 4
+        self.pkt = unipacket.Unipacket(zdict=self.zdict)
+        self.device_id = random.randint(-64, 64)
+        self.network_id = os.urandom(32)
+        self.sequence = random.randint(0, 10000)
+        self.payload = b'ATTITUDE GLOBAL_POSITION_INT HEARTBEAT'
+
+    def test_compress(self):
+        msg = self.pkt.buildpacket(self.network_id, self.device_id,
+                                   self.sequence, self.payload,
+                                   unipacket.FLAG_COMPRESSED)
+        plain_msg = self.pkt.buildpacket(self.network_id, self.device_id,
+                                         self.sequence, self.payload)
+        self.assertLess(len(msg), len(plain_msg), "Not compressed")
+
+        ret_pkt = self.pkt.recoverpacket(msg)
+        self.assertTrue(ret_pkt.Flags & unipacket.FLAG_COMPRESSED,
+                        "Incorrect Flags")
+        self.assertEqual(self.payload, ret_pkt.Payload, "Incorrect Payload")
+        self.assertEqual(len(self.payload), ret_pkt.Payload_length,
+                         "Incorrect Payload_length")
+        view = self.pkt.recoverpacket_into(msg, self.pkt.newbuffer())
+        self.assertEqual(self.payload, view.Payload, "Incorrect Payload")
+        self.assertEqual(self.payload, self.pkt.recoverpacket_ref(msg).Payload,
+                         "Incorrect Payload")
+
+    def test_compressbuildpackets(self):
+        device_ids = [self.device_id, 1, 32]
+        msgs = self.pkt.buildpackets(self.network_id, device_ids,
+                                     self.sequence, self.payload,
+                                     unipacket.FLAG_COMPRESSED)
+        for (dev_id, msg) in zip(device_ids, msgs):
+            self.assertEqual(msg, self.pkt.buildpacket(
+                self.network_id, dev_id, self.sequence, self.payload,
+                unipacket.FLAG_COMPRESSED), "Incorrect packet for DeviceID")
+            self.assertEqual(self.payload, self.pkt.recoverpacket(msg).Payload,
+                             "Incorrect Payload")
+
+    def test_incompressible(self):
+        payload = os.urandom(40)
+        msg = self.pkt.buildpacket(self.network_id, self.device_id,
+                                   self.sequence, payload,
+                                   unipacket.FLAG_COMPRESSED)
+        ret_pkt = self.pkt.recoverpacket(msg)
+        self.assertFalse(ret_pkt.Flags & unipacket.FLAG_COMPRESSED,
+                         "Compressed when larger")
+        self.assertEqual(payload, ret_pkt.Payload, "Incorrect Payload")
+
+    def test_baddecompress(self):
+        self.assertEqual(self.pkt.decompresspayload(b'\xff\xff\xff'), None,
+                         "Bad compressed payload")
+        # a payload that won't fit in a packet
+        comp = zlib.compressobj(9, zlib.DEFLATED, -12)
+        bomb = self.pkt.zdict_id + comp.compress(b'A' * 1000) + comp.flush()
+        self.assertEqual(self.pkt.decompresspayload(bomb), None,
+                         "Oversized payload")
+
+    def test_mismatcheddict(self):
+        # a receiver with a different dictionary, or none, rejects the
+        # packet rather than decompressing it to garbage
+        msg = self.pkt.buildpacket(self.network_id, self.device_id,
+                                   self.sequence, self.payload,
+                                   unipacket.FLAG_COMPRESSED)
+        for other in (unipacket.Unipacket(zdict=self.zdict[::-1]),
+                      unipacket.Unipacket()):
+            self.assertEqual(other.recoverpacket(msg), None,
+                             "Wrong dictionary accepted")
+            self.assertEqual(other.recoverpacket_into(msg, other.newbuffer()),
+                             None, "Wrong dictionary accepted")
+            self.assertEqual(other.recoverpacket_ref(msg), None,
+                             "Wrong dictionary accepted")
+        # but the same dictionary is accepted
+        other = unipacket.Unipacket(zdict=bytes(self.zdict))
+        self.assertEqual(other.recoverpacket(msg).Payload, self.payload,
+                         "Same dictionary rejected")
+
+
+class UnipacketCheckTestCase(unittest.TestCase):
+    """Tests of the integrity check algorithms"""
+    def setUp(self):
+        self.device_id = random.randint(-64, 64)
+        self.network_id = os.urandom(32)
+        self.sequence = random.randint(0, 10000)
+        self.payload = os.urandom(16)
+        self.key = os.urandom(16)
+
+    def test_allchecks(self):
+        for check in unipacket.CHECK_LENGTHS:
+            key = self.key if check == unipacket.CHECK_HMAC else None
+            pkt = unipacket.Unipacket(check, key)
+            msg = pkt.buildpacket(self.network_id, self.device_id,
+                                  self.sequence, self.payload)
+            ret_pkt = pkt.recoverpacket(msg)
+            self.assertEqual(check, ret_pkt.Flags & unipacket.CHECK_MASK,
+                             "Incorrect check type")
+            self.assertEqual(self.payload, ret_pkt.Payload, "Incorrect Payload")
+
+            # any receiver can verify an unkeyed check
+            ret_pkt = unipacket.Unipacket().recoverpacket(msg)
+            if check == unipacket.CHECK_HMAC:
+                self.assertEqual(ret_pkt, None, "HMAC verified with no key")
+            else:
+                self.assertEqual(self.payload, ret_pkt.Payload,
+                                 "Incorrect Payload")
+
+            # and corruption is caught
+            bad_msg = msg[:3] + bytes([msg[3] % 255 + 1]) + msg[3+1:]
+            self.assertEqual(pkt.recoverpacket(bad_msg), None, "Bad check")
+
+    def test_buildpacketsallchecks(self):
+        device_ids = [self.device_id, 1, 32]
+        for check in unipacket.CHECK_LENGTHS:
+            key = self.key if check == unipacket.CHECK_HMAC else None
+            pkt = unipacket.Unipacket(check, key)
+            for net_id in (self.network_id,
+                           self.network_id[:unipacket.TOKEN_LENGTH]):
+                msgs = pkt.buildpackets(net_id, device_ids, self.sequence,
+                                        self.payload)
+                for (dev_id, msg) in zip(device_ids, msgs):
+                    self.assertEqual(msg, pkt.buildpacket(net_id, dev_id,
+                                                          self.sequence,
+                                                          self.payload),
+                                     "Incorrect packet for DeviceID")
+
+    def test_hmacwrongkey(self):
+        pkt = unipacket.Unipacket(unipacket.CHECK_HMAC, self.key)
+        msg = pkt.buildpacket(self.network_id, self.device_id,
+                              self.sequence, self.payload)
+        other = unipacket.Unipacket(unipacket.CHECK_HMAC, os.urandom(16))
+        self.assertEqual(other.recoverpacket(msg), None, "Wrong key accepted")
+        self.assertEqual(other.recoverpacket_into(msg, other.newbuffer()), None,
+                         "Wrong key accepted")
+
+    def test_hmacnokey(self):
+        with self.assertRaises(ValueError):
+            unipacket.Unipacket(unipacket.CHECK_HMAC)
+        with self.assertRaises(ValueError):
+            unipacket.Unipacket(accept=[unipacket.CHECK_HMAC])
+
+    def test_hmacforged(self):
+        # anyone can make an unkeyed check value, so a keyed receiver
+        # doesn't accept them
+        pkt = unipacket.Unipacket(unipacket.CHECK_HMAC, self.key)
+        for check in (unipacket.CHECK_SHA256, unipacket.CHECK_CRC32,
+                      unipacket.CHECK_BLAKE2S):
+            msg = unipacket.Unipacket(check).buildpacket(
+                self.network_id, self.device_id, self.sequence, self.payload)
+            self.assertEqual(pkt.recoverpacket(msg), None, "Forgery accepted")
+            self.assertEqual(pkt.recoverpacket_into(msg, pkt.newbuffer()),
+                             None, "Forgery accepted")
+            self.assertEqual(pkt.recoverheader(msg), None, "Forgery accepted")
+            self.assertEqual(pkt.recoverpacket_ref(msg), None,
+                             "Forgery accepted")
+
+    def test_accept(self):
+        pkt = unipacket.Unipacket(unipacket.CHECK_CRC32,
+                                  accept=[unipacket.CHECK_CRC32])
+        msg = unipacket.Unipacket().buildpacket(
+            self.network_id, self.device_id, self.sequence, self.payload)
+        self.assertEqual(pkt.recoverpacket(msg), None, "SHA256 accepted")
+        msg = pkt.buildpacket(self.network_id, self.device_id,
+                              self.sequence, self.payload)
+        self.assertEqual(pkt.recoverpacket(msg).Payload, self.payload,
+                         "CRC32 not accepted")
+        with self.assertRaises(ValueError):
+            unipacket.Unipacket(accept=[6])
+
+    def test_badcheck(self):
+        with self.assertRaises(ValueError):
+            unipacket.Unipacket(6)
+
+    def test_badversion(self):
+        pkt = unipacket.Unipacket(unipacket.CHECK_CRC32)
+        raw = bytearray(cobsr.decode(pkt.buildpacket(
+            self.network_id, self.device_id, self.sequence, self.payload)[1:-1]))
+        # a newer version, with a valid check value
+        raw[0] = 0x80 | unipacket.CHECK_CRC32
+        raw[-4:] = pkt.makecheck(unipacket.CHECK_CRC32, bytes(raw[:-4]))
+        msg = b'\x00' + cobsr.encode(bytes(raw)) + b'\x00'
+        self.assertEqual(pkt.recoverpacket(msg), None, "Bad version accepted")
+
+    def test_buildpackets(self):
+        device_ids = [self.device_id, 1, 32, -64, 64]
+        for check in unipacket.CHECK_LENGTHS:
+            pkt = unipacket.Unipacket(check, self.key)
+            msgs = pkt.buildpackets(self.network_id, device_ids,
+                                    self.sequence, self.payload)
+            for (dev_id, msg) in zip(device_ids, msgs):
+                self.assertEqual(msg, pkt.buildpacket(self.network_id, dev_id,
+                                                      self.sequence,
+                                                      self.payload),
+                                 "Incorrect packet for DeviceID")
+
+
+class UnipacketTokenTestCase(unittest.TestCase):
+    """Tests of the compact header, with a session token"""
+    def setUp(self):
+        self.pkt = unipacket.Unipacket()
+        self.device_id = random.randint(-64, 64)
+        self.token = os.urandom(unipacket.TOKEN_LENGTH)
+        self.sequence = random.randint(0, 10000)
+        self.payload = os.urandom(16)
+        self.msg = self.pkt.buildpacket(self.token, self.device_id,
+                                        self.sequence, self.payload)
+
+    def test_smaller(self):
+        msg = self.pkt.buildpacket(os.urandom(32), self.device_id,
+                                   self.sequence, self.payload)
+        self.assertLess(len(self.msg), len(msg) - 25, "Header not smaller")
+
+    def test_recover(self):
+        ret_pkt = self.pkt.recoverpacket(self.msg)
+        self.assertTrue(ret_pkt.Flags & unipacket.FLAG_TOKEN, "Incorrect Flags")
+        self.assertEqual(self.token, ret_pkt.NetworkID, "Incorrect token")
+        self.assertEqual(self.device_id, ret_pkt.DeviceID, "Incorrect DeviceID")
+        self.assertEqual(self.sequence, ret_pkt.Sequence, "Incorrect Sequence")
+        self.assertEqual(self.payload, ret_pkt.Payload, "Incorrect Payload")
+
+    def test_recoverinto(self):
+        view = self.pkt.recoverpacket_into(self.msg, self.pkt.newbuffer())
+        self.assertEqual(self.token, view.NetworkID, "Incorrect token")
+        self.assertEqual(self.device_id, view.DeviceID, "Incorrect DeviceID")
+        self.assertEqual(self.sequence, view.Sequence, "Incorrect Sequence")
+        self.assertEqual(self.payload, view.Payload, "Incorrect Payload")
+
+    def test_recoverheader(self):
+        hdr = self.pkt.recoverheader(self.msg)
+        self.assertEqual(self.token, hdr.NetworkID, "Incorrect token")
+        self.assertEqual(self.device_id, hdr.DeviceID, "Incorrect DeviceID")
+        self.assertEqual(len(self.payload), hdr.Payload_length,
+                         "Incorrect Payload_length")
+
+    def test_buildpackets(self):
+        device_ids = [self.device_id, 1, 32, -64, 64]
+        for check in unipacket.CHECK_LENGTHS:
+            pkt = unipacket.Unipacket(check, os.urandom(16))
+            msgs = pkt.buildpackets(self.token, device_ids, self.sequence,
+                                    self.payload)
+            for (dev_id, msg) in zip(device_ids, msgs):
+                self.assertEqual(msg, pkt.buildpacket(self.token, dev_id,
+                                                      self.sequence,
+                                                      self.payload),
+                                 "Incorrect packet for DeviceID")
+
+    def test_badtoken(self):
+        msg = self.pkt.buildpacket(os.urandom(5), self.device_id,
+                                   self.sequence, self.payload)
+        self.assertEqual(msg, None, "Bad token")
+
+
+class UnipacketReferenceTestCase(unittest.TestCase):
+    """Differential tests of the fast codec against the reference
+    construct definition"""
+    def setUp(self):
+        key = os.urandom(16)
+        self.pkts = [unipacket.Unipacket(check, key,
+                                         accept=unipacket.CHECK_LENGTHS)
+                     for check in unipacket.CHECK_LENGTHS]
+
+    def makefields(self):
+        return (os.urandom(random.choice([32, unipacket.TOKEN_LENGTH])),
+                random.randint(-64, 64),
+                random.randint(0, 65535),
+                os.urandom(random.randint(1, self.pkts[0].maxPayloadSize())))
+
+    def test_buildmatchesref(self):
+        for i in range(0, 500):
+            pkt = random.choice(self.pkts)
+            fields = self.makefields() + (random.choice(
+                [0, unipacket.FLAG_COALESCED, unipacket.FLAG_COMPRESSED]),)
+            self.assertEqual(pkt.buildpacket(*fields),
+                             pkt.buildpacket_ref(*fields),
+                             "Fast and reference packets differ")
+
+    def test_recovermatchesref(self):
+        for i in range(0, 500):
+            pkt = random.choice(self.pkts)
+            msg = pkt.buildpacket_ref(*self.makefields())
+            ret_pkt = pkt.recoverpacket(msg)
+            ref_pkt = pkt.recoverpacket_ref(msg)
+            self.assertEqual(ret_pkt.Flags, ref_pkt.Flags, "Incorrect Flags")
+            self.assertEqual(ret_pkt.NetworkID, ref_pkt.NetworkID,
+                             "Incorrect NetworkID")
+            self.assertEqual(ret_pkt.DeviceID, ref_pkt.DeviceID,
+                             "Incorrect DeviceID")
+            self.assertEqual(ret_pkt.Sequence, ref_pkt.Sequence,
+                             "Incorrect Sequence")
+            self.assertEqual(ret_pkt.Payload_length, ref_pkt.Payload_length,
+                             "Incorrect Payload_length")
+            self.assertEqual(ret_pkt.Payload, ref_pkt.Payload,
+                             "Incorrect Payload")
+
+    def test_corruptmatchesref(self):
+        for i in range(0, 500):
+            pkt = random.choice(self.pkts)
+            msg = bytearray(pkt.buildpacket(*self.makefields()))
+            # corrupt a single (non-delimiter) byte
+            pos = random.randint(1, len(msg) - 2)
+            msg[pos] = random.randint(1, 255)
+            msg = bytes(msg)
+            try:
+                ref_pkt = pkt.recoverpacket_ref(msg)
+            except Exception:
+                ref_pkt = None
+            ret_pkt = pkt.recoverpacket(msg)
+            self.assertEqual(ret_pkt is None, ref_pkt is None,
+                             "Fast and reference disagree on corruption")
+
 if __name__ == '__main__':
     unittest.main()
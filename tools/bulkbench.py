@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Benchmark decoding a capture of packets
+#  Compares the bulk decoder to decoding each packet in turn
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+import os
+import random
+import time
+
+# Via pip
+
+# in this repo
+from TelemXnet import unipacket
+from TelemXnet import bulkdecode
+
+
+def framerate(func, frames, number):
+    """Return the number of frames/sec decoded by func(), which decodes
+    number of frames"""
+    best = None
+    for i in range(0, 3):
+        start = time.perf_counter()
+        func()
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return int(number / best)
+
+if __name__ == '__main__':
+    pkt = unipacket.Unipacket(unipacket.CHECK_CRC32)
+    network_id = os.urandom(32)
+    number = 200000
+    ref_number = 5000
+
+    # a capture of telemetry sized packets
+    frames = [pkt.buildpacket(network_id, random.randint(1, 63), i % 65536,
+                              os.urandom(random.randint(8, 64)))
+              for i in range(0, number)]
+    capture = b''.join(frames)
+    print("Capture of " + str(number) + " frames, " + str(len(capture)) +
+          " bytes")
+
+    decoder = bulkdecode.Bulkdecoder()
+    print("Decoder                       Frames/s")
+    print("recoverpacket_ref (construct) " + str(framerate(
+        lambda: [pkt.recoverpacket_ref(frame) for frame in frames[:ref_number]],
+        frames, ref_number)))
+    print("recoverpacket                 " + str(framerate(
+        lambda: [pkt.recoverpacket(frame) for frame in frames], frames,
+        number)))
+    print("bulk, verified                " + str(framerate(
+        lambda: decoder.decode(capture), frames, number)))
+    print("bulk, not verified            " + str(framerate(
+        lambda: decoder.decode(capture, verify=False), frames, number)))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Benchmark the packet integrity check algorithms
+#  Reports the time and size of each packet for each algorithm
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+import os
+import random
+import timeit
+
+# Via pip
+
+# in this repo
+from TelemXnet import unipacket
+
+
+def nspercall(func, number):
+    """Return the time in ns of a call to func()"""
+    duration = min(timeit.repeat(func, number=number, repeat=3))
+    return int(duration * 1e9 / number)
+
+if __name__ == '__main__':
+    device_id = random.randint(1, 63)
+    network_id = os.urandom(32)
+    sequence = random.randint(0, 10000)
+    key = os.urandom(16)
+
+    print("Check    Payload  Bytes/pkt  Build (ns/pkt)  Recover (ns/pkt)  "
+          "Check only (ns/pkt)")
+    for (name, check) in unipacket.CHECK_NAMES.items():
+        pkt = unipacket.Unipacket(check, key if check == unipacket.CHECK_HMAC else None)
+        for i in [16, 40, 128]:
+            ppayload = os.urandom(i)
+            msg = pkt.buildpacket(network_id, device_id, sequence, ppayload)
+            raw = msg[1:-1]
+
+            build = nspercall(lambda: pkt.buildpacket(network_id, device_id,
+                                                      sequence, ppayload),
+                              50000)
+            recover = nspercall(lambda: pkt.recoverpacket(msg), 50000)
+            check_only = nspercall(lambda: pkt.checkfunc(raw), 50000)
+            print(name.ljust(9) + str(i).ljust(9) + str(len(msg)).ljust(11) +
+                  str(build).ljust(16) + str(recover).ljust(18) +
+                  str(check_only))
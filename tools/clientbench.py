@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Benchmark the client hub engines
+#  Reports the CPU use of a UAS and a GCS Clienthub when idle and when
+#  forwarding packets, the latency from the UAS app to the GCS app, and
+#  the smoothed RTT of the GCS hub's link probes.
+#  The CPU use is read from /proc, so Linux only
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+import argparse
+import os
+import socket
+import struct
+import threading
+import time
+
+# Via pip
+
+# in this repo
+from TelemXnet import clienthub
+from TelemXnet import serverhub
+
+
+def percentile(values, pct):
+    """The pct percentile of a list of values"""
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+def cputime(pid):
+    """The CPU time (sec) used so far by the process pid"""
+    with open("/proc/" + str(pid) + "/stat") as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    # utime and stime, in clock ticks
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def receive(sock, recvtimes, stop):
+    """Record the time each packet is recieved on sock, until stop is
+    set"""
+    while not stop.is_set():
+        try:
+            data = sock.recv(1024)
+        except socket.timeout:
+            continue
+        if len(data) == 8:
+            recvtimes[struct.unpack(">Q", data)[0]] = time.perf_counter()
+
+
+def bench(engine, port, rate, duration):
+    """Run a UAS and a GCS Clienthub with engine, and send rate packets/sec
+    (0 for none) from the UAS app to the GCS app for duration sec.
+    Returns the (CPU % per hub, latencies in sec, packets lost, probe RTT
+    in ms)"""
+    network_id = os.urandom(32)
+    hubs = [clienthub.Clienthub(("127.0.0.1", port + 1), ("127.0.0.1", port),
+                                network_id, 1, engine=engine,
+                                probe_interval=0.1),
+            clienthub.Clienthub(("127.0.0.1", port + 2), ("127.0.0.1", port),
+                                network_id, 32, engine=engine,
+                                probe_interval=0.1)]
+    for hub in hubs:
+        hub.addinterface("127.0.0.1")
+        hub.start()
+    uas = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    gcs = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    gcs.settimeout(0.1)
+    time.sleep(0.5)
+    # the GCS hub only forwards to the GCS app once it's heard from it
+    gcs.sendto(b'hello', ("127.0.0.1", port + 2))
+    time.sleep(0.1)
+    recvtimes = {}
+    stop = threading.Event()
+    receiver = threading.Thread(target=receive, args=(gcs, recvtimes, stop))
+    receiver.start()
+
+    starttimes = [cputime(hub.pid) for hub in hubs]
+    sendtimes = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        if rate:
+            nexttime = start + len(sendtimes) / rate
+            time.sleep(max(0, nexttime - time.perf_counter()))
+            sendtimes.append(time.perf_counter())
+            uas.sendto(struct.pack(">Q", len(sendtimes) - 1),
+                       ("127.0.0.1", port + 1))
+        else:
+            time.sleep(0.1)
+    elapsed = time.perf_counter() - start
+    cpu = sum(cputime(hub.pid) - starttime
+              for (hub, starttime) in zip(hubs, starttimes))
+    probertt = hubs[1].getlinkstats()[0]['rtt']
+    time.sleep(0.1)
+
+    stop.set()
+    receiver.join()
+    for hub in hubs:
+        hub.join()
+    uas.close()
+    gcs.close()
+    latencies = [recvtimes[i] - sendtime
+                 for (i, sendtime) in enumerate(sendtimes) if i in recvtimes]
+    return (cpu / len(hubs) / elapsed * 100, latencies,
+            len(sendtimes) - len(latencies), probertt)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", help="The server port", type=int,
+                        default=16270)
+    parser.add_argument("--rate", help="Packets/sec to send", type=int,
+                        default=500)
+    parser.add_argument("--duration", help="Seconds per test", type=float,
+                        default=5)
+    args = parser.parse_args()
+
+    srv = serverhub.ServerHub(portin=args.port, engine='asyncio')
+    srv.run()
+    print("Engine     Packets/s  CPU/hub (%)  p50 (us)  p99 (us)  Lost  "
+          "Probe RTT (ms)")
+    for engine in ['threaded', 'selector']:
+        for rate in [0, args.rate]:
+            (cpu, latencies, lost, probertt) = bench(engine, args.port, rate,
+                                                     args.duration)
+            if latencies:
+                p50 = str(int(percentile(latencies, 50) * 1e6))
+                p99 = str(int(percentile(latencies, 99) * 1e6))
+            else:
+                p50 = p99 = "-"
+            print(engine.ljust(11) + str(rate).ljust(11) +
+                  str(round(cpu, 1)).ljust(13) + p50.ljust(10) +
+                  p99.ljust(10) + str(lost).ljust(6) +
+                  str(probertt and round(probertt, 2)))
+    srv.close()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Benchmark the packet encoder/decoder
+#  Compares the fast struct based codec against the reference
+#  construct definition
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+import os
+import random
+import timeit
+
+# Via pip
+
+# in this repo
+from TelemXnet import unipacket
+
+
+def packetrate(func, args, number):
+    """Return the number of calls/sec of func(*args)"""
+    duration = min(timeit.repeat(lambda: func(*args), number=number, repeat=3))
+    return int(number / duration)
+
+if __name__ == '__main__':
+    pkt = unipacket.Unipacket()
+    device_id = random.randint(1, 60)
+    network_id = os.urandom(32)
+    sequence = random.randint(0, 10000)
+    rxbuf = pkt.newbuffer()
+
+    print("Payload  Codec      Build (pkt/s)  Recover (pkt/s)")
+    for i in [8, 16, 32, 64, 128, pkt.maxPayloadSize()]:
+        ppayload = os.urandom(i)
+        msg = pkt.buildpacket(network_id, device_id, sequence, ppayload)
+
+        for (name, build, recover, number) in [
+                ("construct", pkt.buildpacket_ref, pkt.recoverpacket_ref, 2000),
+                ("struct", pkt.buildpacket, pkt.recoverpacket, 50000),
+                ("into", pkt.buildpacket,
+                 lambda m: pkt.recoverpacket_into(m, rxbuf), 50000),
+                ("header", pkt.buildpacket, pkt.recoverheader, 50000)]:
+            buildrate = packetrate(build, (network_id, device_id, sequence,
+                                           ppayload), number)
+            recoverrate = packetrate(recover, (msg,), number)
+            print(str(i).ljust(9) + name.ljust(11) + str(buildrate).ljust(15) +
+                  str(recoverrate))
+
+    # encoding the same payload for several interfaces
+    print("")
+    print("Ifaces   buildpacket (us)  buildpackets (us)")
+    ppayload = os.urandom(32)
+    for i in range(1, 5):
+        device_ids = list(range(device_id, device_id + i))
+        single = 1e6 / packetrate(lambda: [pkt.buildpacket(network_id, dev_id,
+                                                          sequence, ppayload)
+                                           for dev_id in device_ids],
+                                  (), 20000)
+        multi = 1e6 / packetrate(pkt.buildpackets, (network_id, device_ids,
+                                                    sequence, ppayload), 20000)
+        print(str(i).ljust(9) + str(round(single, 2)).ljust(18) +
+              str(round(multi, 2)))
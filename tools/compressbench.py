@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Benchmark payload compression
+#  Reports the compression ratio and CPU cost with and without a
+#  preset dictionary. Uses a MAVLink capture if given, otherwise
+#  synthetic telemetry
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+import math
+import os
+import struct
+import sys
+import timeit
+
+# Via pip
+
+# in this repo
+from TelemXnet import unipacket
+import zdictbuild
+
+
+def synthframes(number):
+    """Returns a list of number MAVLink v1 frames that look like a
+    typical telemetry stream (heartbeat, attitude, position, HUD,
+    status)"""
+    # (msgid, struct format, rate divider)
+    msgs = [(0, "<IBBBBB", 10), (1, "<IIIHHhHHHHHHb", 10), (30, "<Iffffff", 1),
+            (33, "<IiiiihhhH", 2), (74, "<ffffhH", 2)]
+    frames = []
+    seq = 0
+    tick = 0
+    while len(frames) < number:
+        tick += 1
+        t = tick * 0.02
+        for (msg, fmt, div) in msgs:
+            if tick % div != 0:
+                continue
+            if msg == 0:
+                payload = struct.pack(fmt, 0, 2, 3, 81, 4, 3)
+            elif msg == 1:
+                payload = struct.pack(fmt, 0x3F, 0x3F, 0x3F, 250,
+                                      12150 - tick % 50, -1, 0, 0, 0, 0, 0,
+                                      0, 87)
+            elif msg == 30:
+                payload = struct.pack(fmt, tick * 20, 0.05 * math.sin(t),
+                                      0.03 * math.cos(t), t % 6.28,
+                                      0.01, -0.02, 0.005)
+            elif msg == 33:
+                payload = struct.pack(fmt, tick * 20, -353632000 + tick,
+                                      1491652000 + tick, 584000, 20000,
+                                      120, -35, 0, 9000)
+            else:
+                payload = struct.pack(fmt, 12.5, 12.7, 90, 20.0, 50, 0)
+            frame = bytes([0xFE, len(payload), seq % 256, 1, 1, msg]) + payload
+            frames.append(frame + os.urandom(2))
+            seq += 1
+    return frames[:number]
+
+
+def nspercall(func, number):
+    """Return the time in ns of a call to func()"""
+    duration = min(timeit.repeat(func, number=number, repeat=3))
+    return int(duration * 1e9 / number)
+
+
+def report(name, pkt, payloads):
+    """Print the size and CPU cost of compressing the payloads"""
+    flags = unipacket.FLAG_COMPRESSED
+    results = [pkt.compresspayload(payload, flags) for payload in payloads]
+    ratio = (sum(len(payload) for payload in payloads) /
+             sum(len(payload) for (payload, ret_flags) in results))
+    # payloads that got smaller
+    compressed = [payload for (payload, ret_flags) in results
+                  if ret_flags & flags]
+    comp = nspercall(lambda: [pkt.compresspayload(payload, flags)
+                              for payload in payloads], 20) // len(payloads)
+    decomp = nspercall(lambda: [pkt.decompresspayload(payload)
+                                for payload in compressed],
+                       20) // max(len(compressed), 1)
+    print(name.ljust(24) + str(round(ratio, 2)).ljust(8) +
+          str(int(len(compressed) * 100 / len(payloads))).ljust(13) +
+          str(comp).ljust(19) + str(decomp))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'rb') as f:
+            frames = zdictbuild.mavframes(f.read())
+    else:
+        frames = synthframes(4000)
+
+    # train on the first half, test on the second
+    train = frames[:len(frames) // 2]
+    test = frames[len(frames) // 2:]
+    zdict = zdictbuild.builddict(train)
+    print("Frames: " + str(len(test)) + ", dictionary: " + str(len(zdict)) +
+          " bytes")
+
+    # one frame per payload, and coalesced frames
+    plain_pkt = unipacket.Unipacket()
+    coalesced = []
+    payload = b''
+    for frame in test:
+        if len(payload) + 1 + len(frame) > plain_pkt.maxPayloadSize():
+            coalesced.append(payload)
+            payload = b''
+        payload += bytes([len(frame)]) + frame
+
+    print("Compression             Ratio   Smaller (%)  Compress (ns/pkt)  "
+          "Decompress (ns/pkt)")
+    report("no dict, single", unipacket.Unipacket(), test)
+    report("trained dict, single", unipacket.Unipacket(zdict=zdict), test)
+    report("no dict, coalesced", unipacket.Unipacket(), coalesced)
+    report("trained dict, coalesced", unipacket.Unipacket(zdict=zdict),
+           coalesced)
+
+    # the cost of a whole packet
+    network_id = os.urandom(32)
+    pkt = unipacket.Unipacket(zdict=zdict)
+    rxbuf = pkt.newbuffer()
+    print("Packet      Bytes/pkt  Build (ns/pkt)  Recover (ns/pkt)")
+    for (name, flags) in [("plain", 0),
+                          ("compressed", unipacket.FLAG_COMPRESSED)]:
+        msgs = [pkt.buildpacket(network_id, 1, 0, payload, flags)
+                for payload in test]
+        build = nspercall(lambda: [pkt.buildpacket(network_id, 1, 0, payload,
+                                                   flags)
+                                   for payload in test], 10) // len(test)
+        recover = nspercall(lambda: [pkt.recoverpacket_into(msg, rxbuf)
+                                     for msg in msgs], 10) // len(test)
+        print(name.ljust(12) +
+              str(sum(len(msg) for msg in msgs) // len(msgs)).ljust(11) +
+              str(build).ljust(16) + str(recover))
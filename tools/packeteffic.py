@@ -35,11 +35,16 @@ if __name__ == '__main__':
     pkt = unipacket.Unipacket()
     device_id = random.randint(-64, 64)
     network_id = os.urandom(32)
+    token = os.urandom(unipacket.TOKEN_LENGTH)
     sequence = random.randint(0, 10000)
-    
+
+    print("Full header (NetworkID) vs compact header (session token)")
     for i in [8, 16, 32, 64, 128, 255]:
         ppayload = os.urandom(i)
         msg = pkt.buildpacket(network_id, device_id, sequence, ppayload)
+        msg_token = pkt.buildpacket(token, device_id, sequence, ppayload)
         efficiency = int(len(ppayload)*100 / len(msg))
+        efficiency_token = int(len(ppayload)*100 / len(msg_token))
         print("Eff of Payload=" + str(len(ppayload)) + " Packet=" + str(len(msg)) +
-              " is " + str(efficiency) + "%")
+              " is " + str(efficiency) + "%, compact Packet=" +
+              str(len(msg_token)) + " is " + str(efficiency_token) + "%")
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Benchmark the rejection of junk datagrams by the server
+#  Reports the time to reject each kind of junk by decoding it, with the
+#  prechecks first, through the whole Router and once its source is
+#  blocked
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+# Default python libs
+import os
+import time
+import timeit
+
+# Via pip
+
+# in this repo
+from TelemXnet import devicedict
+from TelemXnet import ratelimit
+from TelemXnet import serverhub
+from TelemXnet import unipacket
+
+
+def nsperpacket(func, datagrams):
+    """Return the time in ns of func(datagram), per datagram"""
+    duration = min(timeit.repeat(lambda: [func(datagram)
+                                          for datagram in datagrams],
+                                 number=1, repeat=5))
+    return int(duration * 1e9 / len(datagrams))
+
+
+def decode(pkt, buf, datagram):
+    """Reject a datagram by decoding it, as the server did before it had
+    prechecks"""
+    if pkt.recoverheader(datagram):
+        pkt.recoverpacket_into(datagram, buf)
+
+
+def precheck(pkt, buf, datagram):
+    """Reject a datagram as the server does now, with the prechecks
+    first"""
+    if pkt.precheck(datagram) and pkt.recoverheader(datagram):
+        pkt.recoverpacket_into(datagram, buf)
+
+
+def makejunk(pkt, number):
+    """Returns {kind: list of number junk datagrams}"""
+    network_id = os.urandom(32)
+    valid = [pkt.buildpacket(network_id, 1, i, os.urandom(64))
+             for i in range(0, number)]
+    # a byte in the middle of the payload changed, so only the check value
+    # is wrong
+    corrupt = [msg[:60] + bytes([msg[60] % 255 + 1]) + msg[61:]
+               for msg in valid]
+    return {"random bytes": [os.urandom(100) for i in range(0, number)],
+            "framed random": [b'\x00' + os.urandom(100).replace(b'\x00',
+                                                                b'\x01') +
+                              b'\x00' for i in range(0, number)],
+            "truncated": [msg[:40] + b'\x00' for msg in valid],
+            "bad check": corrupt}
+
+if __name__ == '__main__':
+    pkt = unipacket.Unipacket()
+    buf = pkt.newbuffer()
+    address = ("10.0.0.1", 5000)
+    router = serverhub.Router(db=devicedict.Devicedict())
+    blocklist = ratelimit.Blocklist()
+    blocked = serverhub.Router(db=devicedict.Devicedict(),
+                               blocklist=blocklist)
+    blocklist.blocked[address] = time.perf_counter() + 3600
+
+    # times in ns/packet. The Router has a fixed cost per packet for the
+    # metrics
+    print("Junk             Decode    Precheck  Router    Blocked")
+    for (kind, datagrams) in makejunk(pkt, 2000).items():
+        print(kind.ljust(17) +
+              str(nsperpacket(lambda datagram: decode(pkt, buf, datagram),
+                              datagrams)).ljust(10) +
+              str(nsperpacket(lambda datagram: precheck(pkt, buf, datagram),
+                              datagrams)).ljust(10) +
+              str(nsperpacket(lambda datagram: router.handle(
+                  datagram, address, None), datagrams)).ljust(10) +
+              str(nsperpacket(lambda datagram: blocked.handle(
+                  datagram, address, None), datagrams)))
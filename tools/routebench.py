@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Benchmark the server routing table
+#  Reports the lookup rate and memory per route of Devicedict with many
+#  registered networks
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+import argparse
+import os
+import random
+import timeit
+import tracemalloc
+
+# Via pip
+
+# in this repo
+from TelemXnet import devicedict
+
+
+def fill(db, networks):
+    """Register a UAS and GCS on each of networks networks. Returns the
+    tokens"""
+    tokens = []
+    for i in range(0, networks):
+        token = db.newtoken(os.urandom(32))
+        db.addremote(token, 1, "10.0.0.1", 20000 + i % 40000, 1)
+        db.addremote(token, 32, "10.0.0.2", 20000 + i % 40000, 1)
+        tokens.append(token)
+    return tokens
+
+
+def lookuprate(func, tokens):
+    """Return the number of lookups/sec of func(token)"""
+    duration = min(timeit.repeat(lambda: [func(token) for token in tokens],
+                                 number=1, repeat=3))
+    return int(len(tokens) / duration)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--networks", help="Number of networks", type=int,
+                        default=100000)
+    parser.add_argument("--lookups", help="Number of lookups", type=int,
+                        default=200000)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    db = devicedict.Devicedict()
+    tokens = fill(db, args.networks)
+    # the tokens list is the caller's, not the table's
+    used = tracemalloc.get_traced_memory()[0] - tokens.__sizeof__()
+    tracemalloc.stop()
+    print("Networks: " + str(args.networks) + ", routes: " +
+          str(args.networks * 2))
+    print("Memory: " + str(used // (args.networks * 2)) + " bytes/route")
+
+    # packets arrive with a new token object each time
+    hits = [bytes(bytearray(token)) for token in
+            random.choices(tokens, k=args.lookups)]
+    misses = [os.urandom(4) for i in range(0, args.lookups)]
+    print("Lookup            Lookups/s")
+    print("getremote         " + str(lookuprate(
+        lambda token: db.getremote(token, 32), hits)))
+    print("getremote, miss   " + str(lookuprate(
+        lambda token: db.getremote(token, 32), misses)))
+    print("getcheck          " + str(lookuprate(
+        lambda token: db.getcheck(token, 1), hits)))
+    print("getpeers          " + str(lookuprate(
+        lambda token: db.getpeers(token, devicedict.GCS_SIDE), hits)))
+    print("getnetwork        " + str(lookuprate(db.getnetwork, hits)))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Benchmark the server engines
+#  Reports the forwarded packets/sec, forwarding latency and syscalls
+#  per packet of the engines of ServerHub
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+import argparse
+import os
+import socket
+import time
+
+# Via pip
+
+# in this repo
+from TelemXnet import unipacket
+from TelemXnet import batchio
+from TelemXnet import serverhub
+
+
+def percentile(values, pct):
+    """The pct percentile of a list of values"""
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+def bench(engine, port, number, window, fanout, native=None):
+    """Forward number packets from a UAS to fanout GCS clients through a
+    server running engine, with up to window packets in flight. native
+    is passed to the Batchsocket of the batched engine. Returns the
+    (packets/sec, latencies in sec, packets lost, syscalls/packet)"""
+    srv = serverhub.ServerHub(portin=port, engine=engine)
+    if engine == 'batched':
+        srv.batchsock = batchio.Batchsocket(srv.sock, native=native)
+    srv.run()
+    time.sleep(0.1)
+
+    pkt = unipacket.Unipacket(unipacket.CHECK_CRC32)
+    network_id = os.urandom(32)
+    uas = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    gcss = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            for i in range(0, fanout)]
+    address = ("127.0.0.1", port)
+    uas.sendto(pkt.buildpacket(network_id, -1, 0, b'CL_BEGIN'), address)
+    for (i, gcs) in enumerate(gcss):
+        gcs.settimeout(0.5)
+        gcs.sendto(pkt.buildpacket(network_id, -32 - i, 0, b'CL_BEGIN'),
+                   address)
+    time.sleep(0.1)
+    calls = srv.batchsock.calls if engine == 'batched' else 0
+
+    msgs = [pkt.buildpacket(network_id, 1, i % 65536, os.urandom(32))
+            for i in range(0, number)]
+    sendtimes = {}
+    latencies = []
+    lost = 0
+    start = time.perf_counter()
+    for i in range(0, number, window):
+        batch = msgs[i:i + window]
+        for msg in batch:
+            sendtimes[msg] = time.perf_counter()
+            uas.sendto(msg, address)
+        for gcs in gcss:
+            for msg in batch:
+                try:
+                    data = gcs.recv(1024)
+                except socket.timeout:
+                    lost += 1
+                    continue
+                latencies.append(time.perf_counter() - sendtimes[data])
+    duration = time.perf_counter() - start
+    if engine == 'batched':
+        syscalls = (srv.batchsock.calls - calls) / number
+    else:
+        # a recvfrom, and a sendto per destination
+        syscalls = 1 + fanout
+
+    uas.sendto(pkt.buildpacket(network_id, -1, 0, b'CL_END'), address)
+    for (i, gcs) in enumerate(gcss):
+        gcs.sendto(pkt.buildpacket(network_id, -32 - i, 0, b'CL_END'),
+                   address)
+    time.sleep(0.1)
+    uas.close()
+    for gcs in gcss:
+        gcs.close()
+    srv.close()
+    return (int(number / duration), latencies, lost, syscalls)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", help="The server port", type=int,
+                        default=16260)
+    parser.add_argument("--number", help="Packets to send", type=int,
+                        default=20000)
+    parser.add_argument("--window", help="Max packets in flight", type=int,
+                        default=32)
+    parser.add_argument("--fanout", help="Number of GCS clients", type=int,
+                        default=1)
+    args = parser.parse_args()
+
+    print("Engine            Packets/s  p50 (us)  p99 (us)  Lost  "
+          "Syscalls/pkt")
+    for (name, engine, native) in [("threaded", 'threaded', None),
+                                   ("asyncio", 'asyncio', None),
+                                   ("batched, fallback", 'batched', False),
+                                   ("batched, mmsg", 'batched', True)]:
+        if native and not batchio.HAVE_MMSG:
+            continue
+        (pps, latencies, lost, syscalls) = bench(engine, args.port,
+                                                 args.number, args.window,
+                                                 args.fanout, native)
+        print(name.ljust(18) + str(pps).ljust(11) +
+              str(int(percentile(latencies, 50) * 1e6)).ljust(10) +
+              str(int(percentile(latencies, 99) * 1e6)).ljust(10) +
+              str(lost).ljust(6) + str(round(syscalls, 2)))
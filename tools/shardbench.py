@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Benchmark the sharded server
+#  Reports the forwarded packets/sec of ShardedServerHub from 1 to N
+#  worker processes, with many clients sending at once
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+import argparse
+import multiprocessing
+import os
+import socket
+import time
+
+# Via pip
+
+# in this repo
+from TelemXnet import unipacket
+from TelemXnet import serverhub
+
+
+def client(port, duration, window):
+    """Forward packets from a UAS to a GCS of a new network for duration
+    seconds, with up to window packets in flight. Returns the number of
+    packets forwarded"""
+    pkt = unipacket.Unipacket(unipacket.CHECK_CRC32)
+    network_id = os.urandom(32)
+    uas = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    gcs = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    gcs.settimeout(0.5)
+    address = ("127.0.0.1", port)
+    uas.sendto(pkt.buildpacket(network_id, -1, 0, b'CL_BEGIN'), address)
+    gcs.sendto(pkt.buildpacket(network_id, -32, 0, b'CL_BEGIN'), address)
+    time.sleep(0.2)
+
+    msgs = [pkt.buildpacket(network_id, 1, i, os.urandom(32))
+            for i in range(0, window)]
+    forwarded = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        for msg in msgs:
+            uas.sendto(msg, address)
+        try:
+            for msg in msgs:
+                gcs.recv(1024)
+                forwarded += 1
+        except socket.timeout:
+            pass
+
+    uas.sendto(pkt.buildpacket(network_id, -1, 0, b'CL_END'), address)
+    gcs.sendto(pkt.buildpacket(network_id, -32, 0, b'CL_END'), address)
+    uas.close()
+    gcs.close()
+    return forwarded
+
+
+def bench(workers, engine, port, clients, duration, window):
+    """Returns the packets/sec forwarded by a server of workers worker
+    processes"""
+    srv = serverhub.ShardedServerHub(portin=port, engine=engine,
+                                     workers=workers)
+    srv.run()
+    with multiprocessing.get_context('fork').Pool(clients) as pool:
+        forwarded = pool.starmap(client, [(port, duration, window)] * clients)
+    srv.close()
+    return int(sum(forwarded) / duration)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", help="The server port", type=int,
+                        default=16260)
+    parser.add_argument("--workers", help="Max number of workers", type=int,
+                        default=os.cpu_count())
+    parser.add_argument("--engine", help="The engine of each worker",
+                        choices=['threaded', 'asyncio'], default='asyncio')
+    parser.add_argument("--clients", help="Number of clients sending at once",
+                        type=int, default=16)
+    parser.add_argument("--duration", help="Seconds per run", type=float,
+                        default=3)
+    parser.add_argument("--window", help="Max packets in flight per client",
+                        type=int, default=16)
+    args = parser.parse_args()
+
+    print("CPUs: " + str(os.cpu_count()) + ", clients: " + str(args.clients))
+    print("Workers  Packets/s")
+    for workers in range(1, args.workers + 1):
+        print(str(workers).ljust(9) +
+              str(bench(workers, args.engine, args.port, args.clients,
+                        args.duration, args.window)))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Build a preset compression dictionary from a MAVLink capture
+#  The dictionary is used for FLAG_COMPRESSED payloads in Unipacket
+#
+#  Copyright 2017 Stephen Dade <stephen_dade@hotmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# Default python libs
+import argparse
+import collections
+
+# Via pip
+
+# in this repo
+
+
+def mavframes(data):
+    """Split a raw MAVLink v1/v2 stream (or a .tlog) into a list of
+    frames. Anything that isn't a frame, such as tlog timestamps, is
+    skipped. The frame CRCs are not checked"""
+    frames = []
+    pos = 0
+    while pos < len(data) - 1:
+        if data[pos] == 0xFE:
+            # v1 - magic, len, seq, sys, comp, msgid, payload, crc
+            end = pos + data[pos + 1] + 8
+        elif data[pos] == 0xFD and pos + 2 < len(data):
+            # v2 - as v1 but with incompat/compat flags, a 3 byte msgid
+            # and an optional signature
+            end = pos + data[pos + 1] + 12
+            if data[pos + 2] & 0x01:
+                end += 13
+        else:
+            pos += 1
+            continue
+        if end > len(data):
+            break
+        frames.append(data[pos:end])
+        pos = end
+    return frames
+
+
+def msgid(frame):
+    """The MAVLink message ID of a frame"""
+    if frame[0] == 0xFE:
+        return frame[5]
+    return int.from_bytes(frame[7:10], byteorder='little')
+
+
+def builddict(frames, size=4096):
+    """Returns a preset dictionary of up to size bytes for the frames.
+    This is the latest frame of each message type, with the most common
+    types at the end of the dictionary (where deflate can reach them with
+    the shortest distances)"""
+    counts = collections.Counter()
+    latest = {}
+    for frame in frames:
+        counts[msgid(frame)] += 1
+        latest[msgid(frame)] = frame
+
+    zdict = b''
+    for (msg, count) in counts.most_common():
+        if len(zdict) + len(latest[msg]) > size:
+            break
+        zdict = latest[msg] + zdict
+    return zdict
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture", help="Raw MAVLink stream or .tlog file")
+    parser.add_argument("zdict", help="Dictionary file to write")
+    parser.add_argument("--size", help="Max size of the dictionary (bytes)",
+                        type=int, default=4096)
+    args = parser.parse_args()
+
+    with open(args.capture, 'rb') as f:
+        frames = mavframes(f.read())
+    zdict = builddict(frames, args.size)
+    with open(args.zdict, 'wb') as f:
+        f.write(zdict)
+    print("Wrote " + str(len(zdict)) + " byte dictionary from " +
+          str(len(frames)) + " frames")